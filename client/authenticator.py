@@ -5,17 +5,25 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from download_cache import DownloadCache
 import platform
 import requests
 import zipfile
 import os
-import tempfile
+import json
 import stat
 import subprocess
 import shutil
 
 WAIT_TIMEOUT=30
-CHROMIUM_REPO_BASE_URL = "https://www.googleapis.com/download/storage/v1/b/chromium-browser-snapshots/o/"
+
+# Both can be set to test against a local copy of the snapshot bucket, or to stay on a known build
+CHROMIUM_REPO_BASE_URL = os.environ.get(
+    "CHROMIUM_REPO_BASE_URL",
+    "https://www.googleapis.com/download/storage/v1/b/chromium-browser-snapshots/o/"
+)
+CHROMIUM_VERSION = os.environ.get("CHROMIUM_VERSION", "")
 
 OS_SETTINGS = {
     "windows": {
@@ -155,82 +163,109 @@ class Authenticator:
     def _get_latest_chromium_version(self):
         response = requests.get(CHROMIUM_REPO_BASE_URL+self._get_os_config_value("repo_name")+"%2FLAST_CHANGE?alt=media")
         if response.status_code == 200:
-            return response.text
+            return response.text.strip()
         raise Exception("Failed to fetch latest Chromium version.")
 
 
+    def _installed_path(self):
+        return os.path.join(self._ensure_chromium_path(), "installed.json")
+
+
+    def _get_installed_chromium_version(self):
+        if not os.path.exists(self._installed_path()):
+            return None
+        with open(self._installed_path(), 'r') as file:
+            return json.load(file).get('version')
+
+
+    def _get_chromium_version(self):
+        if CHROMIUM_VERSION != "":
+            return CHROMIUM_VERSION
+        return self._get_latest_chromium_version()
+
+
+    def _chromium_url(self, version, zip_setting):
+        return CHROMIUM_REPO_BASE_URL+self._get_os_config_value("repo_name")+"%2F"+version+"%2F"+self._get_os_config_value(zip_setting)+"?alt=media"
+
+
     def _extract_chromium(self, file_name, extract_as):
-        temp_dir = tempfile.mkdtemp()
-        base_path = os.path.dirname(file_name)
+        # Unpack next to the destination, so moving it into place is a rename rather than a copy
+        chrome_path = self._ensure_chromium_path()
+        staging_dir = os.path.join(chrome_path, extract_as+".extracting")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
         
         if self._get_os().startswith("mac"):
-            subprocess.run(["unzip", "-q", file_name, "-d", temp_dir], check=True)
+            subprocess.run(["unzip", "-q", file_name, "-d", staging_dir], check=True)
         else:
             with zipfile.ZipFile(file_name, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
+                for member in zip_ref.infolist():
+                    extracted = zip_ref.extract(member, staging_dir)
+                    # zipfile drops the permissions, put the executable bits back
+                    mode = member.external_attr >> 16
+                    if mode != 0 and not member.is_dir():
+                        os.chmod(extracted, mode)
         
-        extracted_dir = next(os.path.join(temp_dir, d) for d in os.listdir(temp_dir) if os.path.isdir(os.path.join(temp_dir, d)))
-        shutil.move(extracted_dir, os.path.join(base_path, extract_as))
-        os.rmdir(temp_dir)
-        os.remove(file_name)
+        extracted_dir = next(os.path.join(staging_dir, d) for d in os.listdir(staging_dir) if os.path.isdir(os.path.join(staging_dir, d)))
+        shutil.rmtree(os.path.join(chrome_path, extract_as), ignore_errors=True)
+        os.replace(extracted_dir, os.path.join(chrome_path, extract_as))
+        shutil.rmtree(staging_dir)
     
     
-    def _download_chromium(self):
+    def _download_chromium(self, version):
         repo_name = self._get_os_config_value("repo_name")
-        version = self._get_latest_chromium_version()
         chrome_path = self._ensure_chromium_path()
+        cache = DownloadCache(os.path.join(chrome_path, "cache"))
 
-        chrome_url = CHROMIUM_REPO_BASE_URL+repo_name+"%2F"+version+"%2F"+self._get_os_config_value("chrome_zip")+"?alt=media"
-        driver_url = CHROMIUM_REPO_BASE_URL+repo_name+"%2F"+version+"%2F"+self._get_os_config_value("driver_zip")+"?alt=media"
-
-        print(f"Downloading Chromium...")
-        response = requests.get(chrome_url, stream=True)
-        file_name = os.path.join(chrome_path, "chromium.zip")
-        with open(file_name, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        print("Downloading Chromium "+version+" and Chrome Driver...")
+        downloads = {}
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for extract_as, zip_setting in [("chromium", "chrome_zip"), ("chromedriver", "driver_zip")]:
+                name = repo_name+"/"+version+"/"+self._get_os_config_value(zip_setting)
+                downloads[executor.submit(cache.fetch, self._chromium_url(version, zip_setting), name)] = extract_as
 
-        print("Extracting files...")
-        self._extract_chromium(file_name, "chromium")
+            # Unpack each zip as soon as it is in, the driver doesn't wait for the much larger chromium
+            for download in as_completed(downloads):
+                print("Extracting "+downloads[download]+"...")
+                self._extract_chromium(download.result(), downloads[download])
 
         if platform.system() == "Darwin":
             subprocess.run(["xattr", "-r", "-d", "com.apple.quarantine", chrome_path], check=False)
             subprocess.run(["chmod", "+x", self._get_chromium_sub_path("chrome_binary_path")], check=True)
 
-        print(f"Downloading Chrome Driver...")
-        response = requests.get(driver_url, stream=True)
-        file_name = os.path.join(chrome_path, "chrome-driver.zip")
-        with open(file_name, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-        print("Extracting files...")
-        self._extract_chromium(file_name, "chromedriver")
-
         driver_path = self._get_chromium_sub_path("chromedriver_binary_path")
         st = os.stat(driver_path)
         os.chmod(driver_path, st.st_mode | stat.S_IEXEC)
+
+        with open(self._installed_path(), 'w') as file:
+            json.dump({"version": version}, file)
     
 
     def _reset_chromium(self):
+        # The download cache is kept, so reinstalling the same build needs no download
         chromium_dir = self._ensure_chromium_path()
-        if os.path.exists(chromium_dir):
-            for root, dirs, files in os.walk(chromium_dir, topdown=False):
-                for name in files:
-                    os.remove(os.path.join(root, name))
-                for name in dirs:
-                    os.rmdir(os.path.join(root, name))
-            os.rmdir(chromium_dir)
+        for name in ["chromium", "chromedriver", "installed.json"]:
+            path = os.path.join(chromium_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
 
     
     def _ensure_chromium(self):
         chrome_path = self._get_chromium_sub_path("chrome_binary_path")
         driver_path = self._get_chromium_sub_path("chromedriver_binary_path")
+        installed = self._get_installed_chromium_version()
+
+        # An existing install is used as it is, unless a different build has been pinned
+        if os.path.exists(chrome_path) and os.path.exists(driver_path):
+            if CHROMIUM_VERSION == "" or CHROMIUM_VERSION == installed:
+                print("Chromium is ready")
+                return
 
-        if not os.path.exists(chrome_path) or not os.path.exists(driver_path):
-            print("Chromium not found. Downloading...")
-            self._reset_chromium()
-            self._download_chromium()
+        print("Chromium not found. Downloading...")
+        self._reset_chromium()
+        self._download_chromium(self._get_chromium_version())
         print("Chromium is ready")
 
 
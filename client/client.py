@@ -6,8 +6,30 @@ import json
 import argparse
 import shlex
 import sys
+import time
 from authenticator import Authenticator
 
+# Console commands usable in batch mode, with the server command and argument names
+# they turn into. list, get_lists and profile take a variable number of arguments
+# and are handled separately.
+BATCH_COMMANDS = {
+    "lists": ("lists", []),
+    "add": ("add_item", ["item"]),
+    "update": ("update_item", ["old", "new"]),
+    "remove": ("remove_item", ["item"]),
+    "config_set": ("config_set", ["key", "value"]),
+    "config_get": ("config_get", ["key"]),
+    "metrics": ("metrics", []),
+    "ping": ("ping", []),
+    "hello": ("hello", []),
+    "authenticated": ("authenticated", []),
+}
+
+EXIT_OK = 0
+EXIT_COMMAND_FAILED = 1
+EXIT_BAD_BATCH = 2
+EXIT_CONNECTION_FAILED = 3
+
 # ============================================================
 
 
@@ -17,12 +39,18 @@ class WebSocketClient:
         parser = argparse.ArgumentParser(description="Alexa shopping list sync client")
         parser.add_argument("ip", nargs='?', default="localhost", help="Sync server IP Address (localhost)")
         parser.add_argument("port", nargs='?', default="4000", help="Sync server port (4000)")
+        parser.add_argument("--batch", metavar="FILE", help="Run the commands in FILE (- for stdin) without prompting, printing JSON lines")
+        parser.add_argument("--repeat", type=int, default=1, help="Run the batch this many times on each connection (1)")
+        parser.add_argument("--concurrency", type=int, default=1, help="Run the batch over this many connections at once (1)")
         args = parser.parse_args()
 
         connect_addr = args.ip
         connect_port = int(args.port)
 
         self.uri = "ws://"+connect_addr+":"+str(connect_port)
+        self.batch = args.batch
+        self.repeat = args.repeat
+        self.concurrency = args.concurrency
 
     # ============================================================
     # Helpers
@@ -32,13 +60,25 @@ class WebSocketClient:
         async with websockets.connect(self.uri) as websocket:
             request = {
                 'command': command,
+                'events': True,
                 'args': {
                     **kwargs
                 }
             }
             await websocket.send(json.dumps(request))
-            response = await websocket.recv()
-            return json.loads(response)
+            while True:
+                response = json.loads(await websocket.recv())
+                if "event" not in response:
+                    return response
+                self._handle_server_event(response)
+
+
+    def _handle_server_event(self, event):
+        if event['event'] == "auth_expiring":
+            hours = int(event.get('seconds_left', 0) / 3600)
+            print("WARNING: The Amazon session expires in about "+str(hours)+" hours, run 'authenticate' to renew it")
+        elif event['event'] == "auth_expired":
+            print("WARNING: The Amazon session has expired, run 'authenticate' to log in again")
     
 
     def _command_successful(self, response):
@@ -54,6 +94,8 @@ class WebSocketClient:
     
 
     def _command_error(self, response):
+        if "retry_after" in response:
+            return response['error']+", try again in "+str(response['retry_after'])+"s"
         if "error" in response:
             return response['error']
         return None
@@ -65,26 +107,50 @@ class WebSocketClient:
 
     async def _check_server(self):
         print("Attempting to connect to "+self.uri)
-        connected = await self._ping_server()
-        if connected == False:
+        hello = await self._server_hello()
+        if hello == None:
             print("Unable to connect")
             sys.exit()
         else:
             print("Connected successfully")
         
         print("\nChecking config")
-        if await self._server_config_valid() == False:
+        if hello['config_valid'] == False:
             print("Config is invalid, performing setup...")
             await self._setup_server_config()
         else:
             print("Config is valid")
         
         print("\nChecking authentication")
-        if await self._server_authenticated() == False:
+        authenticated = hello['authenticated']
+        if authenticated == None:
+            authenticated = await self._server_authenticated()
+        if authenticated == False:
             print("Server is not authenticated with Amazon, beginning login...")
             await self._setup_server_authentication()
 
 
+    async def _server_hello(self):
+        try:
+            response = await self._send_command("hello")
+        except websockets.ConnectionClosed:
+            # Servers from before the handshake drop the connection on a command they don't know
+            response = None
+        except (OSError, websockets.WebSocketException):
+            return None
+
+        if response != None and self._command_successful(response):
+            return self._command_result(response)
+
+        # Older servers don't know hello, fall back to asking one thing at a time on new connections
+        try:
+            if await self._ping_server() == False:
+                return None
+            return {"config_valid": await self._server_config_valid(), "authenticated": None}
+        except (OSError, websockets.WebSocketException):
+            return None
+
+
     async def _ping_server(self):
         response = await self._send_command("ping")
         if self._command_successful(response):
@@ -148,10 +214,14 @@ class WebSocketClient:
         reset                  Reset the server to initial setup
         shutdown               Send shutdown signal to server
         quit, exit             Close the client
-        list                   List all items on your Alexa list
+        lists                  Show the Alexa lists available on your account
+        list [NAME]            List all items on your Alexa list (or the named list)
+        get_lists NAME...      List the items on several Alexa lists at once
         add ITEM               Add an item to your Alexa list
         update OLD NEW         Update an item on your Alexa list
         remove ITEM            Remove an item from your Alexa list
+        metrics                Show the server's browser queue metrics
+        profile [SECONDS]      Profile the server for a while (10s) and save the stacks
         config_set KEY VALUE   Set a configuration key (e.g., "amazon_url")
 
         Examples:
@@ -202,8 +272,41 @@ class WebSocketClient:
         print("ERROR: "+self._command_error(response))
     
 
-    async def _cmd_get_shopping_list(self):
-        response = await self._send_command("get_list")
+    async def _cmd_get_available_lists(self):
+        response = await self._send_command("lists")
+        if self._command_successful(response):
+            print(json.dumps(self._command_result(response)))
+            return
+        print("ERROR: "+self._command_error(response))
+
+
+    async def _cmd_get_lists(self, names):
+        response = await self._send_command("get_lists", lists=names)
+        if self._command_successful(response):
+            print(json.dumps(self._command_result(response)))
+            return
+        print("ERROR: "+self._command_error(response))
+
+
+    async def _cmd_get_metrics(self):
+        response = await self._send_command("metrics")
+        if self._command_successful(response):
+            print(json.dumps(self._command_result(response), indent=2))
+            return
+        print("ERROR: "+self._command_error(response))
+
+
+    async def _cmd_profile(self, seconds=10):
+        print("Profiling the server for "+str(seconds)+"s ...")
+        response = await self._send_command("profile", seconds=float(seconds))
+        if self._command_successful(response):
+            print(json.dumps(self._command_result(response), indent=2))
+            return
+        print("ERROR: "+self._command_error(response))
+
+
+    async def _cmd_get_shopping_list(self, list_name=None):
+        response = await self._send_command("get_list", list=list_name)
         if self._command_successful(response):
             print(json.dumps(self._command_result(response)))
             return
@@ -250,8 +353,15 @@ class WebSocketClient:
             if self._validate_argument_count(args, 2):
                 await self._cmd_config_set(args[0], args[1])
         
+        if command == "lists":
+            await self._cmd_get_available_lists()
+        if command == "get_lists":
+            await self._cmd_get_lists(args)
         if command == "list":
-            await self._cmd_get_shopping_list()
+            if len(args) > 1:
+                print("Invalid arguments")
+            else:
+                await self._cmd_get_shopping_list(args[0] if len(args) == 1 else None)
         if command == "add":
             if self._validate_argument_count(args, 1):
                 await self._cmd_add_shopping_list_item(args[0])
@@ -268,6 +378,12 @@ class WebSocketClient:
         if command == "help":
             await self._get_help()
 
+        if command == "metrics":
+            await self._cmd_get_metrics()
+
+        if command == "profile":
+            await self._cmd_profile(*args[:1])
+
         if command == "reset":
             await self._cmd_reset_server()
         
@@ -304,9 +420,138 @@ class WebSocketClient:
         
         print("\nGoodbye...")
 
+    # ============================================================
+    # Batch
+
+
+    def _batch_request(self, line):
+        # Either a console command, or a raw {"command": ..., "args": ...} request
+        if line.startswith("{"):
+            request = json.loads(line)
+            return request['command'], request.get('args') or {}
+
+        parts = shlex.split(line)
+        command = parts[0]
+        arguments = parts[1:]
+
+        if command == "list" and len(arguments) <= 1:
+            return "get_list", {"list": arguments[0]} if len(arguments) == 1 else {}
+        if command == "get_lists":
+            return "get_lists", {"lists": arguments}
+        if command == "profile" and len(arguments) <= 1:
+            return "profile", {"seconds": float(arguments[0])} if len(arguments) == 1 else {}
+
+        if command not in BATCH_COMMANDS:
+            raise ValueError("`"+command+"` is not available in batch mode")
+        server_command, names = BATCH_COMMANDS[command]
+        if len(arguments) != len(names):
+            raise ValueError("Invalid arguments for `"+command+"`")
+        return server_command, dict(zip(names, arguments))
+
+
+    def _read_batch(self):
+        if self.batch == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(self.batch, 'r') as file:
+                lines = file.read().splitlines()
+
+        requests = []
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            try:
+                requests.append((number, *self._batch_request(line)))
+            except (ValueError, KeyError) as e:
+                raise ValueError("Line "+str(number)+": "+str(e))
+        return requests
+
+
+    def _emit(self, record):
+        print(json.dumps(record), flush=True)
+
+
+    async def _batch_worker(self, worker, requests, latencies, failures):
+        async with websockets.connect(self.uri) as websocket:
+            for repetition in range(self.repeat):
+                # Send the whole batch before reading anything back, the server
+                # answers a connection's requests in the order they arrive
+                sent = []
+                for number, command, args in requests:
+                    await websocket.send(json.dumps({"command": command, "args": args, "events": True}))
+                    sent.append((number, command, time.perf_counter()))
+
+                # Answers come back in order, so each command was serviced from the later of
+                # when it was sent and when the answer before it arrived
+                answered = None
+                for number, command, sent_at in sent:
+                    while True:
+                        response = json.loads(await websocket.recv())
+                        if "event" not in response:
+                            break
+                        self._emit({"worker": worker, "event": response})
+
+                    now = time.perf_counter()
+                    elapsed = (now - (sent_at if answered == None else max(sent_at, answered))) * 1000
+                    total = (now - sent_at) * 1000
+                    answered = now
+                    latencies.append(elapsed)
+                    ok = self._command_successful(response)
+                    if not ok:
+                        failures.append(number)
+                    self._emit({
+                        "worker": worker,
+                        "repeat": repetition,
+                        "line": number,
+                        "command": command,
+                        "ok": ok,
+                        "result": self._command_result(response),
+                        "error": self._command_error(response),
+                        "ms": round(elapsed, 1),
+                        "total_ms": round(total, 1),
+                    })
+
+
+    async def run_batch(self):
+        try:
+            requests = self._read_batch()
+        except (OSError, ValueError) as e:
+            self._emit({"error": str(e)})
+            return EXIT_BAD_BATCH
+
+        latencies = []
+        failures = []
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*[
+                self._batch_worker(worker, requests, latencies, failures)
+                for worker in range(self.concurrency)
+            ])
+        except (OSError, websockets.WebSocketException) as e:
+            self._emit({"error": "Connection failed: "+str(e)})
+            return EXIT_CONNECTION_FAILED
+
+        ordered = sorted(latencies)
+        percentile = lambda fraction: round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 1) if len(ordered) > 0 else None
+        self._emit({"summary": {
+            "commands": len(latencies),
+            "failed": len(failures),
+            "seconds": round(time.perf_counter() - started, 3),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": percentile(1),
+        }})
+
+        if len(failures) > 0:
+            return EXIT_COMMAND_FAILED
+        return EXIT_OK
+
 # ============================================================
 
 
 if __name__ == "__main__":
     client = WebSocketClient()
+    if client.batch != None:
+        sys.exit(asyncio.run(client.run_batch()))
     asyncio.run(client.run_console())
\ No newline at end of file
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import base64
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Downloads large files in parallel byte ranges that survive being interrupted, and
+# keeps each finished file under its sha256 so it is only ever downloaded once.
+
+DOWNLOAD_PARTS = 4
+CHUNK_SIZE = 1024 * 1024
+
+# ============================================================
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadCache:
+    """Content addressed store of downloaded files, looked up by a name such as repo/version/file"""
+
+    def __init__(self, path: str, parts: int = DOWNLOAD_PARTS):
+        self.path = path
+        self.parts = parts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.path, "partial"), exist_ok=True)
+
+    # ============================================================
+    # Index
+
+
+    def _index_path(self):
+        return os.path.join(self.path, "index.json")
+
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path()):
+            return {}
+        with open(self._index_path(), 'r') as file:
+            return json.load(file)
+
+
+    def _write_json(self, path, data):
+        with open(path+".tmp", 'w') as file:
+            json.dump(data, file)
+        os.replace(path+".tmp", path)
+
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.path, sha256)
+
+
+    def lookup(self, name: str):
+        """Return the cached file for a name, or None when it isn't cached intact"""
+        with self._lock:
+            entry = self._load_index().get(name)
+        if entry == None:
+            return None
+
+        path = self._blob_path(entry['sha256'])
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return None
+        return path
+
+
+    def _store(self, name, part_path, url):
+        sha256 = self._file_hash(part_path, hashlib.sha256())
+        path = self._blob_path(sha256)
+        os.replace(part_path, path)
+
+        with self._lock:
+            index = self._load_index()
+            index[name] = {"sha256": sha256, "size": os.path.getsize(path), "url": url}
+            self._write_json(self._index_path(), index)
+        return path
+
+    # ============================================================
+    # Downloads
+
+
+    def _file_hash(self, path, digest):
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+    def _expected_md5(self, response):
+        # Google storage publishes the md5 of every object as x-goog-hash: crc32c=...,md5=...
+        for part in response.headers.get("x-goog-hash", "").split(","):
+            key, _, value = part.strip().partition("=")
+            if key == "md5":
+                return base64.b64decode(value).hex()
+        return None
+
+
+    def _probe(self, url):
+        with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=30) as response:
+            if response.status_code == 206:
+                size = int(response.headers['Content-Range'].split("/")[-1])
+                return size, True, self._expected_md5(response)
+            if response.status_code == 200:
+                length = response.headers.get("Content-Length")
+                return int(length) if length != None else None, False, self._expected_md5(response)
+        raise DownloadError("Failed to fetch "+url+" ("+str(response.status_code)+")")
+
+
+    def _download_range(self, url, part_path, progress_path, progress, number):
+        start, end, done = progress['ranges'][number]
+        if start + done > end:
+            return
+
+        headers = {"Range": "bytes="+str(start + done)+"-"+str(end)}
+        with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+            if response.status_code != 206:
+                raise DownloadError("Server stopped honouring byte ranges for "+url)
+
+            # Each range writes straight into its place in the one partial file
+            with open(part_path, 'r+b') as file:
+                file.seek(start + done)
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    file.write(chunk)
+                    file.flush()
+                    with self._lock:
+                        progress['ranges'][number][2] += len(chunk)
+                        self._write_json(progress_path, progress)
+
+
+    def _download_ranged(self, url, part_path, size):
+        progress_path = part_path+".json"
+        progress = None
+        if os.path.exists(part_path) and os.path.exists(progress_path):
+            with open(progress_path, 'r') as file:
+                progress = json.load(file)
+            if progress.get('url') != url or progress.get('size') != size:
+                progress = None
+
+        if progress == None:
+            # Nothing to resume, lay out the ranges over an empty file of the final size
+            step = -(-size // self.parts)
+            progress = {
+                "url": url,
+                "size": size,
+                "ranges": [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)],
+            }
+            with open(part_path, 'wb') as file:
+                file.truncate(size)
+            self._write_json(progress_path, progress)
+
+        with ThreadPoolExecutor(max_workers=len(progress['ranges'])) as executor:
+            jobs = [
+                executor.submit(self._download_range, url, part_path, progress_path, progress, number)
+                for number in range(len(progress['ranges']))
+            ]
+            for job in jobs:
+                job.result()
+        os.remove(progress_path)
+
+
+    def _download_whole(self, url, part_path):
+        with requests.get(url, stream=True, timeout=30) as response:
+            if response.status_code != 200:
+                raise DownloadError("Failed to fetch "+url+" ("+str(response.status_code)+")")
+            with open(part_path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    file.write(chunk)
+
+
+    def fetch(self, url: str, name: str):
+        """Return the path of the cached file for name, downloading it from url if needed"""
+        cached = self.lookup(name)
+        if cached != None:
+            return cached
+
+        part_path = os.path.join(self.path, "partial", hashlib.sha256(name.encode()).hexdigest())
+        size, ranged, md5 = self._probe(url)
+        if ranged and size > 0:
+            self._download_ranged(url, part_path, size)
+        else:
+            # Without byte ranges there is nothing to resume from, start over
+            self._download_whole(url, part_path)
+
+        if size != None and os.path.getsize(part_path) != size:
+            os.remove(part_path)
+            raise DownloadError("Downloaded "+name+" is the wrong size")
+        if md5 != None and self._file_hash(part_path, hashlib.md5()) != md5:
+            os.remove(part_path)
+            raise DownloadError("Downloaded "+name+" failed its checksum")
+
+        return self._store(name, part_path, url)
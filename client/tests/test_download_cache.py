@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_cache import DownloadCache, DownloadError, CHUNK_SIZE
+
+BLOB = os.urandom(CHUNK_SIZE * 6 + 12345)
+
+
+class FakeBucket:
+    """Serves BLOB over HTTP with byte ranges, like the snapshot bucket"""
+
+    def __init__(self):
+        self.md5 = hashlib.md5(BLOB).digest()
+        # A range starting here is cut off after one chunk
+        self.break_at = None
+        self.requested = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+
+    def url(self):
+        return "http://127.0.0.1:"+str(self._server.server_address[1])+"/chrome-linux.zip"
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    def _handler(self):
+        bucket = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                start, end = 0, len(BLOB) - 1
+                ranged = self.headers.get("Range")
+                if ranged != None:
+                    first, last = ranged.replace("bytes=", "").split("-")
+                    start, end = int(first), int(last)
+                bucket.requested.append((start, end))
+
+                self.send_response(206 if ranged != None else 200)
+                if ranged != None:
+                    self.send_header("Content-Range", "bytes "+str(start)+"-"+str(end)+"/"+str(len(BLOB)))
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("x-goog-hash", "crc32c=AAAAAA==,md5="+base64.b64encode(bucket.md5).decode())
+                self.end_headers()
+
+                body = BLOB[start:end + 1]
+                if bucket.break_at == start and end > start:
+                    # Drop the connection part way through the range
+                    self.wfile.write(body[:CHUNK_SIZE])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        return Handler
+
+
+class DownloadCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.bucket = FakeBucket()
+
+
+    def tearDown(self):
+        self.bucket.stop()
+        shutil.rmtree(self.path)
+
+
+    def test_interrupted_download_resumes(self):
+        cache = DownloadCache(self.path)
+        self.bucket.break_at = 0
+        with self.assertRaises(Exception):
+            cache.fetch(self.bucket.url(), "repo/1/chrome-linux.zip")
+        self.assertEqual(cache.lookup("repo/1/chrome-linux.zip"), None)
+
+        self.bucket.break_at = None
+        self.bucket.requested = []
+        path = cache.fetch(self.bucket.url(), "repo/1/chrome-linux.zip")
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), BLOB)
+
+        # The first range carried on from the chunk it already had, nothing else was fetched again
+        ranges = [(start, end) for start, end in self.bucket.requested if start != end]
+        self.assertEqual(ranges, [(CHUNK_SIZE, -(-len(BLOB) // cache.parts) - 1)])
+        self.assertEqual(os.listdir(os.path.join(self.path, "partial")), [])
+
+
+    def test_cached_file_is_not_downloaded_again(self):
+        cache = DownloadCache(self.path)
+        path = cache.fetch(self.bucket.url(), "repo/1/chrome-linux.zip")
+        self.bucket.requested = []
+        self.assertEqual(cache.fetch(self.bucket.url(), "repo/1/chrome-linux.zip"), path)
+        self.assertEqual(self.bucket.requested, [])
+
+
+    def test_checksum_failure(self):
+        cache = DownloadCache(self.path)
+        self.bucket.md5 = hashlib.md5(b"something else").digest()
+        with self.assertRaises(DownloadError):
+            cache.fetch(self.bucket.url(), "repo/1/chrome-linux.zip")
+        self.assertEqual(cache.lookup("repo/1/chrome-linux.zip"), None)
+        self.assertEqual(os.listdir(os.path.join(self.path, "partial")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,8 @@
 
 import logging
 
-from .asl import AlexaShoppingListSync
+from .asl import AlexaShoppingListSync, DEFAULT_RENAME_THRESHOLD
+from .coordinator import AlexaShoppingListCoordinator
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -11,14 +12,23 @@ DOMAIN = "alexa_shopping_list"
 CONF_IP = "server_ip"
 CONF_PORT = "server_port"
 CONF_SYNC_MINS = "sync_mins"
+CONF_RENAME_THRESHOLD = "rename_threshold"
+CONF_MATCH_PLURALS = "match_plurals"
+CONF_MATCH_QUANTITIES = "match_quantities"
 
 SERVICE_SYNC = "sync_alexa_shopping_list"
 
+EVENT_CONFLICT = "alexa_shopping_list_conflict"
+
 
 async def async_setup_entry(hass, entry):
     """Set up platform from a ConfigEntry."""
     hass.data.setdefault(DOMAIN, {})
 
+    async def _fire_conflict(data):
+        _LOGGER.debug(f"Firing {EVENT_CONFLICT} event: {data}")
+        hass.bus.async_fire(EVENT_CONFLICT, data)
+
     try:
 
         alexa = AlexaShoppingListSync(
@@ -26,7 +36,13 @@ async def async_setup_entry(hass, entry):
             entry.data[CONF_PORT],
             entry.data[CONF_SYNC_MINS],
             hass.config.path(".shopping_list.json"),
-            hass.data["shopping_list"].async_load
+            hass.data["shopping_list"].async_load,
+            on_conflict=_fire_conflict,
+            rename_threshold=entry.data.get(CONF_RENAME_THRESHOLD, DEFAULT_RENAME_THRESHOLD),
+            matching_rules={
+                "strip_plurals": entry.data.get(CONF_MATCH_PLURALS, False),
+                "strip_quantities": entry.data.get(CONF_MATCH_QUANTITIES, False),
+            }
         )
 
     except Exception as e:
@@ -34,10 +50,13 @@ async def async_setup_entry(hass, entry):
         return False
     
     # hass.bus.async_listen("shopping_list_updated", alexa.homeassistant_shopping_list_updated)
-    hass.data[DOMAIN][entry.entry_id] = alexa
-    await hass.config_entries.async_forward_entry_setups(entry, ["sensor"])
+    coordinator = AlexaShoppingListCoordinator(hass, alexa, entry.data[CONF_SYNC_MINS], DOMAIN)
+    await coordinator.async_config_entry_first_refresh()
+
+    hass.data[DOMAIN][entry.entry_id] = coordinator
+    await hass.config_entries.async_forward_entry_setups(entry, ["sensor", "todo"])
 
-    services = AlexaServices(alexa, _LOGGER, hass)
+    services = AlexaServices(coordinator, _LOGGER, hass)
     hass.services.async_register(DOMAIN, SERVICE_SYNC, services.handle_sync_service)
 
     return True
@@ -45,20 +64,15 @@ async def async_setup_entry(hass, entry):
 
 class AlexaServices:
 
-    def __init__(self, alexa, logger, hass):
-        self.alexa = alexa
+    def __init__(self, coordinator, logger, hass):
+        self.coordinator = coordinator
         self.logger = logger
         self.hass = hass
 
     async def handle_sync_service(self, call):
         self.logger.debug("Alexa Sync Service")
 
-        try:
-            updated = await self.alexa.sync(self.logger, True)
-            if updated == True:
-                _LOGGER.debug("Firing alexa_shopping_list_changed event")
-                self.hass.bus.async_fire("alexa_shopping_list_changed")
-        except Exception as e:
-            self.logger.error(f"Alexa Shopping List Sync Error: {e}", exc_info=True)
+        # Runs now rather than waiting for the debounce, the coordinator logs any failure
+        await self.coordinator.async_refresh()
 
 
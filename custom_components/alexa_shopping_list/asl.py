@@ -6,16 +6,41 @@ import datetime
 import os
 import asyncio
 import hashlib
+import difflib
+
+from .registry import ItemIdRegistry
+from .matching import ItemMatcher
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFAULT_RENAME_THRESHOLD = 0.8
+
+# Returned by a server in ha_mode that isn't currently the leader
+STANDBY_ERROR = "Standby server"
 
 # ============================================================
 
 
 class AlexaShoppingListSync:
 
-    def __init__(self, ip="localhost", port=4000, sync_mins=60, hasl_path=None, hasl_refresh=None):
-        self.uri = "ws://"+ip+":"+str(port)
+    def __init__(self, ip="localhost", port=4000, sync_mins=60, hasl_path=None, hasl_refresh=None, on_conflict=None, rename_threshold=DEFAULT_RENAME_THRESHOLD, matching_rules=None):
+        self._endpoints = self._parse_endpoints(ip, port)
+        self.uri = self._endpoints[0] if len(self._endpoints) > 0 else None
         self._hasl_path = hasl_path
         self._hasl_refresh = hasl_refresh
+        self._on_conflict = on_conflict
+        self._registry = ItemIdRegistry(self._registry_path())
+        self._registry_loaded = False
+        self._exported = None
+        self._rename_threshold = rename_threshold
+        self._matcher = ItemMatcher(matching_rules)
+        self.last_sync_stats = {}
+        self.server_events = {}
+        self.server_capabilities = []
+        self._encoding = "json"
         self._setup_cached_list(sync_mins * 60)
         self._is_syncing = False
 
@@ -23,17 +48,83 @@ class AlexaShoppingListSync:
     # Helpers
 
 
-    async def _send_command(self, command, **kwargs):
-        async with websockets.connect(self.uri) as websocket:
+    def _parse_endpoints(self, ip, port):
+        # "host" or "host:port", comma separated to fail over between several servers
+        endpoints = []
+        for host in str(ip).split(","):
+            host = host.strip()
+            if host == "":
+                continue
+            if ":" not in host:
+                host = host+":"+str(port)
+            endpoints.append("ws://"+host)
+        return endpoints
+
+
+    def _encode(self, message):
+        if self._encoding == "msgpack":
+            return msgpack.packb(message, use_bin_type=True)
+        return json.dumps(message)
+
+
+    def _decode(self, frame):
+        # The server answers in whatever encoding the request came in
+        if isinstance(frame, bytes):
+            return msgpack.unpackb(frame, raw=False)
+        return json.loads(frame)
+
+
+    async def _send_to(self, uri, command, **kwargs):
+        async with websockets.connect(uri, compression="deflate") as websocket:
             request = {
                 'command': command,
+                # We handle pushed events, see _handle_server_event
+                'events': True,
                 'args': {
                     **kwargs
                 }
             }
-            await websocket.send(json.dumps(request))
-            response = await websocket.recv()
-            return json.loads(response)
+            await websocket.send(self._encode(request))
+            while True:
+                response = self._decode(await websocket.recv())
+                if "event" not in response:
+                    return response
+                self._handle_server_event(response)
+
+
+    async def _send_command(self, command, **kwargs):
+        # Start with whichever server answered last, moving on when one is down or standing by
+        error = None
+        standby_response = None
+        for uri in sorted(self._endpoints, key=lambda uri: uri != self.uri):
+            try:
+                response = await self._send_to(uri, command, **kwargs)
+            except (OSError, websockets.WebSocketException) as e:
+                # A server that dropped the connection says more than one that can't be reached
+                if not isinstance(error, websockets.ConnectionClosed):
+                    error = e
+                continue
+
+            if str(response.get('error')).startswith(STANDBY_ERROR):
+                standby_response = response
+                continue
+
+            self.uri = uri
+            return response
+
+        if standby_response != None:
+            return standby_response
+        if error == None:
+            raise ConnectionError("no endpoints configured")
+        raise error
+
+
+    def _handle_server_event(self, event):
+        # The server pushes warnings such as auth_expiring to whoever is connected
+        self.server_events[event['event']] = {
+            **event,
+            "received": datetime.datetime.now().astimezone()
+        }
     
 
     def _command_successful(self, response):
@@ -52,12 +143,58 @@ class AlexaShoppingListSync:
         if "error" in response:
             return response['error']
         return None
-        
+
+
+    def _registry_path(self):
+        if self._hasl_path == None:
+            return None
+        return os.path.join(os.path.dirname(self._hasl_path), ".alexa_shopping_list_ids.json")
+
+
+    def _exported_path(self):
+        if self._hasl_path == None:
+            return None
+        return os.path.join(os.path.dirname(self._hasl_path), ".alexa_shopping_list_exported.json")
+
 
     # ============================================================
     # Server
 
 
+    async def server_hello(self):
+        """Ping, config and auth state in one round trip, or None when the server can't be reached"""
+        try:
+            response = await self._send_command("hello")
+        except websockets.ConnectionClosed:
+            # Servers from before the handshake drop the connection on a command they don't know
+            response = None
+        except (OSError, websockets.WebSocketException):
+            return None
+
+        if response != None and self._command_successful(response):
+            hello = self._command_result(response)
+            self.server_capabilities = hello['capabilities']
+            # Switch to the binary encoding once we know the server speaks it
+            if "msgpack" in self.server_capabilities and msgpack != None:
+                self._encoding = "msgpack"
+            return hello
+
+        # Servers from before the handshake, ask the old way on new connections
+        try:
+            if await self.can_ping_server() == False:
+                return None
+            config_valid = await self.server_config_is_valid()
+        except (OSError, websockets.WebSocketException):
+            return None
+        return {
+            "protocol": 0,
+            "capabilities": [],
+            "config_valid": config_valid,
+            "authenticated": None,
+            "auth_age": None,
+        }
+
+
     async def can_ping_server(self):
         response = await self._send_command("ping")
         if self._command_successful(response):
@@ -87,13 +224,41 @@ class AlexaShoppingListSync:
         self._sync_seconds = sync_seconds
         self.last_updated = None
         self._cached_list = []
+        self._item_ids = []
+        self._pending = []
+        self._alexa_records = {}
+
+
+    def _set_cached_list(self, items):
+        self._cached_list = items
+        # IDs are handed out whenever the list changes, so reading them changes nothing
+        self._item_ids = list(zip(self._registry.assign(self._registry_items(items)), items))
     
 
     def _update_cached_list(self, new_list):
-        self._cached_list = new_list
+        self._set_cached_list(new_list)
         self.last_updated = datetime.datetime.now().astimezone()
     
 
+    def _update_alexa_records(self, records):
+        # Keep what the scrape said about each title, the list itself stays plain titles
+        self._alexa_records = {}
+        for record in records:
+            self._alexa_records.setdefault(record['title'], record)
+        return list(self._alexa_records.keys())
+
+
+    def is_completed(self, item):
+        """Whether Alexa has the item ticked off, as of the last detailed read"""
+        record = self._alexa_records.get(item)
+        return record != None and record.get('completed') == True
+
+
+    @property
+    def items(self):
+        return list(self._cached_list)
+
+
     def _cached_list_needs_updating(self):
         if self.last_updated == None:
             return True
@@ -112,31 +277,231 @@ class AlexaShoppingListSync:
 
     async def _get_list(self, force = False):
         if self._cached_list_needs_updating() or force:
-            response = await self._send_command("get_list")
+            detailed = "detailed" in self.server_capabilities
+            args = {"detailed": True} if detailed else {}
+            response = await self._send_command("get_list", **args)
             if self._command_successful(response):
-                self._update_cached_list(self._command_result(response))
+                items = self._command_result(response)
+                if detailed:
+                    items = self._update_alexa_records(items)
+                self._update_cached_list(self._merge_pending(items))
         return self._cached_list
-    
 
-    async def _add_item(self, item):
-        response = await self._send_command("add_item", item=item)
-        if self._command_successful(response):
-            self._update_cached_list(self._command_result(response))
+
+    # ============================================================
+    # Optimistic mutations
+
+
+    def _apply_mutation(self, items, mutation):
+        items = list(items)
+        index = self._matcher.index(items)
+        if mutation['op'] == "add":
+            if mutation['item'] not in index:
+                items.insert(0, mutation['item'])
+        elif mutation['op'] == "update":
+            old = index.find(mutation['old'])
+            if old != None:
+                items[items.index(old)] = mutation['new']
+        elif mutation['op'] == "remove":
+            item = index.find(mutation['item'])
+            if item != None:
+                items.remove(item)
+        return items
+
+
+    def _revert_mutation(self, items, mutation):
+        if mutation['op'] == "add":
+            return self._apply_mutation(items, {"op": "remove", "item": mutation['item']})
+        if mutation['op'] == "update":
+            return self._apply_mutation(items, {"op": "update", "old": mutation['new'], "new": mutation['old']})
+        return self._apply_mutation(items, {"op": "add", "item": mutation['item']})
+
+
+    def _mutation_conflicts(self, items, mutation):
+        index = self._matcher.index(items)
+        if mutation['op'] == "add":
+            return mutation['item'] not in index
+        if mutation['op'] == "update":
+            if self._matcher.same(mutation['old'], mutation['new']):
+                return mutation['new'] not in index
+            return mutation['new'] not in index or mutation['old'] in index
+        return mutation['item'] in index
+
+
+    def is_pending(self, item):
+        for mutation in self._pending:
+            if item in [mutation.get('item'), mutation.get('new')]:
+                return True
+        return False
+
+
+    @property
+    def pending_operations(self):
+        return len(self._pending)
+
+
+    def _merge_pending(self, items):
+        for mutation in self._pending:
+            items = self._apply_mutation(items, mutation)
+        return items
+
+
+    def _queue_mutations(self, mutations):
+        items = self._cached_list
+        for mutation in mutations:
+            self._pending.append(mutation)
+            if mutation['op'] == "add":
+                # Whatever the last read said about an item of that name, a new one isn't ticked off
+                self._alexa_records.pop(mutation['item'], None)
+            items = self._apply_mutation(items, mutation)
+        # IDs are assigned once for the lot, a list missing items still to be queued
+        # would make the registry forget the IDs HA gave them
+        self._set_cached_list(items)
+        return mutations
+
+
+    def _queue_mutation(self, op, **kwargs):
+        return self._queue_mutations([{"op": op, **kwargs}])[0]
+
+
+    def _undo_mutation(self, mutation):
+        if mutation['op'] == "update":
+            # Give the ID back to the old name, before the list stops showing the new one
+            ha_id = self._registry.ha_id(self._registry.alexa_key(mutation['new']))
+            if ha_id != None:
+                self._registry.rename(ha_id, mutation['old'])
+        self._set_cached_list(self._revert_mutation(self._cached_list, mutation))
+
+
+    def _drop_mutations(self, mutations):
+        # Newest first, so each one is undone on the list it was applied to
+        for mutation in reversed(mutations):
+            if any(mutation is pending for pending in self._pending):
+                self._pending = [pending for pending in self._pending if pending is not mutation]
+                self._undo_mutation(mutation)
+
+
+    async def _report_conflict(self, mutation, items, error=None):
+        if self._on_conflict == None:
+            return
+        await self._on_conflict({
+            **mutation,
+            "list": items,
+            "error": error,
+        })
+
+
+    async def _confirm_mutation(self, mutation):
+        command = mutation['op']+"_item"
+        args = {key: value for key, value in mutation.items() if key != "op"}
+        try:
+            response = await self._send_command(command, **args)
+        except Exception as e:
+            self._pending.remove(mutation)
+            self._undo_mutation(mutation)
+            await self._report_conflict(mutation, self._cached_list, str(e))
+            raise
+        self._pending.remove(mutation)
+
+        if not self._command_successful(response):
+            # Roll back just this mutation, anything else still pending stays applied
+            self._undo_mutation(mutation)
+            await self._report_conflict(mutation, self._cached_list, self._command_error(response))
+            return self._cached_list
+
+        authoritative = self._command_result(response)
+        if authoritative == None and mutation['op'] == "update":
+            # The server couldn't find the old name, so nothing was renamed
+            self._undo_mutation(mutation)
+            await self._report_conflict(mutation, self._cached_list, "Item not found")
+            return self._cached_list
+        if authoritative == None:
+            # The server had nothing to do, so our optimistic view already matches
+            return self._cached_list
+
+        self._update_cached_list(self._merge_pending(authoritative))
+
+        if self._mutation_conflicts(authoritative, mutation):
+            await self._report_conflict(mutation, authoritative)
         return self._cached_list
+
+
+    async def _add_item(self, item):
+        return await self._confirm_mutation(self._queue_mutation("add", item=item))
     
 
     async def _update_item(self, old, new):
-        response = await self._send_command("update_item", old=old, new=new)
-        if self._command_successful(response):
-            self._update_cached_list(self._command_result(response))
-        return self._cached_list
+        return await self._confirm_mutation(self._queue_mutation("update", old=old, new=new))
     
 
     async def _remove_item(self, item):
-        response = await self._send_command("remove_item", item=item)
-        if self._command_successful(response):
-            self._update_cached_list(self._command_result(response))
-        return self._cached_list
+        return await self._confirm_mutation(self._queue_mutation("remove", item=item))
+
+    # ============================================================
+    # Items
+
+
+    def load_registry(self):
+        if self._registry_loaded == False:
+            self._registry.load()
+            self._exported = self._load_exported()
+            self._registry_loaded = True
+
+
+    def item_ids(self):
+        """Pair every cached item with its stable HA ID"""
+        return list(self._item_ids)
+
+
+    def item_name(self, ha_id):
+        return self._registry.name_for(ha_id)
+
+
+    async def _save_registry(self):
+        # The HA list catches up at the next sync, which leaves alone what it exported last time
+        if self._is_syncing == True:
+            return
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._registry.save)
+
+
+    async def add_item(self, item):
+        if item in self._matcher.index(self._cached_list):
+            # Already on the list under another spelling, don't add it twice
+            return
+        await self._add_item(item)
+        await self._save_registry()
+
+
+    async def update_item(self, ha_id, new):
+        old = self.item_name(ha_id)
+        if old == None or old == new:
+            return
+        # Move the ID with the item, so it keeps its place in HA
+        self._registry.rename(ha_id, new)
+        await self._update_item(old, new)
+        await self._save_registry()
+
+
+    async def untick_item(self, ha_id):
+        item = self.item_name(ha_id)
+        if item == None or not self.is_completed(item):
+            return
+        # Alexa can't untick an item, but the same item added again starts unticked
+        await self._remove_item(item)
+        self._registry.learn([{"id": ha_id, "name": item, "complete": False}])
+        await self._add_item(item)
+        await self._save_registry()
+
+
+    async def remove_items(self, ha_ids):
+        for ha_id in ha_ids:
+            item = self.item_name(ha_id)
+            if item != None:
+                self._registry.remove(ha_id)
+                await self._remove_item(item)
+        await self._save_registry()
 
     # ============================================================
     # Sync
@@ -146,17 +511,60 @@ class AlexaShoppingListSync:
         await self.sync(None, True)
     
 
-    def _export_ha_shopping_list(self, items):
+    def _registry_items(self, items):
+        # Hand the registry Alexa's own item IDs wherever the scrape found them
+        return [
+            {"title": item, "id": self._alexa_records[item].get('id')} if item in self._alexa_records else item
+            for item in items
+        ]
+
+
+    def _export_ha_shopping_list(self, final=True):
         export = []
-        for item in items:
+        for ha_id, item in self._item_ids:
             export.append({
-                "id": item.replace(" ", "_"),
+                "id": ha_id,
                 "name": item,
-                "complete": False
+                "complete": self.is_completed(item)
             })
-        
+        self._registry.save()
+        if final:
+            # Only what Alexa confirmed counts as exported, see _ha_changes
+            self._save_exported(export)
+
+        # Leave HA's copy alone when nothing changed, so it doesn't have to reload
+        if self._read_ha_shopping_list() == export:
+            return False
+
         with open(self._hasl_path, "w") as outfile:
             outfile.write(json.dumps(export, indent=4))
+        return True
+
+
+    def _load_exported(self):
+        path = self._exported_path()
+        if path == None or not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+
+    def _save_exported(self, export):
+        path = self._exported_path()
+        if path == None or export == self._exported:
+            return
+        with open(path+".tmp", 'w') as file:
+            json.dump(export, file)
+        os.replace(path+".tmp", path)
+        self._exported = export
+
+
+    def _ha_changes(self, ha_list):
+        # Items still as we last exported them weren't touched in HA, its copy is
+        # just behind on changes made straight to Alexa, e.g. through the todo entity
+        if self._exported == None:
+            return list(ha_list)
+        return [item for item in ha_list if item not in self._exported]
     
 
     def _read_ha_shopping_list(self):
@@ -178,6 +586,92 @@ class AlexaShoppingListSync:
         return None
     
 
+    def _similarity(self, a, b):
+        return difflib.SequenceMatcher(None, a.casefold(), b.casefold()).ratio()
+
+
+    def _plan_renames(self, ha_list, alexa_list, new_items):
+        renames = []
+
+        # Items HA renamed in place still carry the ID we exported them with
+        for item in self._ha_changes(ha_list):
+            if item['complete'] == True or item['id'] not in self._registry:
+                continue
+            old = self._registry.name_for(item['id'])
+            if old != item['name'] and old in alexa_list and item['name'] in new_items:
+                renames.append((old, item['name']))
+                new_items.remove(item['name'])
+                self._registry.rename(item['id'], item['name'])
+
+        # Otherwise pair an item that vanished from HA since the last sync with the
+        # most similar new item, as long as neither side has a closer match
+        ha_ids = set(item['id'] for item in ha_list)
+        exported_ids = set(item['id'] for item in self._exported) if self._exported != None else None
+        renamed = set(old for old, new in renames)
+        disappeared = []
+        for name in alexa_list:
+            ha_id = self._registry.ha_id(self._registry.alexa_key(name))
+            if ha_id == None or ha_id in ha_ids or name in renamed:
+                continue
+            # Items added straight to Alexa never reached HA, they can't have vanished from it
+            if exported_ids == None or ha_id in exported_ids:
+                disappeared.append((ha_id, name))
+
+        if len(disappeared) == 0 or len(new_items) == 0:
+            return renames
+
+        scores = []
+        for ha_id, old in disappeared:
+            for new in new_items:
+                score = self._similarity(old, new)
+                if score >= self._rename_threshold:
+                    scores.append((score, ha_id, old, new))
+
+        paired_old = set()
+        paired_new = set()
+        for score, ha_id, old, new in sorted(scores, reverse=True):
+            if old in paired_old or new in paired_new:
+                continue
+            paired_old.add(old)
+            paired_new.add(new)
+            renames.append((old, new))
+            new_items.remove(new)
+            self._registry.unbind(ha_id)
+
+        return renames
+
+
+    def _plan_sync(self, ha_list, alexa_list):
+        to_add = []
+        to_remove = []
+        to_restore = []
+
+        # Names only need to match after normalising, and the index keeps each lookup O(1)
+        alexa_index = self._matcher.index(alexa_list)
+        adding = self._matcher.index()
+        exported = {item['id']: item for item in self._exported or []}
+        for item in self._ha_changes(ha_list):
+            match = alexa_index.find(item['name'])
+            if item['complete'] == True:
+                # Ticked off in HA, unless Alexa had it ticked off already
+                if match != None and not self.is_completed(match) and match not in to_remove:
+                    to_remove.append(match)
+                    self._registry.remove(item['id'])
+            elif match != None and self.is_completed(match):
+                # Unticked in HA after we exported it ticked off
+                if exported.get(item['id'], {}).get('complete') == True and match not in [name for name, ha_id in to_restore]:
+                    to_restore.append((match, item['id']))
+            elif match == None and item['name'] not in adding:
+                to_add.append(item['name'])
+                adding.add(item['name'])
+
+        # No threshold turns rename detection off, every rename is then an add
+        to_rename = []
+        if self._rename_threshold != None:
+            to_rename = self._plan_renames(ha_list, alexa_list, to_add)
+        return to_add, to_remove, to_rename, to_restore
+
+
     async def _debug_log_entry(self, logger=None, entry=""):
         if logger == None:
             return
@@ -194,41 +688,72 @@ class AlexaShoppingListSync:
         if self._is_syncing == True:
             return False
         self._is_syncing = True
+        try:
+            return await self._sync(logger, force)
+        finally:
+            self._is_syncing = False
+
 
+    async def _sync(self, logger, force):
         loop = asyncio.get_running_loop()
         ha_list = await loop.run_in_executor(None, self._read_ha_shopping_list)
+        await loop.run_in_executor(None, self.load_registry)
         original_ha_list_hash = await loop.run_in_executor(None, self._ha_shopping_list_hash)
         
         await self._debug_log_entry(logger, "Loading Alexa shopping list")
         alexa_list = await self._get_list(force)
         await self._debug_log_entry(logger, "Alexa list: "+json.dumps(alexa_list))
 
-        to_add = []
-        to_remove = []
+        # After the read, which would otherwise forget IDs for items not on Alexa yet
+        self._registry.learn(self._ha_changes(ha_list))
 
-        for item in ha_list:
-            if item['complete'] == True:
-                if item['name'] in alexa_list:
-                    to_remove.append(item['name'])
-                
-            if item['name'] not in alexa_list:
-                to_add.append(item['name'])
+        to_add, to_remove, to_rename, to_restore = self._plan_sync(ha_list, alexa_list)
         
+        await self._debug_log_entry(logger, "To rename on alexa: "+json.dumps(to_rename))
         await self._debug_log_entry(logger, "To add to alexa: "+json.dumps(to_add))
-        for item in to_add:
-            await self._add_item(item)
-        
         await self._debug_log_entry(logger, "To remove from alexa: "+json.dumps(to_remove))
-        for item in to_remove:
-            await self._remove_item(item)
+        await self._debug_log_entry(logger, "To untick on alexa: "+json.dumps([name for name, ha_id in to_restore]))
+        mutations = [{"op": "update", "old": old, "new": new} for old, new in to_rename]
+        mutations += [{"op": "add", "item": item} for item in to_add]
+        mutations += [{"op": "remove", "item": item} for item in to_remove]
+        for name, ha_id in to_restore:
+            # Alexa can't untick an item, but the same item added again starts unticked.
+            # Known by name from now on, so the HA ID goes with the item that comes back
+            self._registry.unbind(ha_id)
+            self._registry.learn([{"id": ha_id, "name": name, "complete": False}])
+            mutations += [{"op": "remove", "item": name}, {"op": "add", "item": name}]
+        self._queue_mutations(mutations)
+
+        # Each rename would otherwise have been an add, plus a remove for the old name
+        self.last_sync_stats = {
+            "renamed": len(to_rename),
+            "added": len(to_add),
+            "removed": len(to_remove),
+            "unticked": len(to_restore),
+            "operations_saved": len(to_rename),
+        }
+        await self._debug_log_entry(logger, "Sync plan: "+json.dumps(self.last_sync_stats))
+
+        if len(mutations) > 0:
+            # Publish the optimistic list straight away, the browser work below takes a while
+            await self._debug_log_entry(logger, "Exporting optimistic HA shopping list")
+            if await loop.run_in_executor(None, self._export_ha_shopping_list, False):
+                await self._hasl_refresh()
+
+        try:
+            for mutation in mutations:
+                await self._confirm_mutation(mutation)
+        except Exception:
+            # None of the rest reached Alexa. HA keeps its copy and the last export stays
+            # as it was, so the next sync plans them again
+            self._drop_mutations(mutations)
+            raise
         
         refreshed_items = await self._get_list()
         await self._debug_log_entry(logger, "Refreshed Alexa list: "+json.dumps(refreshed_items))
         await self._debug_log_entry(logger, "Exporting new HA shopping list")
-        await loop.run_in_executor(None, self._export_ha_shopping_list, refreshed_items)
-        await self._hasl_refresh()
-
-        self._is_syncing = False
+        if await loop.run_in_executor(None, self._export_ha_shopping_list):
+            await self._hasl_refresh()
 
         await self._debug_log_entry(logger, "Original list hash: "+original_ha_list_hash)
         new_ha_list_hash = await loop.run_in_executor(None, self._ha_shopping_list_hash)
@@ -11,9 +11,9 @@ import voluptuous as vol
 from homeassistant import config_entries
 import homeassistant.helpers.config_validation as cv
 
-from .asl import AlexaShoppingListSync
+from .asl import AlexaShoppingListSync, DEFAULT_RENAME_THRESHOLD
 
-from . import DOMAIN, CONF_IP, CONF_PORT, CONF_SYNC_MINS
+from . import DOMAIN, CONF_IP, CONF_PORT, CONF_SYNC_MINS, CONF_RENAME_THRESHOLD, CONF_MATCH_PLURALS, CONF_MATCH_QUANTITIES
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -37,6 +37,9 @@ class AlexaShoppingListConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             CONF_IP: self.config_data[CONF_IP],
             CONF_PORT: self.config_data[CONF_PORT],
             CONF_SYNC_MINS: self.config_data[CONF_SYNC_MINS],
+            CONF_RENAME_THRESHOLD: self.config_data[CONF_RENAME_THRESHOLD],
+            CONF_MATCH_PLURALS: self.config_data[CONF_MATCH_PLURALS],
+            CONF_MATCH_QUANTITIES: self.config_data[CONF_MATCH_QUANTITIES],
         })
     
 
@@ -52,9 +55,15 @@ class AlexaShoppingListConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 self.config_data[CONF_PORT]
             )
 
-            if await alexa.can_ping_server() == True:
-                if await alexa.server_config_is_valid() == True:
-                    if await alexa.server_is_authenticated() == True:
+            hello = await alexa.server_hello()
+            if hello != None:
+                if hello['config_valid'] == True:
+                    # Only ask the server to check with Amazon when it has no recent answer
+                    authenticated = hello['authenticated']
+                    if authenticated == None:
+                        authenticated = await alexa.server_is_authenticated()
+
+                    if authenticated == True:
                         return await self.async_step_sync_mins()
                     else:
                         errors["base"] = "server_not_authenticated"
@@ -78,8 +87,27 @@ class AlexaShoppingListConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 sync_mins = 60
             
             self.config_data[CONF_SYNC_MINS] = int(sync_mins)
-            return self._save_config()
+
+            rename_threshold = user_input.get(CONF_RENAME_THRESHOLD)
+            if rename_threshold == "" or rename_threshold == None:
+                rename_threshold = DEFAULT_RENAME_THRESHOLD
+
+            try:
+                rename_threshold = float(rename_threshold)
+            except ValueError:
+                rename_threshold = -1
+
+            if rename_threshold < 0 or rename_threshold > 1:
+                errors["base"] = "invalid_rename_threshold"
+            else:
+                self.config_data[CONF_RENAME_THRESHOLD] = rename_threshold
+                self.config_data[CONF_MATCH_PLURALS] = user_input.get(CONF_MATCH_PLURALS, False)
+                self.config_data[CONF_MATCH_QUANTITIES] = user_input.get(CONF_MATCH_QUANTITIES, False)
+                return self._save_config()
 
         return self.async_show_form(step_id="sync_mins", data_schema=vol.Schema({
             vol.Required(CONF_SYNC_MINS, default="60"): cv.string,
+            vol.Optional(CONF_RENAME_THRESHOLD, default=str(DEFAULT_RENAME_THRESHOLD)): cv.string,
+            vol.Optional(CONF_MATCH_PLURALS, default=False): cv.boolean,
+            vol.Optional(CONF_MATCH_QUANTITIES, default=False): cv.boolean,
         }), errors=errors)
\ No newline at end of file
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+from datetime import timedelta
+
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+
+_LOGGER = logging.getLogger(__name__)
+
+EVENT_LIST_CHANGED = "alexa_shopping_list_changed"
+
+
+class AlexaShoppingListCoordinator(DataUpdateCoordinator):
+    """Runs the sync once per interval and shares the result with every entity"""
+
+    def __init__(self, hass, alexa, sync_mins, name="alexa_shopping_list"):
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=name,
+            update_interval=timedelta(minutes=sync_mins)
+        )
+        self.alexa = alexa
+
+
+    async def _async_update_data(self):
+        # One round trip gives us the latency and auth state without touching the browser
+        started = time.monotonic()
+        hello = await self.alexa.server_hello()
+        latency = time.monotonic() - started
+        if hello == None:
+            raise UpdateFailed("Unable to connect to the Alexa Shopping List server")
+
+        started = time.monotonic()
+        try:
+            # The coordinator decides when to sync, so skip the integration's own timer
+            updated = await self.alexa.sync(_LOGGER, True)
+        except Exception as e:
+            raise UpdateFailed(f"Alexa Shopping List Sync Error: {e}") from e
+        duration = time.monotonic() - started
+
+        if updated == True:
+            _LOGGER.debug(f"Firing {EVENT_LIST_CHANGED} event")
+            self.hass.bus.async_fire(EVENT_LIST_CHANGED)
+
+        stats = self.alexa.last_sync_stats
+        # Unticking takes a remove and an add
+        return {
+            "items": self.alexa.items,
+            "item_count": len(self.alexa.items),
+            "last_synced": self.alexa.last_updated,
+            "sync_duration": round(duration, 2),
+            "operations": stats.get('added', 0) + stats.get('removed', 0) + stats.get('renamed', 0) + stats.get('unticked', 0) * 2,
+            "pending": self.alexa.pending_operations,
+            "latency": round(latency * 1000),
+            "authenticated": hello['authenticated'],
+            "auth_expires": hello.get('auth_expires'),
+            "sync_stats": dict(stats),
+        }
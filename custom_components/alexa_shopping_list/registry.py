@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import uuid
+
+# ============================================================
+
+
+class ItemIdRegistry:
+    """Persistent two-way mapping between HA item IDs and Alexa items"""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._key_by_id = {}
+        self._id_by_key = {}
+        self._name_by_id = {}
+        self._dirty = False
+
+    # ============================================================
+    # Keys
+
+
+    def _item_name_and_alexa_id(self, item):
+        if isinstance(item, dict):
+            return item['title'], item.get('id')
+        return item, None
+
+
+    def alexa_key(self, name, occurrence=0, alexa_id=None):
+        # Prefer the identifier Alexa gives the item, otherwise fall back to the
+        # name plus which duplicate of that name it is
+        if alexa_id not in [None, ""]:
+            return "id:"+str(alexa_id)
+        return "name:"+str(occurrence)+":"+name
+
+
+    def _is_name_key(self, key):
+        return key.startswith("name:")
+
+
+    def _occurrence(self, key):
+        return int(key.split(":")[1])
+
+    # ============================================================
+    # Lookups
+
+
+    def ha_id(self, key):
+        return self._id_by_key.get(key)
+
+
+    def key_for(self, ha_id):
+        return self._key_by_id.get(ha_id)
+
+
+    def name_for(self, ha_id):
+        return self._name_by_id.get(ha_id)
+
+
+    def __contains__(self, ha_id):
+        return ha_id in self._key_by_id
+
+    # ============================================================
+    # Updates
+
+
+    def bind(self, ha_id, key, name):
+        old_key = self._key_by_id.pop(ha_id, None)
+        if old_key != None:
+            self._id_by_key.pop(old_key, None)
+
+        old_id = self._id_by_key.pop(key, None)
+        if old_id != None:
+            self._key_by_id.pop(old_id, None)
+            self._name_by_id.pop(old_id, None)
+
+        self._key_by_id[ha_id] = key
+        self._id_by_key[key] = ha_id
+        self._name_by_id[ha_id] = name
+        self._dirty = True
+
+
+    def unbind(self, ha_id):
+        key = self._key_by_id.pop(ha_id, None)
+        if key != None:
+            self._id_by_key.pop(key, None)
+            self._name_by_id.pop(ha_id, None)
+            self._dirty = True
+
+
+    def remove(self, ha_id):
+        """Forget an item we are removing, so later duplicates of its name keep their own IDs"""
+        key = self._key_by_id.get(ha_id)
+        if key == None:
+            return
+        name = self._name_by_id[ha_id]
+        self.unbind(ha_id)
+        if not self._is_name_key(key):
+            return
+
+        # Each later copy moves up a place, where the next assign will look for it
+        removed = self._occurrence(key)
+        later = sorted(
+            (self._occurrence(other_key), other_id) for other_id, other_key in self._key_by_id.items()
+            if self._is_name_key(other_key) and self._name_by_id[other_id] == name and self._occurrence(other_key) > removed
+        )
+        for occurrence, other_id in later:
+            self.bind(other_id, self.alexa_key(name, occurrence - 1), name)
+
+
+    def rename(self, ha_id, new_name):
+        key = self._key_by_id.get(ha_id)
+        if key == None:
+            return
+        if self._is_name_key(key):
+            key = self._free_name_key(new_name)
+        self.bind(ha_id, key, new_name)
+
+
+    def _free_name_key(self, name):
+        occurrence = 0
+        while self.alexa_key(name, occurrence) in self._id_by_key:
+            occurrence += 1
+        return self.alexa_key(name, occurrence)
+
+
+    def learn(self, ha_list):
+        """Adopt the IDs HA gave to items it created itself"""
+        for item in ha_list:
+            if item['id'] in self or item['complete'] == True:
+                continue
+            self.bind(item['id'], self._free_name_key(item['name']), item['name'])
+
+
+    def assign(self, items):
+        """Return a stable HA ID for each Alexa item, forgetting items that have gone
+
+        Copies of a name without Alexa IDs can't be told apart. When one goes from Alexa
+        without passing through remove(), the copies left take the first IDs in list order"""
+
+        # IDs known only by name, in duplicate order, for items whose own key has gone
+        by_name = {}
+        for ha_id, key in self._key_by_id.items():
+            if self._is_name_key(key):
+                by_name.setdefault(self._name_by_id[ha_id], []).append(ha_id)
+        for name_ids in by_name.values():
+            name_ids.sort(key=lambda ha_id: self._occurrence(self._key_by_id[ha_id]))
+
+        occurrences = {}
+        key_by_id = {}
+        name_by_id = {}
+        ids = []
+        for item in items:
+            name, alexa_id = self._item_name_and_alexa_id(item)
+            occurrence = occurrences.get(name, 0)
+            occurrences[name] = occurrence + 1
+
+            key = self.alexa_key(name, occurrence, alexa_id)
+            ha_id = self._id_by_key.get(key)
+            if ha_id == None or ha_id in key_by_id:
+                # Fall back to an item we knew by name, including one the page
+                # has only just started exposing an Alexa ID for
+                spare = [ha_id for ha_id in by_name.get(name, []) if ha_id not in key_by_id]
+                ha_id = spare[0] if len(spare) > 0 else uuid.uuid4().hex
+
+            key_by_id[ha_id] = key
+            name_by_id[ha_id] = name
+            ids.append(ha_id)
+
+        if key_by_id != self._key_by_id or name_by_id != self._name_by_id:
+            self._key_by_id = key_by_id
+            self._id_by_key = {key: ha_id for ha_id, key in key_by_id.items()}
+            self._name_by_id = name_by_id
+            self._dirty = True
+
+        return ids
+
+    # ============================================================
+    # Persistence
+
+
+    def load(self):
+        if self._path == None or not os.path.exists(self._path):
+            return
+
+        with open(self._path, 'r') as file:
+            data = json.load(file)
+
+        for ha_id, entry in data.items():
+            self._key_by_id[ha_id] = entry['key']
+            self._id_by_key[entry['key']] = ha_id
+            self._name_by_id[ha_id] = entry['name']
+        self._dirty = False
+
+
+    def save(self):
+        if self._path == None or self._dirty == False:
+            return
+
+        data = {
+            ha_id: {"key": key, "name": self._name_by_id[ha_id]}
+            for ha_id, key in self._key_by_id.items()
+        }
+        temp_path = self._path+".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(data, file, indent=4)
+        os.replace(temp_path, self._path)
+        self._dirty = False
+
+    # ============================================================
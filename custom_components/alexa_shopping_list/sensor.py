@@ -1,34 +1,45 @@
 #!/usr/bin/env python3
 
 import logging
-import json
 
 from homeassistant.components.sensor import (
     SensorDeviceClass,
-    SensorEntity
+    SensorEntity,
+    SensorStateClass
 )
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
 from . import DOMAIN
 
 _LOGGER = logging.getLogger(__name__)
 
+# key, name, icon, unit, device class, state class
+SENSORS = [
+    ("item_count", "Alexa Shopping List Items", "mdi:cart", "items", None, SensorStateClass.MEASUREMENT),
+    ("sync_duration", "Alexa Shopping List Sync Duration", "mdi:timer-outline", "s", SensorDeviceClass.DURATION, SensorStateClass.MEASUREMENT),
+    ("operations", "Alexa Shopping List Sync Operations", "mdi:swap-horizontal", "operations", None, SensorStateClass.MEASUREMENT),
+    ("pending", "Alexa Shopping List Pending Operations", "mdi:timer-sand", "operations", None, SensorStateClass.MEASUREMENT),
+    ("latency", "Alexa Shopping List Server Latency", "mdi:lan-pending", "ms", SensorDeviceClass.DURATION, SensorStateClass.MEASUREMENT),
+]
+
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Setup sensors from a config entry created in the integrations UI."""
 
-    alexa = hass.data[DOMAIN][config_entry.entry_id]
+    coordinator = hass.data[DOMAIN][config_entry.entry_id]
 
-    update_sensor = AlexaShoppingListSyncSensor(hass, alexa)
+    # Every sensor reads the coordinator's last result, none of them talk to the server
+    entities = [AlexaShoppingListSyncSensor(coordinator), AlexaShoppingListAuthSensor(coordinator)]
+    entities += [AlexaShoppingListSensor(coordinator, *sensor) for sensor in SENSORS]
 
-    async_add_entities([update_sensor], update_before_add=True)
+    async_add_entities(entities)
 
 
-class AlexaShoppingListSyncSensor(SensorEntity):
+class AlexaShoppingListSyncSensor(CoordinatorEntity, SensorEntity):
     """Synchronise HA and Alexa shopping lists"""
 
-    def __init__(self, hass, alexa):
-        self.hass = hass
-        self.alexa = alexa
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
 
         self._attr_name = "Alexa Shopping List Sync"
         self._attr_icon = "mdi:sync"
@@ -36,14 +47,57 @@ class AlexaShoppingListSyncSensor(SensorEntity):
         self._attr_device_class = SensorDeviceClass.TIMESTAMP
     
 
-    async def async_update(self) -> None:
-        try:
+    @property
+    def native_value(self):
+        return self.coordinator.data['last_synced']
+
+
+    @property
+    def extra_state_attributes(self):
+        return self.coordinator.data['sync_stats']
+
+
+class AlexaShoppingListSensor(CoordinatorEntity, SensorEntity):
+    """One value from the last sync"""
+
+    def __init__(self, coordinator, key, name, icon, unit, device_class, state_class):
+        super().__init__(coordinator)
+        self._key = key
+
+        self._attr_name = name
+        self._attr_icon = icon
+        self._attr_unique_id = "alexa_shopping_list_"+key
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_class = device_class
+        self._attr_state_class = state_class
+
+
+    @property
+    def native_value(self):
+        return self.coordinator.data[self._key]
+
+
+class AlexaShoppingListAuthSensor(CoordinatorEntity, SensorEntity):
+    """Whether the server's Amazon session is still signed in"""
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+
+        self._attr_name = "Alexa Shopping List Authentication"
+        self._attr_icon = "mdi:account-key"
+        self._attr_unique_id = "alexa_shopping_list_authentication"
+        self._attr_device_class = SensorDeviceClass.ENUM
+        self._attr_options = ["authenticated", "expired", "unknown"]
+
+
+    @property
+    def native_value(self):
+        authenticated = self.coordinator.data['authenticated']
+        if authenticated == None:
+            return "unknown"
+        return "authenticated" if authenticated else "expired"
 
-            updated = await self.alexa.sync(_LOGGER)
-            if updated == True:
-                _LOGGER.debug("Firing alexa_shopping_list_changed event")
-                self.hass.bus.async_fire("alexa_shopping_list_changed")
 
-        except Exception as e:
-            _LOGGER.error(f"Alexa Shopping List Sync Error: {e}", exc_info=True)
-        self._attr_native_value = self.alexa.last_updated
+    @property
+    def extra_state_attributes(self):
+        return {"expires": self.coordinator.data['auth_expires']}
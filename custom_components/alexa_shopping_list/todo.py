@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import logging
+
+from homeassistant.components.todo import (
+    TodoItem,
+    TodoItemStatus,
+    TodoListEntity,
+    TodoListEntityFeature
+)
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from . import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_setup_entry(hass, config_entry, async_add_entities):
+    """Setup the todo list from a config entry created in the integrations UI."""
+
+    coordinator = hass.data[DOMAIN][config_entry.entry_id]
+    async_add_entities([AlexaShoppingListTodoEntity(coordinator)])
+
+
+class AlexaShoppingListTodoEntity(CoordinatorEntity, TodoListEntity):
+    """The Alexa list itself, read from the integration's cached copy"""
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.alexa = coordinator.alexa
+
+        self._attr_name = "Alexa Shopping List"
+        self._attr_icon = "mdi:cart"
+        self._attr_unique_id = "alexa_shopping_list_todo"
+        self._attr_supported_features = (
+            TodoListEntityFeature.CREATE_TODO_ITEM
+            | TodoListEntityFeature.UPDATE_TODO_ITEM
+            | TodoListEntityFeature.DELETE_TODO_ITEM
+        )
+
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        await self.hass.async_add_executor_job(self.alexa.load_registry)
+
+
+    @property
+    def todo_items(self):
+        # Includes changes still on their way to Alexa
+        return [
+            TodoItem(summary=item, uid=ha_id, status=self._status(item))
+            for ha_id, item in self.alexa.item_ids()
+        ]
+
+
+    def _status(self, item):
+        if self.alexa.is_completed(item):
+            return TodoItemStatus.COMPLETED
+        return TodoItemStatus.NEEDS_ACTION
+
+
+    async def async_create_todo_item(self, item):
+        await self.alexa.add_item(item.summary)
+        self.async_write_ha_state()
+
+
+    async def async_update_todo_item(self, item):
+        # We can't tick items off on Alexa, so completing one takes it off the list
+        completed = self.alexa.is_completed(self.alexa.item_name(item.uid))
+        if item.status == TodoItemStatus.COMPLETED and not completed:
+            await self.alexa.remove_items([item.uid])
+        elif item.status == TodoItemStatus.NEEDS_ACTION and completed:
+            await self.alexa.untick_item(item.uid)
+        elif item.summary != None:
+            await self.alexa.update_item(item.uid, item.summary)
+        self.async_write_ha_state()
+
+
+    async def async_delete_todo_items(self, uids):
+        await self.alexa.remove_items(uids)
+        self.async_write_ha_state()
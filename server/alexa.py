@@ -7,18 +7,59 @@ from selenium.webdriver.common.actions.wheel_input import ScrollOrigin
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException
+from selenium.common.exceptions import WebDriverException
+from alexa_scripts import LIST_MACRO, MACRO_TIMEOUT, ROW_RECORDS, LIST_COUNT, SCROLL_TO_OFFSET, ROW_BY_TITLE, SCROLL_PAST_RENDERED, selenium_async, selenium_sync
+from list_payload import LIST_PAYLOAD_URL, merge_list_records, record_titles, add_record, known_tail
+from matching import ItemMatcher
+from chrome_profile import ChromeProfile
 import time
 import json
 import os
+import base64
 
 WAIT_TIMEOUT=30
+LIST_SETTLE_TIME=5
+
+DEFAULT_LIST="shopping"
+ALEXA_LISTS = {
+    "shopping": "/alexaquantum/sp/alexaShoppingList?ref=nav_asl",
+    "todo": "/alexaquantum/sp/alexaToDoList?ref=nav_asl",
+}
+
+# Where each item sat in the list when it was last read, by list and matching key.
+# Kept between instances, the server starts a new browser for most jobs.
+_item_offsets = {}
+
+class ScrapePreempted(Exception):
+    """Raised between scroll steps when the server has more urgent browser work"""
+    pass
+
+
+def write_json_atomic(path: str, data):
+    # Write alongside and swap into place, so a crash mid-write can't leave a truncated file
+    temp_path = path+".tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(temp_path, path)
+
 
 class AlexaShoppingList:
 
-    def __init__(self, amazon_url: str = "amazon.co.uk", cookies_path: str = ""):
+    def __init__(self, amazon_url: str = "amazon.co.uk", cookies_path: str = "", network_capture: bool = False, profile_path: str = "", profile_max_mb: int = 500, remote_url: str = "", debugger_address: str = "", session_store=None):
         self.amazon_url = amazon_url
         self.cookies_path = cookies_path
+        self.session_store = session_store
+        self.network_capture = network_capture
+        self.profile_path = profile_path
+        self.profile_max_mb = profile_max_mb
+        self.remote_url = remote_url
+        self.debugger_address = debugger_address
+        self.startup_seconds = None
+        self.should_yield = None
+        self.matcher = ItemMatcher()
+        # A standby server's browser must never overwrite the leader's saved session
+        self.save_sessions = True
+        self._discovered_lists = {}
         self._setup_driver()
 
 
@@ -35,11 +76,18 @@ class AlexaShoppingList:
     def _is_debug_mode(self):
         return os.environ.get("ALEXA_SHOPPING_LIST_DEBUG", "0") == "1"
 
+    def _amazon_base_url(self):
+        # Lets the server be pointed at a local stand-in for the Amazon pages
+        return os.environ.get("ASL_AMAZON_BASE_URL", "https://www."+self.amazon_url)
+
+    def is_remote(self):
+        return self.remote_url != "" or self.debugger_address != ""
+
     # ============================================================
     # Selenium
 
 
-    def _setup_driver(self):
+    def _chrome_options(self, profile: ChromeProfile = None):
         user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
 
         chrome_options = Options()
@@ -50,16 +98,67 @@ class AlexaShoppingList:
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-dev-shm-usage")
         chrome_options.add_argument(f"--user-agent={user_agent}")
+        if self.network_capture:
+            chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+        if profile != None:
+            chrome_options.add_argument("--user-data-dir="+profile.path)
+            chrome_options.add_argument("--disk-cache-size="+str(profile.cache_size_bytes()))
+
+        if self.debugger_address != "":
+            # Attach to a chrome someone else started with --remote-debugging-port
+            chrome_options = Options()
+            chrome_options.debugger_address = self.debugger_address
+            if self.network_capture:
+                chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        return chrome_options
+
+
+    def _start_chrome(self, chrome_options: Options):
+        if self.remote_url != "":
+            return webdriver.Remote(command_executor=self.remote_url, options=chrome_options)
 
         driver_path = os.environ.get("CHROME_DRIVER", "")
         if driver_path != "":
             service = webdriver.ChromeService(executable_path=driver_path)
-            self.driver = webdriver.Chrome(service=service, options=chrome_options)
-        else:
-            self.driver = webdriver.Chrome(options=chrome_options)
+            return webdriver.Chrome(service=service, options=chrome_options)
+        return webdriver.Chrome(options=chrome_options)
+
+
+    def _acquire_profile(self):
+        # A remote browser keeps its own profile on its own machine
+        if self.profile_path == "" or self.is_remote():
+            return None
+
+        profile = ChromeProfile(self.profile_path, self.profile_max_mb)
+        if profile.acquire() == False:
+            print("\nChrome profile is in use, starting with a clean profile")
+            return None
+
+        profile.prune()
+        return profile
+
+
+    def _setup_driver(self):
+        started = time.time()
+
+        self._profile = self._acquire_profile()
+        try:
+            self.driver = self._start_chrome(self._chrome_options(self._profile))
+        except Exception as e:
+            if self._profile == None:
+                raise
+            # A damaged profile shouldn't stop us working, fall back to a throwaway one
+            print("\nUnable to start chrome with the saved profile, starting with a clean profile: "+str(e))
+            self._profile.release()
+            self._profile = None
+            self.driver = self._start_chrome(self._chrome_options())
+
+        # In-page macros wait for the DOM themselves, allow for each of their retries
+        self.driver.set_script_timeout(WAIT_TIMEOUT * 2)
 
         self.is_authenticated = False
-        self._selenium_get("https://www."+self.amazon_url, (By.TAG_NAME, 'body'))
+        self._selenium_get(self._amazon_base_url(), (By.TAG_NAME, 'body'))
         self._load_cookies()
 
         if len(self.driver.find_elements(By.ID, 'nav-backup-backup')) > 0:
@@ -75,12 +174,39 @@ class AlexaShoppingList:
         else:
             self.is_authenticated = True
 
+        self.startup_seconds = round(time.time() - started, 3)
 
 
     def _clear_driver(self):
         if hasattr(self, "driver"):
-            self.save_session()
-            self.driver.close()
+            if self.is_remote():
+                # The remote session may already be gone, and quitting frees its slot.
+                # An attached chrome keeps running, only chromedriver lets go of it
+                try:
+                    self.save_session()
+                    self.driver.quit()
+                except WebDriverException:
+                    pass
+            else:
+                self.save_session()
+                self.driver.close()
+            del self.driver
+
+        if getattr(self, "_profile", None) != None:
+            self._profile.release()
+            self._profile = None
+
+
+    def close(self):
+        self._clear_driver()
+
+
+    def session_alive(self):
+        try:
+            self.driver.current_url
+        except WebDriverException:
+            return False
+        return True
 
 
     def _selenium_wait_element(self, element: tuple):
@@ -109,11 +235,26 @@ class AlexaShoppingList:
         return os.path.join(self._get_file_location(), "cookies.json")
 
 
-    def _load_cookies(self):
-        if os.path.exists(self._cookie_cache_path()):
+    def _read_cookies(self):
+        # The server keeps the session in its store, on our own it's a cookies.json
+        if self.session_store != None:
+            return self.session_store.load_cookies()
+        if not os.path.exists(self._cookie_cache_path()):
+            return None
+        with open(self._cookie_cache_path(), 'r') as file:
+            return json.load(file)
 
-            with open(self._cookie_cache_path(), 'r') as file:
-                cookies = json.load(file)
+
+    def _write_cookies(self, cookies):
+        if self.session_store != None:
+            self.session_store.save_cookies(cookies)
+        else:
+            write_json_atomic(self._cookie_cache_path(), cookies)
+
+
+    def _load_cookies(self):
+        cookies = self._read_cookies()
+        if cookies != None:
 
             for cookie in cookies:
                 self.driver.add_cookie(cookie)
@@ -140,140 +281,290 @@ class AlexaShoppingList:
     
 
     def save_session(self):
-        if self.is_authenticated:
-            with open(self._cookie_cache_path(), 'w') as file:
-                json.dump(self.driver.get_cookies(), file)
+        if self.is_authenticated and self.save_sessions:
+            self._write_cookies(self.driver.get_cookies())
+
+
+    def refresh_session(self):
+        # Loading a signed in page is enough for amazon to rotate the session cookies
+        self._selenium_get(self._amazon_base_url(), (By.TAG_NAME, 'body'))
+        if len(self.driver.find_elements(By.CLASS_NAME, 'nav-action-signin-button')) > 0:
+            self.is_authenticated = False
+        self.save_session()
+        return self.is_authenticated
+
+    def reload_session(self):
+        # Pick up the cookies another server instance saved while this browser sat idle
+        self._load_cookies()
+        self.is_authenticated = len(self.driver.find_elements(By.CLASS_NAME, 'nav-action-signin-button')) == 0
+        return self.is_authenticated
+
+    # ============================================================
+    # Network capture
+
+
+    def _can_capture(self):
+        # Response bodies are read over CDP, which webdriver.Remote doesn't offer
+        return self.network_capture and hasattr(self.driver, "execute_cdp_cmd")
+
+
+    def _clear_captured_network(self):
+        if self._can_capture():
+            self.driver.get_log("performance")
+
+
+    def _captured_list_responses(self):
+        # Wait for the list data requests the page made while loading to finish
+        deadline = time.time() + LIST_SETTLE_TIME
+        pending = []
+        finished = []
+        while time.time() < deadline:
+            for entry in self.driver.get_log("performance"):
+                message = json.loads(entry['message'])['message']
+                params = message.get('params', {})
+                if message['method'] == 'Network.responseReceived':
+                    if LIST_PAYLOAD_URL.search(params['response']['url']) and 'json' in params['response'].get('mimeType', ''):
+                        pending.append(params['requestId'])
+                elif message['method'] == 'Network.loadingFinished' and params.get('requestId') in pending:
+                    pending.remove(params['requestId'])
+                    finished.append(params['requestId'])
+
+            if len(finished) > 0 and len(pending) == 0:
+                break
+            time.sleep(0.25)
+        return finished
+
+
+    def _read_captured_list(self):
+        payloads = []
+        for request_id in self._captured_list_responses():
+            try:
+                response = self.driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+                body = response['body']
+                if response.get('base64Encoded'):
+                    body = base64.b64decode(body).decode('utf-8')
+                payloads.append(json.loads(body))
+            except Exception:
+                continue
+        return merge_list_records(payloads)
 
     # ============================================================
     # Alexa lists
 
 
-    def _ensure_driver_is_on_alexa_list(self, refresh: bool = False):
-        list_url = "https://www."+self.amazon_url+"/alexaquantum/sp/alexaShoppingList?ref=nav_asl"
+    def _alexa_list_url(self, list_name: str = DEFAULT_LIST):
+        if list_name in ALEXA_LISTS:
+            path = ALEXA_LISTS[list_name]
+        elif list_name in self._discovered_lists:
+            path = self._discovered_lists[list_name]
+        else:
+            return None
+        return self._amazon_base_url()+path
+
+
+    def _ensure_driver_is_on_alexa_list(self, refresh: bool = False, list_name: str = DEFAULT_LIST):
+        list_url = self._alexa_list_url(list_name)
         if self.driver.current_url != list_url:
+            self._clear_captured_network()
             self._selenium_get(list_url, (By.CLASS_NAME, 'virtual-list'))
+            return True
         elif refresh == True:
+            self._clear_captured_network()
             self.driver.refresh()
             self._selenium_wait_element((By.CLASS_NAME, 'virtual-list'))
+            return True
+        return False
+
+
+    def get_alexa_lists(self):
+        # Custom lists are linked from the navigation of the list pages themselves,
+        # so open the default list and collect every link that points at another list
+        self._ensure_driver_is_on_alexa_list(False)
+
+        found = {name: path for name, path in ALEXA_LISTS.items()}
+        for link in self.driver.find_elements(By.CSS_SELECTOR, 'a[href*="/alexaquantum/sp/"]'):
+            href = link.get_attribute('href') or ""
+            name = (link.get_attribute('innerText') or "").strip()
+            path = href[href.index("/alexaquantum/sp/"):]
+            if name == "" or path in found.values():
+                continue
+            found[name] = path
+
+        self._discovered_lists = {name: path for name, path in found.items() if name not in ALEXA_LISTS}
+        return list(found.keys())
+
+
+    def has_alexa_list(self, list_name: str):
+        if self._alexa_list_url(list_name) == None:
+            self.get_alexa_lists()
+        return self._alexa_list_url(list_name) != None
+
+
+    def get_alexa_list(self, refresh: bool = True, list_name: str = DEFAULT_LIST, detailed: bool = False, known: list = None):
+        """With the records of an earlier read as known, stop scrolling once the list matches them"""
+        records = self._scrape_alexa_list(refresh, list_name, known)
+        if detailed:
+            return records
+        return record_titles(records)
 
 
-    def get_alexa_list(self, refresh: bool = True):
-        self._ensure_driver_is_on_alexa_list(refresh)
+    def _scrape_alexa_list(self, refresh: bool, list_name: str, known: list = None):
+        loaded = self._ensure_driver_is_on_alexa_list(refresh, list_name)
+
+        if loaded and self._can_capture():
+            # The page fetched the whole list as JSON while loading, no need to scroll for it
+            captured = self._read_captured_list()
+            if captured != None:
+                return captured
+
         time.sleep(5)
 
         list_container = self.driver.find_element(By.CLASS_NAME, 'virtual-list')
+        count = self.driver.execute_script(selenium_sync(LIST_COUNT), {}) if known != None else None
 
         found = []
         last = None
         while True:
-            list_items = list_container.find_elements(By.CLASS_NAME, 'item-title')
-            for item in list_items:
-                if item.get_attribute('innerText') not in found:
-                    found.append(item.get_attribute('innerText'))
-            if not list_items or last == list_items[-1]:
+            # One call reads every rendered row and scrolls the last one into view
+            rows = self.driver.execute_script(selenium_sync(ROW_RECORDS), {"scroll": True})
+            self._remember_offsets(list_name, rows)
+            for record in rows:
+                add_record(found, record)
+            tail = known_tail(found, known)
+            if tail != None and (count == None or len(found) + len(tail) == count):
+                # The rest of the list hasn't changed since the known read
+                found += tail
+                break
+            if not rows or last == rows[-1]['title']:
                 # We've reached the end
                 break
-            last = list_items[-1]
-            self.driver.execute_script("arguments[0].scrollIntoView();", last)
+            last = rows[-1]['title']
             time.sleep(1)
+            self._yield_point(list_container)
 
         if not refresh:
-            # Now let's scroll back to the top
-            first = None
-            while True:
-                list_items = list_container.find_elements(By.CLASS_NAME, 'item-title')
-                if not list_items or first == list_items[0]:
-                    # We've reached the top
-                    break
-                first = list_items[0]
-                scroll_origin = ScrollOrigin.from_element(first)
-                ActionChains(self.driver).scroll_from_origin(scroll_origin, 0, -1000).perform()
+            self._scroll_alexa_list_to_top(list_container)
 
         return found
 
 
-    def _get_alexa_list_item_element(self, item: str):
-        self._ensure_driver_is_on_alexa_list(False)
-        time.sleep(5)
+    def _scroll_alexa_list_to_top(self, list_container):
+        first = None
+        while True:
+            list_items = list_container.find_elements(By.CLASS_NAME, 'item-title')
+            if not list_items or first == list_items[0]:
+                # We've reached the top
+                break
+            first = list_items[0]
+            scroll_origin = ScrollOrigin.from_element(first)
+            ActionChains(self.driver).scroll_from_origin(scroll_origin, 0, -1000).perform()
+
+
+    def _yield_point(self, list_container):
+        if self.should_yield == None or self.should_yield() == False:
+            return
+        # Leave the list the way a fresh page has it for whoever runs next
+        self._scroll_alexa_list_to_top(list_container)
+        raise ScrapePreempted()
+
+
+    def read_alexa_lists(self, list_names: list, detailed: bool = False, known: dict = None):
+        found = {}
+        for list_name in list_names:
+            found[list_name] = self.get_alexa_list(True, list_name, detailed, (known or {}).get(list_name))
+        return found
+
+
+    def _remember_offsets(self, list_name: str, rows: list):
+        offsets = _item_offsets.setdefault(list_name, {})
+        for row in rows:
+            offset = row.pop('offset', None)
+            if offset != None:
+                offsets[self.matcher.key(row['title'])] = offset
+
+
+    def _rendered_row(self, titles: list, item: str):
+        match = item if item in titles else next((title for title in titles if self.matcher.same(title, item)), None)
+        if match == None:
+            return None
+        return self.driver.execute_script(selenium_sync(ROW_BY_TITLE), {"title": match})
+
+
+    def _get_alexa_list_item_element(self, item: str, list_name: str = DEFAULT_LIST):
+        if self._ensure_driver_is_on_alexa_list(False, list_name):
+            time.sleep(5)
+
+        # Go straight to where the last read saw it, and check it is still there
+        offset = _item_offsets.get(list_name, {}).get(self.matcher.key(item))
+        if offset != None:
+            titles = self.driver.execute_async_script(selenium_async(SCROLL_TO_OFFSET), {"offset": offset})
+            element = self._rendered_row(titles, item)
+            if element != None:
+                return element
+
+        # Otherwise search from the top, learning where everything is on the way
         list_container = self.driver.find_element(By.CLASS_NAME, 'virtual-list')
+        self.driver.execute_script("arguments[0].scrollTop = 0;", list_container)
 
         last = None
         while True:
-            list_items = list_container.find_elements(By.CLASS_NAME, 'inner')
-            for container in list_items:
-                title_element = container.find_element(By.CLASS_NAME, 'item-title')
-                if title_element.get_attribute('innerText') == item:
-                    return container  # Return immediately when found
-
-            if not list_items or last == list_items[-1]:
-                # We've reached the top
+            rows = self.driver.execute_script(selenium_sync(ROW_RECORDS), {"scroll": False})
+            self._remember_offsets(list_name, rows)
+            element = self._rendered_row([row['title'] for row in rows], item)
+            if element != None:
+                return element
+
+            if not rows or last == rows[-1]['title']:
+                # We've reached the bottom
                 break
 
-            last = list_items[-1]
-            self.driver.execute_script("arguments[0].scrollIntoView();", last)
+            last = rows[-1]['title']
+            self.driver.execute_script(selenium_sync(SCROLL_PAST_RENDERED), {})
             time.sleep(1)
 
         return None
 
 
-    def add_alexa_list_item(self, item: str):
-        element = self._get_alexa_list_item_element(item)
-        if element != None:
-            return
+    def _run_list_macro(self, op: str, **kwargs):
+        # One round trip: the page performs the change and waits for it to show up
+        result = self.driver.execute_async_script(
+            selenium_async(LIST_MACRO),
+            {"op": op, "timeout": MACRO_TIMEOUT * 1000, **kwargs}
+        )
+        if result == None or result.get('ok') != True:
+            print("\nList "+op+" failed: "+str(result.get('error') if result != None else None))
+        return result
 
-        self.driver.find_element(By.CLASS_NAME, 'list-header').find_element(By.CLASS_NAME, 'add-symbol').click()
 
-        textfield = self.driver.find_element(By.CLASS_NAME, 'list-header').find_element(By.CLASS_NAME, 'input-box').find_element(By.TAG_NAME, 'input')
-        textfield.send_keys(item)
+    def _element_title(self, element):
+        # The item as the page spells it, which may only match the request after normalising
+        return element.find_element(By.CLASS_NAME, 'item-title').get_attribute('innerText')
 
-        submit = self.driver.find_element(By.CLASS_NAME, 'list-header').find_element(By.CLASS_NAME, 'add-to-list').find_element(By.TAG_NAME, 'button')
-        submit.click()
 
-        self.driver.find_element(By.CLASS_NAME, 'list-header').find_element(By.CLASS_NAME, 'cancel-input').click()
-        time.sleep(1)
+    def add_alexa_list_item(self, item: str, list_name: str = DEFAULT_LIST):
+        element = self._get_alexa_list_item_element(item, list_name)
+        if element != None:
+            return
 
-        return self.get_alexa_list(False)
+        self._run_list_macro("add", item=item)
+        return self.get_alexa_list(False, list_name)
 
 
-    def update_alexa_list_item(self, old: str, new: str):
-        element = self._get_alexa_list_item_element(old)
+    def update_alexa_list_item(self, old: str, new: str, list_name: str = DEFAULT_LIST):
+        element = self._get_alexa_list_item_element(old, list_name)
         if element == None:
             return
 
-        element.find_element(By.CLASS_NAME, 'item-actions-1').find_element(By.TAG_NAME, 'button').click()
-
-        textfield = element.find_element(By.CLASS_NAME, 'input-box').find_element(By.TAG_NAME, 'input')
-        textfield.clear()
-        textfield.send_keys(new)
+        self._run_list_macro("update", old=self._element_title(element), new=new)
+        return self.get_alexa_list(False, list_name)
 
-        element.find_element(By.CLASS_NAME, 'item-actions-2').find_element(By.TAG_NAME, 'button').click()
-        time.sleep(1)
 
-        return self.get_alexa_list(False)
+    def remove_alexa_list_item(self, item: str, list_name: str = DEFAULT_LIST):
+        element = self._get_alexa_list_item_element(item, list_name)
+        if element is None:
+            return None
 
-
-    def remove_alexa_list_item(self, item: str):
-        # In large lists, items towards the end are sometimes not found on the first try
-        # In cases like these, retry if the element is not found
-        retries = 3
-        while retries > 0:
-            element = self._get_alexa_list_item_element(item)
-            
-            if element is None:
-                return None
-            
-            try:
-                # Find the delete button and click it
-                delete_button = element.find_element(By.CLASS_NAME, 'item-actions-2').find_element(By.TAG_NAME, 'button')
-                delete_button.click()
-                break
-            except StaleElementReferenceException:
-                retries -= 1
-                time.sleep(1)
-            except Exception as e:
-                return None
-        
-        time.sleep(1)  # Wait for the list to update
-        return self.get_alexa_list(False)
+        self._run_list_macro("remove", item=self._element_title(element))
+        return self.get_alexa_list(False, list_name)
 
     # ============================================================
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from alexa import DEFAULT_LIST, ALEXA_LISTS, ScrapePreempted
+from matching import ItemMatcher
+from list_payload import known_tail, record_titles
+
+# An in-memory stand-in for AlexaShoppingList, selected with browser_backend "fake".
+# It answers like the real thing after a configurable delay, so the server can be
+# load tested without chrome or an amazon account.
+
+# Items read per simulated scroll step, the same point the real scrape can be preempted
+SCROLL_STEP_ITEMS = 10
+
+# The lists outlive each instance, the server creates a new "browser" for every job
+_lists = {name: [] for name in ALEXA_LISTS}
+_lock = threading.Lock()
+
+
+def reset_fake_lists(lists: dict = None):
+    with _lock:
+        _lists.clear()
+        for name in ALEXA_LISTS:
+            _lists[name] = []
+        for name, items in (lists or {}).items():
+            _lists[name] = list(items)
+
+
+class FakeAlexaShoppingList:
+
+    def __init__(self, latency_ms: int = 200, scroll_latency_ms: int = 20):
+        self.latency = latency_ms / 1000
+        self.scroll_latency = scroll_latency_ms / 1000
+        self.is_authenticated = True
+        self.should_yield = None
+        self.matcher = ItemMatcher()
+        self.save_sessions = True
+        self.startup_seconds = 0
+        # Steps the last read walked, for comparing full and incremental reads
+        self.scroll_steps = 0
+        self._sleep(self.latency)
+
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+    def close(self):
+        pass
+
+
+    def is_remote(self):
+        return False
+
+
+    def session_alive(self):
+        return True
+
+    # ============================================================
+    # Session
+
+
+    def requires_login(self):
+        return False
+
+
+    def save_session(self):
+        pass
+
+
+    def refresh_session(self):
+        self._sleep(self.latency)
+        return True
+
+
+    def reload_session(self):
+        return True
+
+    # ============================================================
+    # Alexa lists
+
+
+    def get_alexa_lists(self):
+        self._sleep(self.latency)
+        with _lock:
+            return list(_lists.keys())
+
+
+    def has_alexa_list(self, list_name: str):
+        with _lock:
+            return list_name in _lists
+
+
+    def get_alexa_list(self, refresh: bool = True, list_name: str = DEFAULT_LIST, detailed: bool = False, known: list = None):
+        self._sleep(self.latency)
+        with _lock:
+            items = list(_lists[list_name])
+        records = [{"title": item, "completed": False, "quantity": None, "id": None} for item in items]
+
+        # Walk the list a step at a time like the real scrape, giving way when asked
+        found = []
+        self.scroll_steps = 0
+        for step in range(0, len(records), SCROLL_STEP_ITEMS):
+            found += records[step:step + SCROLL_STEP_ITEMS]
+            self.scroll_steps += 1
+            tail = known_tail(found, known)
+            if tail != None and len(found) + len(tail) == len(records):
+                found += tail
+                break
+            self._sleep(self.scroll_latency)
+            if self.should_yield != None and self.should_yield():
+                raise ScrapePreempted()
+
+        if detailed:
+            return found
+        return record_titles(found)
+
+
+    def read_alexa_lists(self, list_names: list, detailed: bool = False, known: dict = None):
+        return {name: self.get_alexa_list(True, name, detailed, (known or {}).get(name)) for name in list_names}
+
+    # ============================================================
+    # Items
+
+
+    def add_alexa_list_item(self, item: str, list_name: str = DEFAULT_LIST):
+        self._sleep(self.latency)
+        with _lock:
+            if item in self.matcher.index(_lists[list_name]):
+                return None
+            _lists[list_name].insert(0, item)
+            return list(_lists[list_name])
+
+
+    def update_alexa_list_item(self, old: str, new: str, list_name: str = DEFAULT_LIST):
+        self._sleep(self.latency)
+        with _lock:
+            items = _lists[list_name]
+            old = self.matcher.index(items).find(old)
+            if old == None:
+                return None
+            items[items.index(old)] = new
+            return list(items)
+
+
+    def remove_alexa_list_item(self, item: str, list_name: str = DEFAULT_LIST):
+        self._sleep(self.latency)
+        with _lock:
+            item = self.matcher.index(_lists[list_name]).find(item)
+            if item == None:
+                return None
+            _lists[list_name].remove(item)
+            return list(_lists[list_name])
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+from playwright.async_api import async_playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from alexa import DEFAULT_LIST, ALEXA_LISTS, ScrapePreempted, write_json_atomic
+from alexa_scripts import LIST_MACRO, MACRO_TIMEOUT, ROW_RECORDS, LIST_COUNT, SCROLL_TO_OFFSET
+from matching import ItemMatcher
+from list_payload import LIST_PAYLOAD_URL, merge_list_records, record_titles, add_record, known_tail
+import asyncio
+import json
+import os
+import re
+
+WAIT_TIMEOUT=30
+SETTLE_TIMEOUT=5
+SCROLL_TIMEOUT=1
+
+# Where each item sat in the list when it was last read, by list and matching key
+_item_offsets = {}
+
+class AsyncAlexaShoppingList:
+    """Playwright implementation of AlexaShoppingList, for use inside an asyncio event loop"""
+
+    def __init__(self, amazon_url: str = "amazon.co.uk", cookies_path: str = "", network_capture: bool = False, cdp_url: str = "", session_store=None):
+        self.amazon_url = amazon_url
+        self.cookies_path = cookies_path
+        self.session_store = session_store
+        self.network_capture = network_capture
+        self.cdp_url = cdp_url
+        self._discovered_lists = {}
+        self.is_authenticated = False
+        self.should_yield = None
+        self.matcher = ItemMatcher()
+        self.save_sessions = True
+
+
+    async def start(self):
+        await self._setup_browser()
+
+
+    async def close(self):
+        await self._clear_browser()
+
+    # ============================================================
+    # Helpers
+
+
+    def _get_file_location(self):
+        return os.path.dirname(os.path.realpath(__file__))
+
+    def _is_debug_mode(self):
+        return os.environ.get("ALEXA_SHOPPING_LIST_DEBUG", "0") == "1"
+
+    def _amazon_base_url(self):
+        # Lets the server be pointed at a local stand-in for the Amazon pages
+        return os.environ.get("ASL_AMAZON_BASE_URL", "https://www."+self.amazon_url)
+
+    # ============================================================
+    # Playwright
+
+
+    async def _setup_browser(self):
+        user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36"
+
+        # Reuse the system chromium the docker image already ships, when there is one
+        executable_path = os.environ.get("CHROME_BIN", "")
+
+        self._playwright = await async_playwright().start()
+        if self.cdp_url != "":
+            # A chrome started elsewhere with --remote-debugging-port, we get our own context in it
+            self.browser = await self._playwright.chromium.connect_over_cdp(self.cdp_url)
+        else:
+            self.browser = await self._playwright.chromium.launch(
+                headless=self._is_debug_mode() == False,
+                executable_path=executable_path if executable_path != "" else None,
+                args=["--disable-gpu", "--no-sandbox", "--disable-dev-shm-usage"]
+            )
+        self.context = await self.browser.new_context(
+            user_agent=user_agent,
+            viewport={"width": 1366, "height": 768}
+        )
+        self.context.set_default_timeout(WAIT_TIMEOUT * 1000)
+        await self._load_cookies()
+
+        self.page = await self.context.new_page()
+        await self.page.goto(self._amazon_base_url())
+        await self.page.locator('body').wait_for(state="attached")
+
+        if await self.page.locator('#nav-backup-backup').count() > 0:
+            # See AlexaShoppingList._setup_driver, the same english-only workaround
+            await self.page.locator('.nav-bb-right').get_by_role("link", name="Your Account").click()
+            await self.page.wait_for_load_state()
+
+        if await self.page.locator('.nav-action-signin-button').count() > 0:
+            await self.page.locator('#nav-link-accountList').click()
+            await self.page.wait_for_load_state()
+        else:
+            self.is_authenticated = True
+
+
+    def is_remote(self):
+        return self.cdp_url != ""
+
+
+    async def session_alive(self):
+        return self.browser.is_connected()
+
+
+    async def _clear_browser(self):
+        if hasattr(self, "browser"):
+            if self.browser.is_connected():
+                await self.save_session()
+            # Over CDP this only closes our context and disconnects, the shared chrome keeps running
+            await self.browser.close()
+            await self._playwright.stop()
+            del self.browser
+
+
+    def _cookie_cache_path(self):
+        if self.cookies_path != "":
+            return os.path.join(self.cookies_path, "cookies.json")
+        return os.path.join(self._get_file_location(), "cookies.json")
+
+
+    def _read_cookies(self):
+        # Shared with the selenium backend through the server's store or cookies.json
+        if self.session_store != None:
+            return self.session_store.load_cookies()
+        if not os.path.exists(self._cookie_cache_path()):
+            return None
+        with open(self._cookie_cache_path(), 'r') as file:
+            return json.load(file)
+
+
+    def _write_cookies(self, cookies):
+        if self.session_store != None:
+            self.session_store.save_cookies(cookies)
+        else:
+            write_json_atomic(self._cookie_cache_path(), cookies)
+
+
+    def _cookie_from_selenium(self, cookie):
+        # cookies.json is written in selenium's format so both backends can share it
+        converted = {
+            "name": cookie['name'],
+            "value": cookie['value'],
+            "domain": cookie['domain'],
+            "path": cookie.get('path', "/"),
+            "httpOnly": cookie.get('httpOnly', False),
+            "secure": cookie.get('secure', False),
+        }
+        if 'expiry' in cookie:
+            converted['expires'] = cookie['expiry']
+        if cookie.get('sameSite') in ["Strict", "Lax", "None"]:
+            converted['sameSite'] = cookie['sameSite']
+        return converted
+
+
+    def _cookie_to_selenium(self, cookie):
+        converted = {
+            "name": cookie['name'],
+            "value": cookie['value'],
+            "domain": cookie['domain'],
+            "path": cookie['path'],
+            "httpOnly": cookie['httpOnly'],
+            "secure": cookie['secure'],
+            "sameSite": cookie['sameSite'],
+        }
+        if cookie.get('expires', -1) > 0:
+            converted['expiry'] = int(cookie['expires'])
+        return converted
+
+
+    async def _load_cookies(self):
+        cookies = self._read_cookies()
+        if cookies != None:
+            await self.context.add_cookies([self._cookie_from_selenium(cookie) for cookie in cookies])
+
+    # ============================================================
+    # Authentication
+
+
+    async def requires_login(self):
+        if 'ap/signin' in self.page.url:
+            return True
+
+        if await self.page.locator('.nav-action-signin-button').count() > 0:
+            return True
+
+        if self.is_authenticated == False:
+            return True
+
+        return False
+
+
+    async def save_session(self):
+        if self.is_authenticated and self.save_sessions:
+            cookies = await self.context.cookies()
+            self._write_cookies([self._cookie_to_selenium(cookie) for cookie in cookies])
+
+
+    async def refresh_session(self):
+        # Loading a signed in page is enough for amazon to rotate the session cookies
+        await self.page.goto(self._amazon_base_url())
+        if await self.page.locator('.nav-action-signin-button').count() > 0:
+            self.is_authenticated = False
+        await self.save_session()
+        return self.is_authenticated
+
+
+    async def reload_session(self):
+        await self._load_cookies()
+        await self.page.goto(self._amazon_base_url())
+        self.is_authenticated = await self.page.locator('.nav-action-signin-button').count() == 0
+        return self.is_authenticated
+
+    # ============================================================
+    # Alexa lists
+
+
+    def _alexa_list_url(self, list_name: str = DEFAULT_LIST):
+        if list_name in ALEXA_LISTS:
+            path = ALEXA_LISTS[list_name]
+        elif list_name in self._discovered_lists:
+            path = self._discovered_lists[list_name]
+        else:
+            return None
+        return self._amazon_base_url()+path
+
+
+    async def _ensure_page_is_on_alexa_list(self, page, refresh: bool = False, list_name: str = DEFAULT_LIST):
+        list_url = self._alexa_list_url(list_name)
+        responses = []
+        loaded = True
+
+        def capture(response):
+            if LIST_PAYLOAD_URL.search(response.url):
+                responses.append(response)
+
+        page.on("response", capture)
+        try:
+            if page.url != list_url:
+                await page.goto(list_url)
+            elif refresh == True:
+                await page.reload()
+            else:
+                loaded = False
+
+            # Instead of sleeping, wait for the list to settle. Amazon keeps polling in the
+            # background, so don't wait any longer than the selenium backend would have slept
+            await page.locator('.virtual-list').wait_for(state="attached")
+            try:
+                await page.wait_for_load_state("networkidle", timeout=SETTLE_TIMEOUT * 1000)
+            except PlaywrightTimeoutError:
+                pass
+        finally:
+            page.remove_listener("response", capture)
+
+        # The list data responses seen while (re)loading, or None when the page wasn't loaded
+        if loaded == False:
+            return None
+        return responses
+
+
+    async def _read_captured_list(self, responses):
+        payloads = []
+        for response in responses:
+            try:
+                payloads.append(await response.json())
+            except Exception:
+                continue
+        return merge_list_records(payloads)
+
+
+    async def get_alexa_lists(self):
+        await self._ensure_page_is_on_alexa_list(self.page, False)
+
+        found = {name: path for name, path in ALEXA_LISTS.items()}
+        links = await self.page.locator('a[href*="/alexaquantum/sp/"]').evaluate_all(
+            "links => links.map(link => [link.innerText, link.href])"
+        )
+        for name, href in links:
+            name = (name or "").strip()
+            path = href[href.index("/alexaquantum/sp/"):]
+            if name == "" or path in found.values():
+                continue
+            found[name] = path
+
+        self._discovered_lists = {name: path for name, path in found.items() if name not in ALEXA_LISTS}
+        return list(found.keys())
+
+
+    async def has_alexa_list(self, list_name: str):
+        if self._alexa_list_url(list_name) == None:
+            await self.get_alexa_lists()
+        return self._alexa_list_url(list_name) != None
+
+
+    async def _rendered_records(self, page):
+        return await page.evaluate(ROW_RECORDS, {"scroll": False})
+
+
+    async def _scroll_to_last_rendered(self, page, last_title):
+        await page.locator('.virtual-list .item-title').last.evaluate("title => title.scrollIntoView()")
+        try:
+            await page.wait_for_function(
+                """last => {
+                    const titles = document.querySelectorAll('.virtual-list .item-title');
+                    return titles.length > 0 && titles[titles.length - 1].innerText !== last;
+                }""",
+                arg=last_title,
+                timeout=SCROLL_TIMEOUT * 1000
+            )
+        except PlaywrightTimeoutError:
+            # Nothing new rendered, so we are at the end of the list
+            pass
+
+
+    async def _scrape_alexa_list(self, page, refresh: bool, list_name: str, known: list = None):
+        responses = await self._ensure_page_is_on_alexa_list(page, refresh, list_name)
+
+        if responses != None and self.network_capture:
+            # The page fetched the whole list as JSON while loading, no need to scroll for it
+            captured = await self._read_captured_list(responses)
+            if captured != None:
+                return captured
+
+        count = await page.evaluate(LIST_COUNT, {}) if known != None else None
+
+        found = []
+        last = None
+        while True:
+            rows = await self._rendered_records(page)
+            self._remember_offsets(list_name, rows)
+            for record in rows:
+                add_record(found, record)
+            tail = known_tail(found, known)
+            if tail != None and (count == None or len(found) + len(tail) == count):
+                # The rest of the list hasn't changed since the known read
+                found += tail
+                break
+            if not rows or last == rows[-1]['title']:
+                # We've reached the end
+                break
+            last = rows[-1]['title']
+            await self._scroll_to_last_rendered(page, last)
+
+            if self.should_yield != None and self.should_yield():
+                # Leave the list the way a fresh page has it for whoever runs next
+                await page.locator('.virtual-list').evaluate("list => list.scrollTop = 0")
+                raise ScrapePreempted()
+
+        if not refresh:
+            # Now let's scroll back to the top
+            await page.locator('.virtual-list').evaluate("list => list.scrollTop = 0")
+
+        return found
+
+
+    async def get_alexa_list(self, refresh: bool = True, list_name: str = DEFAULT_LIST, detailed: bool = False, known: list = None):
+        records = await self._scrape_alexa_list(self.page, refresh, list_name, known)
+        if detailed:
+            return records
+        return record_titles(records)
+
+
+    async def read_alexa_lists(self, list_names: list, detailed: bool = False, known: dict = None):
+        # Every list gets its own page in the same browser context, so they load in parallel
+        pages = [self.page] + [await self.context.new_page() for i in range(len(list_names) - 1)]
+        try:
+            results = await asyncio.gather(*[
+                self._scrape_alexa_list(page, True, list_name, (known or {}).get(list_name))
+                for page, list_name in zip(pages, list_names)
+            ])
+        finally:
+            for page in pages[1:]:
+                await page.close()
+        if not detailed:
+            results = [record_titles(records) for records in results]
+        return dict(zip(list_names, results))
+
+
+    def _item_locator(self, item: str):
+        title = self.page.locator('.item-title', has_text=re.compile("^"+re.escape(item)+"$"))
+        return self.page.locator('.virtual-list .inner').filter(has=title)
+
+
+    def _remember_offsets(self, list_name: str, rows: list):
+        offsets = _item_offsets.setdefault(list_name, {})
+        for row in rows:
+            offset = row.pop('offset', None)
+            if offset != None:
+                offsets[self.matcher.key(row['title'])] = offset
+
+
+    def _rendered_row(self, titles: list, item: str):
+        found = [title for title in titles if self.matcher.same(title, item)]
+        if len(found) == 0:
+            return None
+        # The page's own spelling, in case the item only matched after normalising
+        return self._item_locator(item if item in found else found[0]).first
+
+
+    async def _get_alexa_list_item_element(self, item: str, list_name: str = DEFAULT_LIST):
+        await self._ensure_page_is_on_alexa_list(self.page, False, list_name)
+
+        # Go straight to where the last read saw it, and check it is still there
+        offset = _item_offsets.get(list_name, {}).get(self.matcher.key(item))
+        if offset != None:
+            element = self._rendered_row(await self.page.evaluate(SCROLL_TO_OFFSET, {"offset": offset}), item)
+            if element != None:
+                return element
+            await self.page.locator('.virtual-list').evaluate("list => list.scrollTop = 0")
+
+        last = None
+        while True:
+            rows = await self._rendered_records(self.page)
+            self._remember_offsets(list_name, rows)
+            titles = [row['title'] for row in rows]
+            element = self._rendered_row(titles, item)
+            if element != None:
+                return element
+
+            if not titles or last == titles[-1]:
+                break
+            last = titles[-1]
+            await self._scroll_to_last_rendered(self.page, last)
+
+        return None
+
+
+    async def _run_list_macro(self, op: str, **kwargs):
+        result = await self.page.evaluate(LIST_MACRO, {"op": op, "timeout": MACRO_TIMEOUT * 1000, **kwargs})
+        if result == None or result.get('ok') != True:
+            print("\nList "+op+" failed: "+str(result.get('error') if result != None else None))
+        return result
+
+
+    async def _element_title(self, element):
+        return await element.locator('.item-title').inner_text()
+
+
+    async def add_alexa_list_item(self, item: str, list_name: str = DEFAULT_LIST):
+        element = await self._get_alexa_list_item_element(item, list_name)
+        if element != None:
+            return
+
+        await self._run_list_macro("add", item=item)
+        return await self.get_alexa_list(False, list_name)
+
+
+    async def update_alexa_list_item(self, old: str, new: str, list_name: str = DEFAULT_LIST):
+        element = await self._get_alexa_list_item_element(old, list_name)
+        if element == None:
+            return
+
+        await self._run_list_macro("update", old=await self._element_title(element), new=new)
+        return await self.get_alexa_list(False, list_name)
+
+
+    async def remove_alexa_list_item(self, item: str, list_name: str = DEFAULT_LIST):
+        element = await self._get_alexa_list_item_element(item, list_name)
+        if element is None:
+            return None
+
+        await self._run_list_macro("remove", item=await self._element_title(element))
+        return await self.get_alexa_list(False, list_name)
+
+    # ============================================================
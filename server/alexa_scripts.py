@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Scripts injected into the Alexa list page. Each one is a javascript function
+# taking a single argument, so playwright can evaluate it directly and selenium
+# can run it through execute_script with selenium_sync(), or through
+# execute_async_script with selenium_async() for the async ones.
+
+# ============================================================
+# List reads
+
+# Reads every rendered row in one go: the title along with whatever the row says
+# about being ticked off, its quantity and its id. Amazon doesn't document any of
+# this, so each is looked for in the few places it tends to live and left empty
+# otherwise. The row's offset from the top of the list comes along too, for
+# finding it again later. With args.scroll the last row is then scrolled into
+# view, ready for the next read.
+ROW_RECORDS = """
+(args) => {
+    const attribute = (element, names) => {
+        for (const name of names) {
+            const value = element.getAttribute(name);
+            if (value) {
+                return value;
+            }
+        }
+        return null;
+    };
+
+    const list = document.querySelector('.virtual-list');
+    const titles = Array.from(document.querySelectorAll('.virtual-list .item-title'));
+    const records = titles.map((title) => {
+        const row = title.closest('.inner') || title.parentElement;
+        const checkbox = row.querySelector('input[type="checkbox"]');
+        const flagged = row.querySelector('[aria-checked="true"], .checked, .completed, .item-completed');
+        const quantity = row.querySelector('.item-quantity, [class*="quantity"]');
+        return {
+            title: title.innerText,
+            completed: checkbox ? checkbox.checked : (!!flagged || /(^|\\s)(checked|completed)(\\s|$)/.test(row.className)),
+            quantity: quantity ? quantity.innerText.trim() || null : attribute(row, ['data-quantity']),
+            id: attribute(row, ['data-item-id', 'data-itemid', 'data-id', 'id']) || attribute(title, ['data-item-id', 'id']),
+            offset: Math.round(row.getBoundingClientRect().top - list.getBoundingClientRect().top + list.scrollTop)
+        };
+    });
+
+    if (args.scroll && titles.length > 0) {
+        titles[titles.length - 1].scrollIntoView();
+    }
+    return records;
+}
+"""
+
+# Scrolls the list so a position remembered from an earlier read is in the middle
+# of the view, then returns the titles drawn there once the list has caught up.
+SCROLL_TO_OFFSET = """
+async (args) => {
+    const list = document.querySelector('.virtual-list');
+    list.scrollTop = Math.max(0, args.offset - list.clientHeight / 2);
+    // Not requestAnimationFrame, which never fires while the page is in the background
+    await new Promise((resolve) => setTimeout(resolve, args.settle || 150));
+    return Array.from(list.querySelectorAll('.item-title')).map((title) => title.innerText);
+}
+"""
+
+# The rendered row showing exactly args.title, or null
+ROW_BY_TITLE = """
+(args) => {
+    const title = Array.from(document.querySelectorAll('.virtual-list .item-title'))
+        .find((element) => element.innerText === args.title);
+    return title ? (title.closest('.inner') || title.parentElement) : null;
+}
+"""
+
+# Scrolls the last rendered row into view, so the list draws the rows after it
+SCROLL_PAST_RENDERED = """
+(args) => {
+    const titles = document.querySelectorAll('.virtual-list .item-title');
+    if (titles.length > 0) {
+        titles[titles.length - 1].scrollIntoView();
+    }
+}
+"""
+
+# How many items the page says the list holds, or null when it doesn't say.
+# Virtual lists often give the full length to screen readers, and some pages
+# show a counter next to the list name.
+LIST_COUNT = """
+(args) => {
+    const number = (value) => {
+        const count = parseInt(String(value || '').replace(/[^0-9-]/g, ''), 10);
+        return isNaN(count) || count < 0 ? null : count;
+    };
+
+    const counted = document.querySelector('.virtual-list[aria-rowcount], .virtual-list [aria-rowcount]');
+    if (counted) {
+        return number(counted.getAttribute('aria-rowcount'));
+    }
+    const row = document.querySelector('.virtual-list [aria-setsize]');
+    if (row) {
+        return number(row.getAttribute('aria-setsize'));
+    }
+    const counter = document.querySelector('[data-item-count], .list-count, .item-count');
+    if (counter) {
+        return number(counter.getAttribute('data-item-count') || counter.innerText);
+    }
+    return null;
+}
+"""
+
+# ============================================================
+# List mutations
+
+# Performs one add/update/remove entirely inside the page. It finds the controls,
+# performs the action and waits until the list shows the change. Rows are looked
+# up again on every attempt, so a re-rendered row is retried here instead of
+# surfacing as a stale element.
+LIST_MACRO = """
+async (args) => {
+    const timeout = args.timeout || 10000;
+    const attempts = args.attempts || 3;
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    const until = async (check) => {
+        const end = Date.now() + timeout;
+        while (Date.now() < end) {
+            const value = check();
+            if (value) {
+                return value;
+            }
+            await sleep(50);
+        }
+        return null;
+    };
+
+    const titles = () => Array.from(document.querySelectorAll('.virtual-list .item-title'));
+    const titleCount = (title) => titles().filter((element) => element.innerText === title).length;
+    const findRow = (title) => {
+        const element = titles().find((element) => element.innerText === title);
+        return element ? element.closest('.inner') : null;
+    };
+    const editingInput = () => document.querySelector('.virtual-list .inner .input-box input');
+
+    const setValue = (input, value) => {
+        // Go through the native setter so frameworks tracking the input notice the change
+        const setter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+        setter.call(input, value);
+        input.dispatchEvent(new Event('input', {bubbles: true}));
+        input.dispatchEvent(new Event('change', {bubbles: true}));
+    };
+
+    const add = async () => {
+        const list = document.querySelector('.virtual-list');
+        if (list) {
+            list.scrollTop = 0;
+        }
+        const header = document.querySelector('.list-header');
+        header.querySelector('.add-symbol').click();
+        const input = await until(() => header.querySelector('.input-box input'));
+        if (!input) {
+            return {ok: false, error: 'Add input did not open'};
+        }
+        const before = titleCount(args.item);
+        setValue(input, args.item);
+        header.querySelector('.add-to-list button').click();
+        const cancel = header.querySelector('.cancel-input');
+        if (cancel) {
+            cancel.click();
+        }
+        const done = await until(() => titleCount(args.item) > before);
+        return {ok: !!done, error: done ? null : 'Added item did not appear'};
+    };
+
+    const update = async () => {
+        const row = findRow(args.old);
+        if (!row) {
+            return {ok: false, error: 'Item not found', retry: true};
+        }
+        const before = titleCount(args.new);
+        row.querySelector('.item-actions-1 button').click();
+        const input = await until(editingInput);
+        if (!input) {
+            return {ok: false, error: 'Edit input did not open', retry: true};
+        }
+        setValue(input, args.new);
+        input.closest('.inner').querySelector('.item-actions-2 button').click();
+        const done = await until(() => !editingInput() && titleCount(args.new) > before);
+        return {ok: !!done, error: done ? null : 'Updated item did not appear'};
+    };
+
+    const remove = async () => {
+        const row = findRow(args.item);
+        if (!row) {
+            return {ok: false, error: 'Item not found', retry: true};
+        }
+        const before = titleCount(args.item);
+        row.querySelector('.item-actions-2 button').click();
+        const done = await until(() => titleCount(args.item) < before);
+        return {ok: !!done, error: done ? null : 'Removed item did not disappear'};
+    };
+
+    const actions = {add: add, update: update, remove: remove};
+    let result = {ok: false, error: 'Unknown operation'};
+    let attempt = 0;
+    for (; attempt < attempts && actions[args.op]; attempt++) {
+        try {
+            result = await actions[args.op]();
+        } catch (error) {
+            result = {ok: false, error: String(error), retry: true};
+        }
+        if (result.ok || !result.retry) {
+            break;
+        }
+        await sleep(200);
+    }
+    result.attempts = Math.min(attempt + 1, attempts);
+    return result;
+}
+"""
+
+MACRO_TIMEOUT=5
+
+# ============================================================
+# Helpers
+
+
+def selenium_sync(script):
+    return "return ("+script+")(arguments[0]);"
+
+
+def selenium_async(script):
+    # execute_async_script passes its callback as the last argument
+    return (
+        "const done = arguments[arguments.length - 1];"
+        "("+script+")(arguments[0]).then(done, (error) => done({ok: false, error: String(error)}));"
+    )
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import asyncio
+import argparse
+import inspect
+import json
+import os
+import tempfile
+import time
+from fake_amazon import FakeAmazon
+
+# Compares the selenium and playwright browser backends against a local fake list
+# page. Reports how long each step takes and the resident memory of the browser.
+
+# ============================================================
+# Helpers
+
+
+def _process_children():
+    children = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", pid, "stat"), 'r') as file:
+                ppid = int(file.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(pid))
+    return children
+
+
+def _browser_rss_mb():
+    # Linux only, sums every process started underneath this one
+    if not os.path.exists("/proc"):
+        return None
+
+    children = _process_children()
+    pending = list(children.get(os.getpid(), []))
+    total = 0
+    while len(pending) > 0:
+        pid = pending.pop()
+        pending += children.get(pid, [])
+        try:
+            with open(os.path.join("/proc", str(pid), "statm"), 'r') as file:
+                total += int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+    return round(total / (1024 * 1024), 1)
+
+
+async def _timed(timings, name, method, *args):
+    started = time.perf_counter()
+    result = method(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    timings[name] = round(time.perf_counter() - started, 3)
+    return result
+
+# ============================================================
+# Backends
+
+
+def _create_backend(backend, cookies_path, profile_path=""):
+    if backend == "playwright":
+        from alexa_playwright import AsyncAlexaShoppingList
+        return AsyncAlexaShoppingList("localhost", cookies_path)
+
+    from alexa import AlexaShoppingList
+    # The selenium backend opens its browser as soon as it is created
+    return lambda: AlexaShoppingList("localhost", cookies_path, profile_path=profile_path)
+
+
+async def _run_backend(backend, item_count, profile_path=""):
+    fake = FakeAmazon(["Item "+str(i) for i in range(item_count)])
+    os.environ["ASL_AMAZON_BASE_URL"] = fake.start()
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as cookies_path:
+        instance = _create_backend(backend, cookies_path, profile_path)
+        if backend == "playwright":
+            await _timed(timings, "start", instance.start)
+        else:
+            instance = await _timed(timings, "start", instance)
+
+        items = await _timed(timings, "get_list", instance.get_alexa_list)
+        memory = _browser_rss_mb()
+        await _timed(timings, "add_item", instance.add_alexa_list_item, "benchmark item")
+        await _timed(timings, "update_item", instance.update_alexa_list_item, "benchmark item", "benchmark item 2")
+        await _timed(timings, "remove_item", instance.remove_alexa_list_item, "benchmark item 2")
+        await _timed(timings, "close", instance.close)
+
+    fake.stop()
+    return {
+        "backend": backend,
+        "profile": "persistent" if profile_path != "" else "throwaway",
+        "items": item_count,
+        "items_read": len(items),
+        "consistent": fake.titles() == items,
+        "browser_rss_mb": memory,
+        "seconds": timings,
+    }
+
+# ============================================================
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare the selenium and playwright browser backends")
+    parser.add_argument("--items", type=int, default=200, help="Number of items on the fake list (200)")
+    parser.add_argument("--backend", action="append", choices=["selenium", "playwright"], help="Backend to run, repeat for several (both)")
+    parser.add_argument("--persistent-profile", action="store_true", help="Compare selenium cold and warm starts with and without a saved profile")
+    args = parser.parse_args()
+
+    if args.persistent_profile:
+        print(json.dumps(await _run_backend("selenium", args.items)))
+        with tempfile.TemporaryDirectory() as profile_path:
+            # The first run fills the empty profile, the second starts warm from it
+            print(json.dumps({"run": "cold", **await _run_backend("selenium", args.items, profile_path)}))
+            print(json.dumps({"run": "warm", **await _run_backend("selenium", args.items, profile_path)}))
+        return
+
+    for backend in args.backend or ["selenium", "playwright"]:
+        print(json.dumps(await _run_backend(backend, args.items)))
+
+# ============================================================
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
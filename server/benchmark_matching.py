@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import random
+import time
+from matching import ItemMatcher
+
+# Times planning a sync of two large lists that differ only in how the names are
+# written, once by scanning the list for every name and once through the index.
+# Every name should match, so nothing would be added to Alexa.
+
+# ============================================================
+
+
+def _lists(item_count):
+    alexa_list = ["Item "+str(i)+" apple" for i in range(item_count)]
+    ha_list = [" ITEM  "+str(i)+" Apples " for i in range(item_count)]
+    random.shuffle(ha_list)
+    return alexa_list, ha_list
+
+
+def _plan_by_scan(matcher, alexa_list, ha_list):
+    return [name for name in ha_list if not any(matcher.same(name, item) for item in alexa_list)]
+
+
+def _plan_by_index(matcher, alexa_list, ha_list):
+    index = matcher.index(alexa_list)
+    return [name for name in ha_list if name not in index]
+
+
+def _time_ms(method):
+    started = time.perf_counter()
+    result = method()
+    return round((time.perf_counter() - started) * 1000, 2), result
+
+
+def _measure(item_count, scan):
+    matcher = ItemMatcher({"strip_plurals": True})
+    alexa_list, ha_list = _lists(item_count)
+
+    index_ms, to_add = _time_ms(lambda: _plan_by_index(matcher, alexa_list, ha_list))
+    measurement = {
+        "items": item_count,
+        "to_add": len(to_add),
+        "index_ms": index_ms,
+        "index_us_per_item": round(index_ms * 1000 / item_count, 2),
+    }
+    if scan:
+        measurement['scan_ms'], to_add = _time_ms(lambda: _plan_by_scan(matcher, alexa_list, ha_list))
+    return measurement
+
+# ============================================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare matching item names by scanning and through the index")
+    parser.add_argument("--items", type=int, action="append", help="List length to measure, repeat for several (100, 1000, 10000)")
+    parser.add_argument("--scan-limit", type=int, default=1000, help="Longest list also timed by scanning, which is quadratic (1000)")
+    args = parser.parse_args()
+
+    for item_count in args.items or [100, 1000, 10000]:
+        print(json.dumps(_measure(item_count, item_count <= args.scan_limit)))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+import websockets
+
+# Times a sync where some items were renamed in HA, and counts the commands it sends
+# with rename detection and with it turned off. Half the renames keep their HA ID, the
+# other half are deleted and added again with a corrected name. Without detection the
+# old names stay on Alexa, each needing a remove later, so those count too.
+# The integration is driven through its public API against a stand-in server, which
+# needs websockets but not Home Assistant.
+
+COMPONENT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "custom_components", "alexa_shopping_list")
+package = types.ModuleType("alexa_shopping_list")
+package.__path__ = [COMPONENT]
+sys.modules.setdefault("alexa_shopping_list", package)
+
+from alexa_shopping_list.asl import AlexaShoppingListSync, DEFAULT_RENAME_THRESHOLD
+
+# ============================================================
+
+
+class ListServer:
+    """Answers the integration's list commands from memory, counting them"""
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.commands = {}
+
+
+    async def handle(self, websocket, path=None):
+        async for message in websocket:
+            request = json.loads(message)
+            command = request['command']
+            args = request.get('args') or {}
+            self.commands[command] = self.commands.get(command, 0) + 1
+
+            result = self.items
+            if command == "add_item" and args['item'] not in self.items:
+                self.items.insert(0, args['item'])
+            elif command == "remove_item" and args['item'] in self.items:
+                self.items.remove(args['item'])
+            elif command == "update_item":
+                if args['old'] in self.items:
+                    self.items[self.items.index(args['old'])] = args['new']
+                else:
+                    result = None
+            await websocket.send(json.dumps({"result": list(result) if result != None else None, "error": None}))
+
+
+def _rename(ha_list, rename_count):
+    step = max(1, len(ha_list) // max(1, rename_count))
+    renamed = ha_list[::step][:rename_count]
+    for number, item in enumerate(renamed):
+        if number % 2 == 0:
+            item['name'] = item['name'].replace("apple", "green apple")
+        else:
+            ha_list.remove(item)
+            ha_list.append({"id": "new-"+str(number), "name": item['name'].replace("apple", "appel"), "complete": False})
+    return ha_list
+
+
+async def _run(item_count, rename_count, rename_threshold):
+    path = tempfile.mkdtemp()
+    hasl_path = os.path.join(path, ".shopping_list.json")
+    server = ListServer(["Item "+str(i)+" apple" for i in range(item_count)])
+    listener = await websockets.serve(server.handle, "127.0.0.1", 0)
+    try:
+        async def refresh():
+            pass
+
+        sync = AlexaShoppingListSync(ip="127.0.0.1", port=listener.sockets[0].getsockname()[1], hasl_path=hasl_path, hasl_refresh=refresh, rename_threshold=rename_threshold)
+
+        # The first sync hands every Alexa item to HA with an ID
+        with open(hasl_path, 'w') as file:
+            json.dump([], file)
+        await sync.sync(None, True)
+
+        with open(hasl_path, 'r') as file:
+            ha_list = _rename(json.load(file), rename_count)
+        with open(hasl_path, 'w') as file:
+            json.dump(ha_list, file)
+
+        server.commands = {}
+        started = time.perf_counter()
+        await sync.sync(None, True)
+        sync_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        ha_names = set(item['name'] for item in ha_list)
+        return {
+            "sync_ms": sync_ms,
+            "commands": sum(count for command, count in server.commands.items() if command != "get_list"),
+            "stale": len([item for item in server.items if item not in ha_names]),
+            "renamed": sync.last_sync_stats.get('renamed', 0),
+        }
+    finally:
+        listener.close()
+        await listener.wait_closed()
+        shutil.rmtree(path)
+
+
+def _measure(item_count, rename_count):
+    detected = asyncio.run(_run(item_count, rename_count, DEFAULT_RENAME_THRESHOLD))
+    undetected = asyncio.run(_run(item_count, rename_count, None))
+    return {
+        "items": item_count,
+        "renamed_in_ha": rename_count,
+        "renames_found": detected['renamed'],
+        "sync_ms": detected['sync_ms'],
+        "operations": detected['commands'] + detected['stale'],
+        "sync_ms_without_renames": undetected['sync_ms'],
+        "operations_without_renames": undetected['commands'] + undetected['stale'],
+    }
+
+# ============================================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure rename detection when syncing")
+    parser.add_argument("--items", type=int, action="append", help="List length to measure, repeat for several (100, 1000)")
+    parser.add_argument("--renamed", type=float, default=0.1, help="Fraction of the items renamed in HA (0.1)")
+    args = parser.parse_args()
+
+    for item_count in args.items or [100, 1000]:
+        print(json.dumps(_measure(item_count, max(1, int(item_count * args.renamed)))))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import time
+import zlib
+from wire import encode, decode, encodings
+
+# Compares the size and speed of the websocket encodings on list responses of
+# different lengths. Deflated sizes use the same raw deflate stream that the
+# permessage-deflate extension puts on the wire.
+
+# ============================================================
+
+
+def _list_response(item_count):
+    return {"result": ["Shopping list item number "+str(i) for i in range(item_count)], "error": None}
+
+
+def _deflated_size(frame):
+    if isinstance(frame, str):
+        frame = frame.encode()
+    compressor = zlib.compressobj(wbits=-15)
+    return len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def _time_us(method, rounds):
+    started = time.perf_counter()
+    for i in range(rounds):
+        method()
+    return round((time.perf_counter() - started) / rounds * 1000000, 1)
+
+
+def _measure(encoding, item_count, rounds):
+    message = _list_response(item_count)
+    frame = encode(message, encoding)
+    if decode(frame)[0] != message:
+        raise Exception(encoding+" did not survive a round trip")
+
+    return {
+        "encoding": encoding,
+        "items": item_count,
+        "bytes": len(frame.encode() if isinstance(frame, str) else frame),
+        "deflated_bytes": _deflated_size(frame),
+        "encode_us": _time_us(lambda: encode(message, encoding), rounds),
+        "decode_us": _time_us(lambda: decode(frame), rounds),
+    }
+
+# ============================================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare websocket payload encodings")
+    parser.add_argument("--items", type=int, action="append", help="List length to measure, repeat for several (100, 500, 1000)")
+    parser.add_argument("--rounds", type=int, default=200, help="Encodes and decodes timed per measurement (200)")
+    args = parser.parse_args()
+
+    for item_count in args.items or [100, 500, 1000]:
+        for encoding in encodings():
+            print(json.dumps(_measure(encoding, item_count, args.rounds)))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+
+# Caches chrome rebuilds on its own, these are the first to go when the profile grows too big
+PRUNABLE_DIRS = [
+    os.path.join("Default", "Cache"),
+    os.path.join("Default", "Code Cache"),
+    os.path.join("Default", "GPUCache"),
+    os.path.join("Default", "Service Worker", "CacheStorage"),
+    os.path.join("Default", "Service Worker", "ScriptCache"),
+    "GrShaderCache",
+    "ShaderCache",
+]
+
+# Left behind in the profile when chrome is killed rather than closed
+CHROME_LOCK_FILES = ["SingletonLock", "SingletonSocket", "SingletonCookie"]
+
+# Lock files held by a ChromeProfile in this process. The pid in the file can't tell
+# a lock we hold now from one an earlier run of the server left behind.
+_held_locks = set()
+
+
+class ChromeProfile:
+    """A persistent chrome user-data-dir, locked to one browser at a time"""
+
+    def __init__(self, path: str, max_size_mb: int = 500):
+        self.path = path
+        self.max_size_mb = max_size_mb
+        self._locked = False
+
+    # ============================================================
+    # Locking
+
+
+    def _lock_path(self):
+        return self.path+".lock"
+
+
+    def _lock_owner(self):
+        try:
+            with open(self._lock_path(), 'r') as file:
+                return int(file.read().strip())
+        except (OSError, ValueError):
+            return None
+
+
+    def _process_is_running(self, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+
+    def acquire(self):
+        if self._locked:
+            return True
+
+        # Another profile object in this process has chrome running on it
+        if self._lock_path() in _held_locks:
+            return False
+
+        # A lock carrying our own pid that nobody here holds was left by an earlier
+        # run, in a container the server is often pid 1 every time it starts
+        owner = self._lock_owner()
+        if owner != None and owner != os.getpid() and self._process_is_running(owner):
+            return False
+
+        # Nobody alive holds the lock, so anything chrome left behind is stale too
+        if os.path.exists(self._lock_path()):
+            os.remove(self._lock_path())
+        for name in CHROME_LOCK_FILES:
+            if os.path.lexists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+
+        try:
+            descriptor = os.open(self._lock_path(), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(descriptor, 'w') as file:
+            file.write(str(os.getpid()))
+
+        os.makedirs(self.path, exist_ok=True)
+        self._locked = True
+        _held_locks.add(self._lock_path())
+        return True
+
+
+    def release(self):
+        if not self._locked:
+            return
+        if self._lock_owner() == os.getpid():
+            os.remove(self._lock_path())
+        _held_locks.discard(self._lock_path())
+        self._locked = False
+
+    # ============================================================
+    # Size
+
+
+    def _dir_size(self, path):
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+        return total
+
+
+    def size_mb(self):
+        return self._dir_size(self.path) / (1024 * 1024)
+
+
+    def cache_size_bytes(self):
+        # Keep chrome's own http cache to half the budget so it doesn't need pruning every run
+        return int(self.max_size_mb * 1024 * 1024 / 2)
+
+
+    def prune(self):
+        if self.size_mb() <= self.max_size_mb:
+            return
+
+        for name in PRUNABLE_DIRS:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+        if self.size_mb() > self.max_size_mb:
+            self.reset()
+
+
+    def reset(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
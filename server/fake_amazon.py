@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import json
+
+# A local stand-in for the parts of the Amazon website the browser backends use.
+# The list page renders a virtualised list from /api/items in the same DOM shape
+# as the real Alexa list, so the backends can be compared without an account.
+
+HOME_PAGE = """<!DOCTYPE html>
+<html><body>
+<a id="nav-link-accountList" href="/">Account &amp; Lists</a>
+<a href="/alexaquantum/sp/alexaShoppingList?ref=nav_asl">Shopping List</a>
+</body></html>
+"""
+
+LIST_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<style>
+.virtual-list { height: 600px; overflow-y: auto; position: relative; }
+.spacer { position: relative; }
+.inner { position: absolute; left: 0; right: 0; height: 40px; display: flex; }
+.item-title { flex: 1; }
+</style>
+</head>
+<body>
+<a id="nav-link-accountList" href="/">Account &amp; Lists</a>
+<div class="list-header">
+    <span class="add-symbol">+</span>
+    <div class="input-box"><input type="text"></div>
+    <div class="add-to-list"><button>Add</button></div>
+    <span class="cancel-input">x</span>
+</div>
+<div class="virtual-list"><div class="spacer"></div></div>
+<script>
+const ROW = 40;
+let items = [];
+let editing = null;
+
+const list = document.querySelector('.virtual-list');
+const spacer = document.querySelector('.spacer');
+
+function post(body) {
+    return fetch('/alexashoppinglists/api/updatelistitem', {method: 'POST', body: JSON.stringify(body)})
+        .then(response => response.json())
+        .then(data => { items = data.items; render(); });
+}
+
+function row(index) {
+    const item = items[index];
+    const inner = document.createElement('div');
+    inner.className = 'inner';
+    inner.style.top = (index * ROW) + 'px';
+
+    inner.innerHTML = (editing === index ? '<div class="input-box"><input type="text"></div>' : '<div class="item-title"></div>')
+        + '<div class="item-actions-1"><button>Edit</button></div>'
+        + '<div class="item-actions-2"><button>' + (editing === index ? 'Save' : 'Delete') + '</button></div>';
+
+    if (editing === index) {
+        inner.querySelector('.input-box input').value = item.title;
+    } else {
+        inner.querySelector('.item-title').innerText = item.title;
+    }
+
+    inner.querySelector('.item-actions-1 button').onclick = () => { editing = index; render(); };
+    inner.querySelector('.item-actions-2 button').onclick = () => {
+        if (editing === index) {
+            const value = inner.querySelector('.input-box input').value;
+            editing = null;
+            post({op: 'update', old: item.title, new: value});
+        } else {
+            post({op: 'remove', item: item.title});
+        }
+    };
+    return inner;
+}
+
+function render() {
+    spacer.style.height = (items.length * ROW) + 'px';
+    const first = Math.max(0, Math.floor(list.scrollTop / ROW) - 2);
+    const last = Math.min(items.length, first + Math.ceil(list.clientHeight / ROW) + 4);
+    spacer.replaceChildren();
+    for (let index = first; index < last; index++) {
+        spacer.appendChild(row(index));
+    }
+}
+
+list.addEventListener('scroll', render);
+document.querySelector('.add-to-list button').onclick = () => {
+    const input = document.querySelector('.list-header .input-box input');
+    post({op: 'add', item: input.value});
+    input.value = '';
+};
+
+fetch('/alexashoppinglists/api/getlistitems').then(response => response.json()).then(data => { items = data.items; render(); });
+</script>
+</body>
+</html>
+"""
+
+
+class FakeAmazon:
+
+    def __init__(self, items: list = None, port: int = 0):
+        self.items = [{"title": item, "completed": False} for item in (items or [])]
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread = None
+
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:"+str(self._server.server_address[1])
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    def titles(self):
+        with self._lock:
+            return [item['title'] for item in self.items]
+
+
+    def apply(self, change):
+        with self._lock:
+            titles = [item['title'] for item in self.items]
+            if change['op'] == "add" and change['item'] not in titles:
+                self.items.insert(0, {"title": change['item'], "completed": False})
+            elif change['op'] == "update" and change['old'] in titles:
+                self.items[titles.index(change['old'])]['title'] = change['new']
+            elif change['op'] == "remove" and change['item'] in titles:
+                del self.items[titles.index(change['item'])]
+            return {"items": list(self.items)}
+
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, body, content_type="text/html"):
+                payload = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.startswith("/alexashoppinglists/api/"):
+                    with fake._lock:
+                        self._send(json.dumps({"items": fake.items}), "application/json")
+                elif self.path.startswith("/alexaquantum/sp/"):
+                    self._send(LIST_PAGE)
+                else:
+                    self._send(HOME_PAGE)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                change = json.loads(self.rfile.read(length))
+                self._send(json.dumps(fake.apply(change)), "application/json")
+
+        return Handler
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+
+# A leadership lease kept as a file in the config directory shared by every server
+# instance. The holder renews its heartbeat well inside the ttl; once a heartbeat is
+# older than the ttl any other instance may take the lease over.
+
+DEFAULT_TTL = 15
+
+# ============================================================
+
+
+class Lease:
+    """Decides which of several server instances sharing one config directory leads"""
+
+    def __init__(self, path: str, owner: str, ttl: int = DEFAULT_TTL, endpoint: str = None):
+        self.path = path
+        self.owner = owner
+        self.ttl = ttl
+        self.endpoint = endpoint
+
+    # ============================================================
+    # Helpers
+
+
+    def _guard_path(self):
+        return self.path+".guard"
+
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+
+    def _write(self):
+        data = {"owner": self.owner, "endpoint": self.endpoint, "heartbeat": time.time()}
+        with open(self.path+".tmp."+self.owner, 'w') as file:
+            json.dump(data, file)
+        os.replace(self.path+".tmp."+self.owner, self.path)
+
+
+    def _expired(self, data):
+        return data == None or time.time() - data.get('heartbeat', 0) > self.ttl
+
+
+    def _guarded(self, action):
+        # Only one instance reads and rewrites the lease at a time
+        try:
+            descriptor = os.open(self._guard_path(), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # A guard outliving the ttl belongs to an instance that died holding it
+            try:
+                if time.time() - os.path.getmtime(self._guard_path()) > self.ttl:
+                    os.remove(self._guard_path())
+            except OSError:
+                pass
+            return False
+
+        os.close(descriptor)
+        try:
+            return action()
+        finally:
+            os.remove(self._guard_path())
+
+    # ============================================================
+    # Lease
+
+
+    def holder(self):
+        """The current holder's lease data, or None when nobody holds it"""
+        data = self._read()
+        if self._expired(data):
+            return None
+        return data
+
+
+    def acquire(self):
+        def take():
+            data = self._read()
+            if data != None and data.get('owner') != self.owner and not self._expired(data):
+                return False
+            self._write()
+            return True
+        return self._guarded(take)
+
+
+    def renew(self):
+        def heartbeat():
+            data = self._read()
+            if data == None or data.get('owner') != self.owner:
+                return False
+            self._write()
+            return True
+
+        renewed = self._guarded(heartbeat)
+        if renewed == False:
+            # Losing the race for the guard isn't losing the lease, check who holds it
+            data = self._read()
+            return data != None and data.get('owner') == self.owner and not self._expired(data)
+        return renewed
+
+
+    def release(self):
+        def remove():
+            data = self._read()
+            if data != None and data.get('owner') == self.owner:
+                os.remove(self.path)
+            return True
+        self._guarded(remove)
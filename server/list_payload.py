@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import re
+
+# Reads the Alexa list out of the JSON the list page fetches for itself, so the
+# list can be taken from the network responses instead of scrolling the page.
+
+# Only the list items endpoint is read, the page also fetches list names, settings and
+# the responses to its own edits from the same API
+LIST_PAYLOAD_URL = re.compile(r"/alexashoppinglists/api/(?:v\d+/)?(?:getlistitems|lists/[^/?]+/items)", re.IGNORECASE)
+
+# Where the items sit in a response, at the top or under the id of the list they belong to
+ITEM_LIST_KEYS = ["items", "listItems", "itemInfoList"]
+TITLE_KEYS = ["value", "itemName", "title", "name", "text"]
+DELETED_KEYS = ["deleted", "isDeleted"]
+COMPLETED_KEYS = ["completed", "complete", "isCompleted", "checked"]
+QUANTITY_KEYS = ["quantity", "itemQuantity"]
+ID_KEYS = ["itemId", "listItemId", "id"]
+
+# Items in a row that have to match the last snapshot before an incremental read stops
+VERIFY_RUN = 3
+
+# ============================================================
+
+
+def _item_title(entry):
+    for key in TITLE_KEYS:
+        if isinstance(entry.get(key), str):
+            return entry[key]
+    return None
+
+
+def _is_item(entry):
+    # Every list item has a title and a completed flag, other records the page loads don't
+    if not isinstance(entry, dict) or _item_title(entry) == None:
+        return False
+    return any(isinstance(entry.get(key), bool) for key in COMPLETED_KEYS)
+
+
+def _is_item_list(value):
+    # An empty list is still a list, it sits under one of the item keys
+    return isinstance(value, list) and all(_is_item(entry) for entry in value)
+
+
+def _find_item_list(payload):
+    if not isinstance(payload, dict):
+        return None
+
+    for key in ITEM_LIST_KEYS:
+        if _is_item_list(payload.get(key)):
+            return payload[key]
+
+    for child in payload.values():
+        found = _find_item_list(child)
+        if found != None:
+            return found
+    return None
+
+
+def _first_value(entry, keys):
+    for key in keys:
+        if entry.get(key) != None:
+            return entry[key]
+    return None
+
+
+def _item_record(entry):
+    quantity = _first_value(entry, QUANTITY_KEYS)
+    item_id = _first_value(entry, ID_KEYS)
+    return {
+        "title": _item_title(entry),
+        "completed": any(entry.get(key) == True for key in COMPLETED_KEYS),
+        "quantity": str(quantity) if quantity != None else None,
+        "id": str(item_id) if item_id != None else None,
+    }
+
+
+def record_titles(records):
+    """The distinct titles of a list of item records, in order"""
+    return list(dict.fromkeys(record['title'] for record in records))
+
+
+def add_record(found, record):
+    """Add a record unless one with the same id, or the same title when there are no ids, is there already"""
+    for existing in found:
+        if record['id'] != None and existing['id'] != None:
+            if existing['id'] == record['id']:
+                return False
+        elif existing['title'] == record['title']:
+            return False
+    found.append(record)
+    return True
+
+
+def known_tail(found, known, run_length=VERIFY_RUN):
+    """The rest of the list, taken from the known records, once the last run_length records found
+    match a run of them in the same order. None until they do"""
+    if known == None or len(found) < run_length:
+        return None
+
+    run = [record['title'] for record in found[-run_length:]]
+    titles = [record['title'] for record in known]
+    if run[0] not in titles:
+        return None
+    start = titles.index(run[0])
+    if titles[start:start + run_length] != run:
+        return None
+
+    # Anything found higher up was moved there, it isn't further down any more
+    seen = set(record_titles(found))
+    return [record for record in known[start + run_length:] if record['title'] not in seen]
+
+
+def parse_list_records(payload):
+    """Return an item record for each item in a list payload, or None when it doesn't hold a list"""
+    entries = _find_item_list(payload)
+    if entries == None:
+        return None
+
+    found = []
+    for entry in entries:
+        if any(entry.get(key) == True for key in DELETED_KEYS):
+            continue
+        add_record(found, _item_record(entry))
+    return found
+
+
+def parse_list_payload(payload):
+    """Return the item titles in a list payload, or None when it doesn't hold a list"""
+    records = parse_list_records(payload)
+    if records == None:
+        return None
+    return record_titles(records)
+
+
+def merge_list_records(payloads):
+    """Combine the records of every payload that held a list, in the order they arrived"""
+    found = None
+    for payload in payloads:
+        records = parse_list_records(payload)
+        if records == None:
+            continue
+        if found == None:
+            found = []
+        for record in records:
+            add_record(found, record)
+    return found
+
+
+def merge_list_payloads(payloads):
+    """Combine the titles of every payload that held a list, in the order they arrived"""
+    records = merge_list_records(payloads)
+    if records == None:
+        return None
+    return record_titles(records)
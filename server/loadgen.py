@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import asyncio
+import argparse
+import json
+import random
+import sys
+import time
+import websockets
+
+# Opens several websocket clients against a running server and replays a mix of
+# list commands, then reports throughput, latency, errors and whether the list
+# ended up holding what the clients expect. Run the server with browser_backend
+# "fake" to measure the server itself rather than amazon.
+
+DEFAULT_MIX = "get=4,add=2,update=1,remove=1"
+
+# ============================================================
+# Helpers
+
+
+def _parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = int(weight)
+    return weights
+
+
+def _percentile(ordered, fraction):
+    if len(ordered) == 0:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 1)
+
+
+async def _send(websocket, command, **kwargs):
+    await websocket.send(json.dumps({"command": command, "args": kwargs}))
+    while True:
+        response = json.loads(await websocket.recv())
+        if "event" not in response:
+            return response
+
+# ============================================================
+# Clients
+
+
+class LoadClient:
+    """One simulated client, keeping track of the items it expects on the list"""
+
+    def __init__(self, number: int, uri: str, list_name: str, reconnect: bool):
+        self.number = number
+        self.uri = uri
+        self.list_name = list_name
+        self.reconnect = reconnect
+        self.owned = []
+        self.gone = []
+        self.latencies = []
+        self.errors = {}
+        self._counter = 0
+
+
+    def _new_item(self):
+        self._counter += 1
+        return "loadgen "+str(self.number)+"-"+str(self._counter)
+
+
+    def _next_request(self, command):
+        # Changes only touch this client's own items, so the final list can be checked
+        if command in ["update", "remove"] and len(self.owned) == 0:
+            command = "add"
+
+        if command == "get":
+            return "get_list", {}, None
+        if command == "add":
+            item = self._new_item()
+            return "add_item", {"item": item}, ("add", item)
+        if command == "update":
+            old = random.choice(self.owned)
+            new = self._new_item()
+            return "update_item", {"old": old, "new": new}, ("update", old, new)
+        item = random.choice(self.owned)
+        return "remove_item", {"item": item}, ("remove", item)
+
+
+    def _record(self, response, change):
+        if response.get('error') != None:
+            error = response['error']
+            if "retry_after" in response:
+                error = "Server busy"
+            self.errors[error] = self.errors.get(error, 0) + 1
+            return
+
+        if change == None:
+            return
+        if change[0] == "add":
+            self.owned.append(change[1])
+        elif change[0] == "update":
+            self.owned.remove(change[1])
+            self.gone.append(change[1])
+            self.owned.append(change[2])
+        else:
+            self.owned.remove(change[1])
+            self.gone.append(change[1])
+
+
+    async def _request(self, websocket, command):
+        name, args, change = self._next_request(command)
+        if self.list_name != None:
+            args['list'] = self.list_name
+
+        started = time.perf_counter()
+        try:
+            if websocket == None:
+                async with websockets.connect(self.uri) as connection:
+                    response = await _send(connection, name, **args)
+            else:
+                response = await _send(websocket, name, **args)
+        except (OSError, websockets.WebSocketException) as e:
+            response = {"result": None, "error": type(e).__name__}
+        self.latencies.append(time.perf_counter() - started)
+        self._record(response, change)
+
+
+    async def run(self, commands):
+        # Home assistant opens a connection per command, the CLI keeps one open
+        if self.reconnect:
+            for command in commands:
+                await self._request(None, command)
+            return
+
+        async with websockets.connect(self.uri) as websocket:
+            for command in commands:
+                await self._request(websocket, command)
+
+# ============================================================
+# Report
+
+
+async def _final_list(uri, list_name):
+    args = {"list": list_name} if list_name != None else {}
+    async with websockets.connect(uri) as websocket:
+        items = await _send(websocket, "get_list", **args)
+        metrics = await _send(websocket, "metrics")
+    return items.get('result'), metrics.get('result')
+
+
+def _consistency(clients, items):
+    if items == None:
+        return {"ok": False, "missing": None, "unexpected": None}
+
+    expected = [item for client in clients for item in client.owned]
+    gone = [item for client in clients for item in client.gone]
+    missing = [item for item in expected if item not in items]
+    unexpected = [item for item in gone if item in items and item not in expected]
+    return {"ok": len(missing) == 0 and len(unexpected) == 0, "missing": missing, "unexpected": unexpected}
+
+
+def _report(clients, seconds, items, metrics):
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    errors = {}
+    for client in clients:
+        for error, count in client.errors.items():
+            errors[error] = errors.get(error, 0) + count
+    error_count = sum(errors.values())
+
+    return {
+        "clients": len(clients),
+        "requests": len(latencies),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 2) if seconds > 0 else None,
+        "latency_ms": {
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+            "p99": _percentile(latencies, 0.99),
+            "max": _percentile(latencies, 1),
+        },
+        "error_rate": round(error_count / len(latencies), 4) if len(latencies) > 0 else 0,
+        "errors": errors,
+        "consistency": _consistency(clients, items),
+        "server_metrics": metrics,
+    }
+
+# ============================================================
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Generate concurrent websocket load against the server")
+    parser.add_argument("--uri", default="ws://localhost:4000", help="Server to connect to (ws://localhost:4000)")
+    parser.add_argument("--clients", type=int, default=5, help="Concurrent clients (5)")
+    parser.add_argument("--requests", type=int, default=20, help="Requests sent by each client (20)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted command mix ("+DEFAULT_MIX+")")
+    parser.add_argument("--list", default=None, help="Alexa list to use (the server's default)")
+    parser.add_argument("--reconnect", action="store_true", help="Open a new connection for every request, like home assistant")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed, to replay the same run")
+    parser.add_argument("--max-error-rate", type=float, default=0, help="Exit with an error above this error rate (0)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    weights = _parse_mix(args.mix)
+    clients = [LoadClient(number, args.uri, args.list, args.reconnect) for number in range(args.clients)]
+    plans = [random.choices(list(weights.keys()), list(weights.values()), k=args.requests) for client in clients]
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client.run(plan) for client, plan in zip(clients, plans)])
+    seconds = time.perf_counter() - started
+
+    items, metrics = await _final_list(args.uri, args.list)
+    report = _report(clients, seconds, items, metrics)
+    print(json.dumps(report, indent=2))
+
+    # Usable as a gate, fail when the list is wrong or too many requests failed
+    if report['consistency']['ok'] == False or report['error_rate'] > args.max_error_rate:
+        sys.exit(1)
+
+# ============================================================
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
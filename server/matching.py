@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import re
+import unicodedata
+
+# Decides when two item names mean the same item, so "Milk", "milk " and "milk"
+# aren't added to a list three times. Names are reduced to a key and an index
+# maps each key back to the names on the list, so lookups don't walk the list.
+#
+# The integration keeps an identical copy of this module, change both together.
+
+DEFAULT_RULES = {
+    "casefold": True,
+    "collapse_whitespace": True,
+    "strip_plurals": False,
+    "strip_quantities": False,
+    # Extra [pattern, replacement] regular expressions, applied last
+    "replacements": [],
+}
+
+# "2 milk", "2x milk", "2 x milk"
+LEADING_QUANTITY = re.compile(r"^\d+(?:[.,]\d+)?\s*(?:x|×)?\s+", re.IGNORECASE)
+# "milk 2", "milk x2", "milk (2)"
+TRAILING_QUANTITY = re.compile(r"\s+\(?\s*(?:x|×)?\s*\d+(?:[.,]\d+)?\s*\)?$", re.IGNORECASE)
+
+# ============================================================
+
+
+def _singular(word):
+    # Plain english endings only, anything unusual is left as it is
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3]+"y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes", "zes", "oes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+class ItemMatcher:
+    """Reduces item names to the key they are matched on"""
+
+    def __init__(self, rules: dict = None):
+        self.rules = {**DEFAULT_RULES, **(rules or {})}
+        self._replacements = [
+            (re.compile(pattern), replacement) for pattern, replacement in self.rules['replacements']
+        ]
+
+
+    def key(self, name: str):
+        key = unicodedata.normalize("NFKC", name)
+        if self.rules['casefold']:
+            key = key.casefold()
+        if self.rules['collapse_whitespace']:
+            key = " ".join(key.split())
+
+        if self.rules['strip_quantities']:
+            stripped = TRAILING_QUANTITY.sub("", LEADING_QUANTITY.sub("", key))
+            if stripped != "":
+                key = stripped
+
+        if self.rules['strip_plurals'] and key != "":
+            words = key.split(" ")
+            words[-1] = _singular(words[-1])
+            key = " ".join(words)
+
+        for pattern, replacement in self._replacements:
+            key = pattern.sub(replacement, key)
+        return key
+
+
+    def same(self, a: str, b: str):
+        return a == b or self.key(a) == self.key(b)
+
+
+    def index(self, items: list = ()):
+        return ItemIndex(self, items)
+
+
+class ItemIndex:
+    """The names on a list grouped by their key, in list order"""
+
+    def __init__(self, matcher: ItemMatcher, items: list = ()):
+        self.matcher = matcher
+        self._names = {}
+        for item in items:
+            self.add(item)
+
+
+    def add(self, item: str):
+        self._names.setdefault(self.matcher.key(item), []).append(item)
+
+
+    def remove(self, item: str):
+        key = self.matcher.key(item)
+        names = self._names.get(key, [])
+        if item in names:
+            names.remove(item)
+        if len(names) == 0:
+            self._names.pop(key, None)
+
+
+    def find(self, name: str):
+        """The name on the list matching name, preferring an exact match, or None"""
+        names = self._names.get(self.matcher.key(name))
+        if names == None:
+            return None
+        return name if name in names else names[0]
+
+
+    def __contains__(self, name: str):
+        return self.matcher.key(name) in self._names
+
+
+    def __len__(self):
+        return sum(len(names) for names in self._names.values())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import threading
+import time
+
+# A sampling profiler for the running server. While active a background thread
+# snapshots the stacks of the chosen threads every few milliseconds, nothing is
+# hooked in when it is not running. Stacks are written in the folded format read
+# by flamegraph.pl and speedscope: "thread;outer;inner count".
+
+DEFAULT_INTERVAL_MS = 5
+# Anything shorter and the sampler would spin, starving the threads it watches
+MIN_INTERVAL_MS = 1
+
+# ============================================================
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return code.co_name+" ("+os.path.basename(code.co_filename)+":"+str(code.co_firstlineno)+")"
+
+
+class StackSampler:
+    """Counts how often each stack is seen on the threads whose names match the prefixes"""
+
+    def __init__(self, thread_prefixes: tuple = ("MainThread",), interval_ms: int = DEFAULT_INTERVAL_MS):
+        self.thread_prefixes = thread_prefixes
+        self.interval = max(interval_ms, MIN_INTERVAL_MS) / 1000
+        self.samples = 0
+        self.started = None
+        self.stopped = None
+        self._stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        if self._thread != None:
+            self._thread.join()
+        self.stopped = time.time()
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, "")
+                if not name.startswith(self.thread_prefixes):
+                    continue
+
+                stack = []
+                while frame != None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                key = ";".join([name] + stack[::-1])
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+            self.samples += 1
+
+    # ============================================================
+    # Results
+
+
+    def folded(self):
+        return "\n".join(stack+" "+str(count) for stack, count in sorted(self._stacks.items()))+"\n"
+
+
+    def top(self, count: int = 15):
+        # Where the samples landed, counting only the innermost frame of each stack
+        leaves = {}
+        for stack, samples in self._stacks.items():
+            parts = stack.split(";")
+            leaf = parts[0]+": "+parts[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + samples
+
+        ordered = sorted(leaves.items(), key=lambda leaf: leaf[1], reverse=True)[:count]
+        return [{"frame": leaf, "samples": samples} for leaf, samples in ordered]
+
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "profile-"+time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))+".folded")
+        with open(path, 'w') as file:
+            file.write(self.folded())
+        return path
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SYNC = 1
+PRIORITY_HOUSEKEEPING = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_SYNC: "sync",
+    PRIORITY_HOUSEKEEPING: "housekeeping",
+}
+
+METRIC_SAMPLES = 200
+
+
+class QueueFull(Exception):
+    """Raised by submit when admission control turns a job away"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server busy")
+        self.retry_after = retry_after
+
+
+class BrowserScheduler:
+    """Runs browser jobs one at a time, most urgent first"""
+
+    def __init__(self, max_depth: int = 10, max_preemptions: int = 3, preempted_exceptions: tuple = ()):
+        self.max_depth = max_depth
+        self.max_preemptions = max_preemptions
+        self._preempted_exceptions = preempted_exceptions
+        self._queue = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._running = None
+        self._worker = None
+        self._metrics = {
+            priority: {"jobs": 0, "preempted": 0, "rejected": 0, "waits": deque(maxlen=METRIC_SAMPLES), "runs": deque(maxlen=METRIC_SAMPLES)}
+            for priority in PRIORITY_NAMES
+        }
+
+    # ============================================================
+    # Jobs
+
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+
+    def stop(self):
+        if self._worker != None:
+            self._worker.cancel()
+
+
+    def pending(self):
+        return len(self._queue)
+
+
+    async def submit(self, priority: int, job, preemptible: bool = False, admit: bool = False):
+        """Queue a job and wait for its result. Admitted jobs skip the queue depth limit"""
+        if len(self._queue) >= self.max_depth and admit == False:
+            self._metrics[priority]['rejected'] += 1
+            raise QueueFull(self._retry_after())
+
+        entry = {
+            "priority": priority,
+            "job": job,
+            "preemptible": preemptible,
+            "preemptions": 0,
+            "queued": time.monotonic(),
+            "future": asyncio.get_running_loop().create_future(),
+        }
+        heapq.heappush(self._queue, (priority, next(self._sequence), entry))
+        self._wakeup.set()
+        return await entry['future']
+
+
+    def should_yield(self):
+        """Called by a running job between steps, true when something more urgent is waiting"""
+        running = self._running
+        if running == None or running['preemptible'] == False:
+            return False
+        if running['preemptions'] >= self.max_preemptions:
+            return False
+
+        queue = self._queue
+        return len(queue) > 0 and queue[0][0] < running['priority']
+
+
+    async def _run(self):
+        while True:
+            if len(self._queue) == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            priority, sequence, entry = heapq.heappop(self._queue)
+            started = time.monotonic()
+            if entry['preemptions'] == 0:
+                self._metrics[priority]['waits'].append(started - entry['queued'])
+
+            self._running = entry
+            try:
+                result = await entry['job']()
+            except self._preempted_exceptions:
+                # Put it back in its original place, ahead of anything queued after it
+                entry['preemptions'] += 1
+                self._metrics[priority]['preempted'] += 1
+                heapq.heappush(self._queue, (priority, sequence, entry))
+                continue
+            except Exception as e:
+                entry['future'].set_exception(e)
+            else:
+                entry['future'].set_result(result)
+            finally:
+                self._running = None
+                self._metrics[priority]['runs'].append(time.monotonic() - started)
+
+            self._metrics[priority]['jobs'] += 1
+
+    # ============================================================
+    # Metrics
+
+
+    def _retry_after(self):
+        runs = [run for metrics in self._metrics.values() for run in metrics['runs']]
+        average = sum(runs) / len(runs) if len(runs) > 0 else 30
+        return max(1, int(average * (len(self._queue) + 1)))
+
+
+    def _summary(self, samples):
+        if len(samples) == 0:
+            return {"avg": None, "p95": None, "max": None}
+        ordered = sorted(samples)
+        return {
+            "avg": round(sum(ordered) / len(ordered), 3),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            "max": round(ordered[-1], 3),
+        }
+
+
+    def metrics(self):
+        return {
+            "queued": len(self._queue),
+            "running": PRIORITY_NAMES[self._running['priority']] if self._running != None else None,
+            "priorities": {
+                PRIORITY_NAMES[priority]: {
+                    "jobs": metrics['jobs'],
+                    "preempted": metrics['preempted'],
+                    "rejected": metrics['rejected'],
+                    "queue_seconds": self._summary(metrics['waits']),
+                    "run_seconds": self._summary(metrics['runs']),
+                }
+                for priority, metrics in self._metrics.items()
+            }
+        }
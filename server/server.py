@@ -2,17 +2,68 @@
 
 import asyncio
 import websockets
-import json
 import signal
 import os
-from alexa import AlexaShoppingList
+import inspect
+import functools
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from alexa import AlexaShoppingList, DEFAULT_LIST, ScrapePreempted
+from list_payload import record_titles
+from matching import ItemMatcher
+from chrome_profile import ChromeProfile
+from lease import Lease, DEFAULT_TTL
+from store import Store, DATABASE_FILE
+from wire import encode, decode, encodings
+from profiler import StackSampler, DEFAULT_INTERVAL_MS, MIN_INTERVAL_MS
+from scheduler import BrowserScheduler, QueueFull, PRIORITY_INTERACTIVE, PRIORITY_SYNC, PRIORITY_HOUSEKEEPING, PRIORITY_NAMES
 import time
 
 clients = set()
+client_encodings = {}
+# Connections that asked for pushed events, older clients would read one as the response
+event_clients = set()
 
 alexa_running = False
 alexa = None
 
+scheduler = None
+
+# Selenium blocks, so it gets a thread of its own to leave the event loop free to queue jobs
+browser_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="browser")
+
+active_profile = None
+
+# Only used in ha_mode, where several instances share one config directory
+lease = None
+ha_state = {"role": "leader"}
+
+# What a standby still answers, everything else is left to the leader
+STANDBY_COMMANDS = ["hello", "ping", "config_valid", "config_get", "metrics", "profile"]
+STANDBY_ERROR = "Standby server"
+
+# A timed profile can't run for longer than this
+MAX_PROFILE_SECONDS = 600
+
+list_cache = {}
+
+# Config, cookies and list snapshots, kept in the config directory
+store = None
+
+# Config values that change often, written with the next batch rather than straight away
+DEFERRED_CONFIG_KEYS = ["auth_checked_time"]
+STORE_FLUSH_SECONDS = 5
+
+session_state = {"authenticated": None, "checked": 0, "expires": None}
+
+PROTOCOL_VERSION = 1
+
+# Optional features a client can check for in the hello response before relying on them
+CAPABILITIES = ["lists", "get_lists", "max_age", "events", "priority", "metrics", "reset_profile", "profile", "failover", "detailed"]
+
+# Amazon's sign-in tokens, these are what end the session when they expire
+AUTH_COOKIE_PREFIXES = ("at-", "sess-at-", "x-", "session-token")
+
 # ============================================================
 # Helpers
 
@@ -20,6 +71,12 @@ alexa = None
 def _time_now():
     return int(time.time())
 
+
+def _list_name(args):
+    if args != None and args.get('list') not in [None, ""]:
+        return args['list']
+    return DEFAULT_LIST
+
 # ============================================================
 # Config
 
@@ -32,39 +89,68 @@ def _config_path():
 
 
 def _load_config():
-    global config
-    if os.path.exists(os.path.join(_config_path(), 'config.json')):
-        with open(os.path.join(_config_path(), 'config.json'), 'r') as file:
-            config = json.load(file)
-            return
-    config = {}
-
+    global store
+    if store == None:
+        store = Store(os.path.join(_config_path(), DATABASE_FILE))
+    else:
+        # Pick up whatever other server instances wrote
+        store.reload()
 
-def _save_config():
-    with open(os.path.join(_config_path(), 'config.json'), 'w') as file:
-        json.dump(config, file)
+    # Files from older versions, or dropped in by hand, are moved into the store
+    if store.migrate_json(os.path.join(_config_path(), 'config.json'), "config"):
+        print("\nMigrated config.json")
+    if store.migrate_json(os.path.join(_config_path(), 'cookies.json'), "session", "cookies"):
+        print("\nMigrated cookies.json")
 
 
 def _get_config_value(key, default=None):
-    if key in config.keys():
-        return config[key]
-    return default
+    return store.get("config", key, default)
 
 
 def _set_config_value(key, new_value=None):
     print("\nSet config value `"+key+"` = "+str(new_value))
-    global config
-    if new_value != None:
-        config[key] = new_value
-    else:
-        del config[key]
-    _save_config()
+    store.set("config", key, new_value, defer=key in DEFERRED_CONFIG_KEYS)
+
+
+async def _store_flusher():
+    while True:
+        await asyncio.sleep(STORE_FLUSH_SECONDS)
+        try:
+            store.flush()
+        except Exception as e:
+            print("\nFailed to write the store: "+str(e))
 
 
 async def _cmd_config_valid():
-    return os.path.exists(
-        os.path.join(_config_path(), 'config.json')
-    ), None
+    return store.has("config"), None
+
+
+async def _cmd_hello(args=None):
+    # Everything here comes from memory, so it never waits on the browser
+    authenticated = session_state['authenticated']
+    checked = session_state['checked']
+    if authenticated == None and _time_now() - _get_config_value('auth_checked_time', 0) < 86400:
+        authenticated = True
+        checked = _get_config_value('auth_checked_time', 0)
+
+    return {
+        "protocol": PROTOCOL_VERSION,
+        "capabilities": CAPABILITIES + _wire_capabilities(),
+        "encodings": encodings(),
+        "config_valid": (await _cmd_config_valid())[0],
+        "authenticated": authenticated,
+        # A check time from a clock that ran ahead would otherwise give a negative age
+        "auth_age": max(0, _time_now() - checked) if checked > 0 else None,
+        "auth_expires": session_state['expires'],
+        "lists": {name: entry['version'] for name, entry in list_cache.items()},
+        "role": ha_state['role'],
+        "load": {
+            "queued": scheduler.pending(),
+            "running": scheduler.metrics()['running'],
+            "browser_running": alexa_running,
+            "clients": len(clients)
+        }
+    }, None
 
 
 async def _cmd_config_set(args):
@@ -75,117 +161,573 @@ async def _cmd_config_set(args):
 async def _cmd_config_get(args):
     return _get_config_value(args['key']), None
 
+
+def _profile_path():
+    # Instances sharing a config directory can't share one chrome profile
+    if _get_config_value("ha_mode", False):
+        return os.path.join(_config_path(), "chrome-profile-"+_instance_id())
+    return os.path.join(_config_path(), "chrome-profile")
+
+
+def _instance_id():
+    return os.environ.get("ASL_INSTANCE_ID", socket.gethostname()+"-"+str(os.getpid()))
+
+
+def _compression():
+    # permessage-deflate, only used when the client offers it too
+    if _get_config_value("compression", "deflate") == "none":
+        return None
+    return "deflate"
+
+
+def _wire_capabilities():
+    capabilities = ["msgpack"] if "msgpack" in encodings() else []
+    if _compression() != None:
+        capabilities.append("deflate")
+    return capabilities
+
+
+def _listen_port():
+    return int(os.environ.get("ASL_LISTEN_PORT", _get_config_value('listen_port', 4000)))
+
 # ============================================================
 # Alexa
 
 
-def _start_alexa():
+def _create_alexa():
+    backend = _get_config_value("browser_backend", "selenium")
+
+    if backend == "fake":
+        # In-memory list for load testing, see loadgen.py
+        from alexa_fake import FakeAlexaShoppingList
+        return FakeAlexaShoppingList(
+            int(_get_config_value("fake_latency_ms", 200)),
+            int(_get_config_value("fake_scroll_latency_ms", 20))
+        )
+
+    if backend == "playwright":
+        # Optional dependency, only needed when this backend is selected
+        from alexa_playwright import AsyncAlexaShoppingList
+        return AsyncAlexaShoppingList(
+            _get_config_value("amazon_url", "amazon.co.uk"),
+            _config_path(),
+            _get_config_value("network_capture", False),
+            cdp_url=_get_config_value("cdp_url", os.environ.get("ASL_CDP_URL", "")),
+            session_store=store
+        )
+
+    return AlexaShoppingList(
+        _get_config_value("amazon_url", "amazon.co.uk"),
+        _config_path(),
+        _get_config_value("network_capture", False),
+        profile_path=_profile_path() if _get_config_value("persistent_profile", False) else "",
+        profile_max_mb=int(_get_config_value("profile_max_mb", 500)),
+        remote_url=_get_config_value("remote_webdriver_url", os.environ.get("ASL_REMOTE_WEBDRIVER_URL", "")),
+        debugger_address=_get_config_value("debugger_address", os.environ.get("ASL_DEBUGGER_ADDRESS", "")),
+        session_store=store
+    )
+
+
+async def _browser(method, *args):
+    # The selenium backend is synchronous, the playwright one runs in our event loop
+    if inspect.iscoroutinefunction(method):
+        return await method(*args)
+    return await asyncio.get_running_loop().run_in_executor(browser_executor, functools.partial(method, *args))
+
+
+async def _start_alexa():
     global alexa
     global alexa_running
 
+    # A kept remote session can be ended from the other side, e.g. by a grid's idle timeout
+    if alexa_running == True and await _browser(alexa.session_alive) == False:
+        print("\nBrowser session was lost, starting a new one")
+        await _stop_alexa(True)
+
     if alexa_running == False:
-        alexa = AlexaShoppingList(
-            _get_config_value("amazon_url", "amazon.co.uk"),
-            _config_path()
-        )
+        alexa = await _browser(_create_alexa)
+        if hasattr(alexa, "start"):
+            await alexa.start()
+        alexa.should_yield = scheduler.should_yield
+        alexa.matcher = ItemMatcher(_get_config_value("matching"))
         alexa_running = True
     
     return alexa
 
 
-def _stop_alexa():
+async def _stop_alexa(force=False):
     global alexa
     global alexa_running
 
+    # Keep the browser warm for whatever is queued next
+    if scheduler.pending() > 0 and force == False:
+        return
+
+    # A remote session is cheap to hold and slow to recreate, so it is kept between jobs
+    if alexa_running == True and alexa.is_remote() and force == False:
+        return
+
     if alexa_running == True:
+        await _browser(alexa.close)
         del alexa
     
     alexa = None
     alexa_running = False
 
+# ============================================================
+# Scheduling
+
+
+async def _schedule(args, priority, job, preemptible=False):
+    # Callers can ask for a different priority, e.g. a sync wanting to go ahead of housekeeping
+    requested = args.get('priority') if args != None else None
+    for value, name in PRIORITY_NAMES.items():
+        if requested == name:
+            priority = value
+    return await scheduler.submit(priority, job, preemptible)
+
+# ============================================================
+# List cache
+
+
+def _cache_list(list_name, items=None, records=None, full=False):
+    # Reads bring the full item records, mutations only the titles
+    if records != None:
+        items = record_titles(records)
+    if items == None:
+        return items
+
+    entry = list_cache.get(list_name)
+    if entry == None or entry['items'] != items or (records != None and entry['records'] not in [None, records]):
+        list_cache[list_name] = {
+            "items": items,
+            "records": records,
+            "version": entry['version'] + 1 if entry != None else 1,
+            "updated": _time_now(),
+            "full_read": entry.get('full_read', 0) if entry != None else 0
+        }
+    else:
+        if records != None:
+            entry['records'] = records
+        entry['updated'] = _time_now()
+    if full:
+        list_cache[list_name]['full_read'] = _time_now()
+    store.set("lists", list_name, list_cache[list_name], defer=True)
+    return items
+
+
+def _load_list_cache():
+    # Snapshots from before a restart, or from the previous leader
+    list_cache.clear()
+    list_cache.update(store.values("lists"))
+
+
+def _cached_list_is_fresh(list_name, max_age, detailed=False):
+    if max_age == None or list_name not in list_cache:
+        return False
+    if detailed and list_cache[list_name]['records'] == None:
+        # Only the titles are known since the last change
+        return False
+    return _time_now() - list_cache[list_name]['updated'] <= max_age
+
+
+def _cached_list_entry(list_name, detailed=False):
+    hidden = ['full_read'] if detailed else ['records', 'full_read']
+    return {key: value for key, value in list_cache[list_name].items() if key not in hidden}
+
+
+def _known_records(list_name):
+    # What an incremental read can stop at. Removals below the point it stops are only
+    # seen by a full read, so every so often a read has to be a full one
+    entry = list_cache.get(list_name)
+    if not _get_config_value("incremental_reads", True) or entry == None or entry['records'] == None:
+        return None
+    if _time_now() - entry.get('full_read', 0) > int(_get_config_value("full_read_mins", 60)) * 60:
+        return None
+    return entry['records']
+
+
+def _detailed(args):
+    return args != None and args.get('detailed') == True
+
+# ============================================================
+# Session
+
+
+def _session_known_expired():
+    # Once the refresher has seen the session die there's no point starting the browser
+    return session_state['authenticated'] == False
+
+
+def _session_expiry():
+    cookies = store.load_cookies()
+    if cookies == None:
+        return None
+
+    expiries = [cookie['expiry'] for cookie in cookies if 'expiry' in cookie and cookie['name'].startswith(AUTH_COOKIE_PREFIXES)]
+    if len(expiries) == 0:
+        expiries = [cookie['expiry'] for cookie in cookies if 'expiry' in cookie]
+    if len(expiries) == 0:
+        return None
+    return int(min(expiries))
+
+
+async def _broadcast(event, **data):
+    for websocket in list(event_clients):
+        try:
+            await websocket.send(encode({"event": event, **data}, client_encodings.get(websocket, "json")))
+        except websockets.ConnectionClosed:
+            clients.discard(websocket)
+            event_clients.discard(websocket)
+
+
+async def _refresh_session():
+    if store.get("session", "cookies") == None:
+        return
+
+    instance = await _start_alexa()
+    authenticated = await _browser(instance.refresh_session)
+    await _stop_alexa()
+
+    session_state.update(authenticated=authenticated, checked=_time_now(), expires=_session_expiry())
+    if authenticated:
+        _set_config_value("auth_checked_time", _time_now())
+    else:
+        _set_config_value("auth_checked_time", 0)
+        print("\nAmazon session has expired")
+        await _broadcast("auth_expired")
+        return
+
+    warn_seconds = int(_get_config_value("auth_warning_hours", 48)) * 3600
+    expires = session_state['expires']
+    if expires != None and expires - _time_now() < warn_seconds:
+        print("\nAmazon session expires at "+str(expires))
+        await _broadcast("auth_expiring", expires=expires, seconds_left=expires - _time_now())
+
+
+async def _session_refresher():
+    while True:
+        await asyncio.sleep(int(_get_config_value("session_refresh_mins", 360)) * 60)
+
+        # The leader looks after the session, a standby would only fight it over the cookies
+        if ha_state['role'] != "leader":
+            continue
+
+        try:
+            await scheduler.submit(PRIORITY_HOUSEKEEPING, _refresh_session)
+        except QueueFull:
+            # Leave it for the next round rather than add to a backlog
+            continue
+        except Exception as e:
+            print("\nSession refresh failed: "+str(e))
+
 # ============================================================
 # API
 
 
-async def _cmd_reset():
-    purge_files = ['config.json', 'cookies.json']
-    for filename in purge_files:
-        file_path = os.path.join(_config_path(), filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    
-    _load_config()
+def _wipe_profile():
+    if not os.path.exists(_profile_path()):
+        return True, None
+
+    profile = ChromeProfile(_profile_path())
+    if profile.acquire() == False:
+        return None, "Chrome profile is in use"
+    profile.reset()
+    profile.release()
     return True, None
 
 
-async def _cmd_is_authenticated():
-    recent = _get_config_value('auth_checked_time', 0)
-    time_diff = _time_now() - recent
+async def _cmd_reset(args=None):
+    # Queued like any browser job, so it can't pull the browser out from under a scrape
+    async def job():
+        # A kept remote browser would otherwise carry on with the old session
+        await _stop_alexa(True)
 
-    if time_diff < 86400:
-        return True, None
+        # Leftovers from older versions would only be migrated straight back in
+        purge_files = ['config.json', 'cookies.json']
+        for filename in purge_files:
+            file_path = os.path.join(_config_path(), filename)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        store.clear(["config", "session", "lists"])
+
+        list_cache.clear()
+        session_state.update(authenticated=None, checked=0, expires=None)
+
+        # The saved profile holds the amazon session as well
+        return _wipe_profile()
+
+    return await _schedule(args, PRIORITY_INTERACTIVE, job)
 
-    instance = _start_alexa()
 
-    if instance.requires_login() == True:
+async def _cmd_reset_profile(args=None):
+    async def job():
+        # Chrome has to be gone before its profile can be wiped
+        await _stop_alexa(True)
+        return _wipe_profile()
+
+    return await _schedule(args, PRIORITY_INTERACTIVE, job)
+
+
+async def _check_authentication():
+    instance = await _start_alexa()
+
+    if await _browser(instance.requires_login) == True:
         print("\nAuthenticated: No")
+        session_state.update(authenticated=False, checked=_time_now())
         result = False, None
     else:
         print("\nAuthenticated: Yes")
         _set_config_value("auth_checked_time", _time_now())
+        session_state.update(authenticated=True, checked=_time_now())
         result = True, None
     
-    _stop_alexa()
+    await _stop_alexa()
     return result
 
 
+async def _cmd_is_authenticated(args=None):
+    if _session_known_expired():
+        return False, None
+
+    recent = _get_config_value('auth_checked_time', 0)
+    time_diff = _time_now() - recent
+
+    if time_diff < 86400:
+        return True, None
+
+    return await _schedule(args, PRIORITY_HOUSEKEEPING, _check_authentication)
+
+
 async def _cmd_login(args):
     print("\nAttempting login...")
 
-    with open(os.path.join(_config_path(), 'cookies.json'), 'w') as file:
-        json.dump(args['session'], file)
+    store.save_cookies(args['session'])
 
-    return await _cmd_is_authenticated()
+    # A new session has to be checked properly, not taken from the last check
+    _set_config_value("auth_checked_time", 0)
+    session_state.update(authenticated=None, expires=_session_expiry())
+    # Someone is waiting on this one, so it goes ahead of routine housekeeping
+    return await _cmd_is_authenticated({"priority": "interactive"})
 
 
-async def _cmd_get_shopping_list():
-    instance = _start_alexa()
-    if instance.requires_login():
-        result =  None, "Not authenticated"
-    else:
-        result = instance.get_alexa_list(), None
-    _stop_alexa()
-    return result
+async def _cmd_get_lists_available(args=None):
+    if _session_known_expired():
+        return None, "Not authenticated"
+
+    async def job():
+        instance = await _start_alexa()
+        if await _browser(instance.requires_login):
+            result = None, "Not authenticated"
+        else:
+            result = await _browser(instance.get_alexa_lists), None
+        await _stop_alexa()
+        return result
+
+    return await _schedule(args, PRIORITY_SYNC, job)
+
+
+async def _cmd_get_lists(args):
+    if _session_known_expired():
+        return None, "Not authenticated"
+
+    requested = args.get('lists') if args != None else None
+    max_age = args.get('max_age') if args != None else None
+    detailed = _detailed(args)
+
+    if requested == None or len(requested) == 0:
+        requested = [DEFAULT_LIST]
+
+    # Only start the browser when at least one list is stale, then read
+    # every stale list with that same session
+    async def job():
+        stale = [name for name in requested if not _cached_list_is_fresh(name, max_age, detailed)]
+        if len(stale) == 0:
+            # Another job refreshed them while this one was queued
+            await _stop_alexa()
+            return None
+        instance = await _start_alexa()
+        if await _browser(instance.requires_login):
+            await _stop_alexa()
+            return "Not authenticated"
+
+        for name in stale:
+            if await _browser(instance.has_alexa_list, name) == False:
+                await _stop_alexa()
+                return "Unknown list `"+name+"`"
+
+        known = {name: _known_records(name) for name in stale}
+        for name, records in (await _browser(instance.read_alexa_lists, stale, True, known)).items():
+            _cache_list(name, records=records, full=known[name] == None)
+        await _stop_alexa()
+        return None
+
+    if not all(_cached_list_is_fresh(name, max_age, detailed) for name in requested):
+        error = await _schedule(args, PRIORITY_SYNC, job, preemptible=True)
+        if error != None:
+            return None, error
+
+    return {name: _cached_list_entry(name, detailed) for name in requested}, None
+
+
+async def _list_job(args, priority, method, *method_args, preemptible=False, read=False):
+    if _session_known_expired():
+        return None, "Not authenticated"
+    list_name = _list_name(args)
+
+    async def job():
+        instance = await _start_alexa()
+        if await _browser(instance.requires_login):
+            result =  None, "Not authenticated"
+        elif await _browser(instance.has_alexa_list, list_name) == False:
+            result = None, "Unknown list `"+list_name+"`"
+        elif read:
+            # Reads always take the full records, whichever form was asked for
+            known = _known_records(list_name)
+            records = await _browser(getattr(instance, method), *method_args, list_name, True, known)
+            items = _cache_list(list_name, records=records, full=known == None)
+            result = (records if _detailed(args) else items), None
+        else:
+            result = _cache_list(list_name, await _browser(getattr(instance, method), *method_args, list_name)), None
+        await _stop_alexa()
+        return result
+
+    return await _schedule(args, priority, job, preemptible)
+
+
+async def _cmd_get_shopping_list(args):
+    # Long scrapes give way to single item changes between scroll steps
+    return await _list_job(args, PRIORITY_SYNC, "get_alexa_list", True, preemptible=True, read=True)
 
 
 async def _cmd_get_add_shopping_list_item(args):
-    instance = _start_alexa()
-    if instance.requires_login():
-        result =  None, "Not authenticated"
-    else:
-        result = instance.add_alexa_list_item(args['item']), None
-    _stop_alexa()
-    return result
+    return await _list_job(args, PRIORITY_INTERACTIVE, "add_alexa_list_item", args['item'])
 
 
 async def _cmd_get_update_shopping_list_item(args):
-    instance = _start_alexa()
-    if instance.requires_login():
-        result =  None, "Not authenticated"
-    else:
-        result = instance.update_alexa_list_item(args['old'], args['new']), None
-    _stop_alexa()
-    return result
+    return await _list_job(args, PRIORITY_INTERACTIVE, "update_alexa_list_item", args['old'], args['new'])
 
 
 async def _cmd_get_remove_shopping_list_item(args):
-    instance = _start_alexa()
-    if instance.requires_login():
-        result =  None, "Not authenticated"
-    else:
-        result = instance.remove_alexa_list_item(args['item']), None
-    _stop_alexa()
-    return result
+    return await _list_job(args, PRIORITY_INTERACTIVE, "remove_alexa_list_item", args['item'])
+
+
+async def _cmd_metrics():
+    return scheduler.metrics(), None
+
+# ============================================================
+# Profiling
+
+
+def _start_profile(args):
+    global active_profile
+    sampler = StackSampler(("MainThread", "browser"), int(args.get('interval_ms', DEFAULT_INTERVAL_MS)))
+    sampler.start()
+    active_profile = {"sampler": sampler, "commands_left": args.get('commands')}
+
+
+def _finish_profile():
+    global active_profile
+    sampler = active_profile['sampler']
+    active_profile = None
+    sampler.stop()
+
+    return {
+        "path": sampler.save(os.path.join(_config_path(), "profiles")),
+        "seconds": round(sampler.stopped - sampler.started, 3),
+        "samples": sampler.samples,
+        "top": sampler.top(),
+    }
+
+
+async def _count_profiled_command():
+    if active_profile == None or active_profile['commands_left'] == None:
+        return
+
+    active_profile['commands_left'] -= 1
+    if active_profile['commands_left'] <= 0:
+        await _broadcast("profile_saved", **_finish_profile())
+
+
+async def _cmd_profile(args):
+    """Profile for {"seconds": n}, or for the next {"commands": n}, or {"stop": true} early"""
+    args = args or {}
+
+    if args.get('stop') == True:
+        if active_profile == None:
+            return None, "No profile running"
+        return _finish_profile(), None
+
+    if active_profile != None:
+        return None, "A profile is already running"
+
+    if float(args.get('interval_ms', DEFAULT_INTERVAL_MS)) < MIN_INTERVAL_MS:
+        return None, "interval_ms must be at least "+str(MIN_INTERVAL_MS)
+
+    if args.get('commands') != None:
+        _start_profile(args)
+        return {"profiling": True, "commands": args['commands']}, None
+
+    seconds = min(float(args.get('seconds', 10)), MAX_PROFILE_SECONDS)
+    _start_profile(args)
+    await asyncio.sleep(seconds)
+    if active_profile == None:
+        return None, "Profile was stopped early"
+    return _finish_profile(), None
+
+# ============================================================
+# Failover
+
+
+async def _prewarm_standby_browser():
+    # Have chrome up and signed in ready for a takeover, without ever saving its session
+    instance = await _start_alexa()
+    instance.save_sessions = False
+
+
+async def _become_leader():
+    print("\nTaking over as the leader")
+    ha_state['role'] = "leader"
+
+    # The old leader may have changed all of this while we were waiting
+    _load_config()
+    _load_list_cache()
+    session_state.update(authenticated=None, checked=0, expires=_session_expiry())
+
+    if alexa_running:
+        alexa.save_sessions = True
+        await _browser(alexa.reload_session)
+    await _broadcast("leader", instance=_instance_id())
+
+
+async def _become_standby():
+    print("\nNo longer the leader, standing by")
+    ha_state['role'] = "standby"
+    if alexa_running:
+        # Whoever holds the lease now owns the saved session
+        alexa.save_sessions = False
+
+    # Queued like any browser job, so a running job finishes before its driver is quit
+    async def job():
+        await _stop_alexa(True)
+
+    await scheduler.submit(PRIORITY_INTERACTIVE, job, admit=True)
+
+
+async def _lease_keeper():
+    while True:
+        try:
+            if ha_state['role'] == "leader":
+                if await asyncio.to_thread(lease.renew) == False:
+                    await _become_standby()
+            elif await asyncio.to_thread(lease.acquire):
+                await _become_leader()
+            elif _get_config_value("ha_prewarm", True) and alexa_running == False:
+                await _prewarm_standby_browser()
+        except Exception as e:
+            print("\nLease check failed: "+str(e))
+
+        await asyncio.sleep(lease.ttl / 3)
 
 # ============================================================
 # Main handler
@@ -193,6 +735,14 @@ async def _cmd_get_remove_shopping_list_item(args):
 
 async def _route_command(command, arguments={}):
 
+    if ha_state['role'] != "leader" and command not in STANDBY_COMMANDS:
+        holder = lease.holder() if lease != None else None
+        return None, STANDBY_ERROR+(", the leader is "+str(holder['endpoint']) if holder != None else "")
+
+    # Handshake
+    if command == "hello":
+        return await _cmd_hello(arguments)
+
     # Config
     if command == "config_valid":
         return await _cmd_config_valid()
@@ -201,19 +751,25 @@ async def _route_command(command, arguments={}):
     if command == "config_get":
         return await _cmd_config_get(arguments)
     if command == "reset":
-        return await _cmd_reset()
+        return await _cmd_reset(arguments)
+    if command == "reset_profile":
+        return await _cmd_reset_profile(arguments)
     
     # Authentication
     if command == "authenticated":
-        return await _cmd_is_authenticated()
+        return await _cmd_is_authenticated(arguments)
     if command == "login":
         return await _cmd_login(arguments)
     if command == "mfa":
         return await _cmd_mfa(arguments)
     
     # Shopping list
+    if command == "lists":
+        return await _cmd_get_lists_available(arguments)
+    if command == "get_lists":
+        return await _cmd_get_lists(arguments)
     if command == "get_list":
-        return await _cmd_get_shopping_list()
+        return await _cmd_get_shopping_list(arguments)
     if command == "add_item":
         return await _cmd_get_add_shopping_list_item(arguments)
     if command == "update_item":
@@ -224,6 +780,10 @@ async def _route_command(command, arguments={}):
     # Misc
     if command == "ping":
         return "pong", None
+    if command == "metrics":
+        return await _cmd_metrics()
+    if command == "profile":
+        return await _cmd_profile(arguments)
     if command == "shutdown":
         await _shutdown_server()
 
@@ -234,14 +794,25 @@ async def _process_command(websocket, path):
     async for message in websocket:
         # try:
 
-        data = json.loads(message)
+        try:
+            data, encoding = decode(message)
+        except ValueError as e:
+            await websocket.send(encode({"result": None, "error": str(e)}))
+            continue
+        client_encodings[websocket] = encoding
+        if data.get('events') == True:
+            event_clients.add(websocket)
         command = data.get('command')
         arguments = data.get('args')
 
         response = {"result": None, "error": None}
-        results = await _route_command(command, arguments)
+        try:
+            results = await _route_command(command, arguments)
+        except QueueFull as e:
+            await websocket.send(encode({"result": None, "error": "Server busy", "retry_after": e.retry_after}, encoding))
+            continue
 
-        if len(results) == 2:
+        if results != None and len(results) == 2:
             response = {
                 "result": results[0],
                 "error": results[1]
@@ -254,9 +825,14 @@ async def _process_command(websocket, path):
         # except:
         #     response = {'error': 'Fatal exception'}
 
-        await websocket.send(json.dumps(response))
+        await websocket.send(encode(response, encoding))
+
+        if command != "profile":
+            await _count_profiled_command()
     # finally:
     clients.remove(websocket)
+    client_encodings.pop(websocket, None)
+    event_clients.discard(websocket)
 
 # ============================================================
 # Start/Stop
@@ -276,16 +852,50 @@ def _signal_handler(sig, frame):
 
 async def main():
     _load_config()
+    _load_list_cache()
 
     global server
+    global scheduler
+    scheduler = BrowserScheduler(
+        max_depth=int(_get_config_value('max_queue_depth', 10)),
+        preempted_exceptions=(ScrapePreempted,)
+    )
+    scheduler.start()
+
     listen_addr = None
-    listen_port = int(_get_config_value('listen_port', 4000))
-    server = await websockets.serve(_process_command, listen_addr, listen_port)
+    listen_port = _listen_port()
+    server = await websockets.serve(_process_command, listen_addr, listen_port, compression=_compression())
 
     print("Alexa Shopping List server started on port "+str(listen_port))
 
+    session_state['expires'] = _session_expiry()
+    refresher = asyncio.create_task(_session_refresher())
+    flusher = asyncio.create_task(_store_flusher())
+
+    keeper = None
+    if _get_config_value("ha_mode", False):
+        global lease
+        lease = Lease(
+            os.path.join(_config_path(), "leader.lease"),
+            _instance_id(),
+            int(_get_config_value("ha_lease_seconds", DEFAULT_TTL)),
+            os.environ.get("ASL_ENDPOINT", socket.gethostname()+":"+str(listen_port))
+        )
+        # Everyone starts as a standby, the keeper promotes us once the lease is ours
+        ha_state['role'] = "standby"
+        keeper = asyncio.create_task(_lease_keeper())
+        print("High availability mode, instance "+_instance_id())
+
     signal.signal(signal.SIGINT, _signal_handler)
     await server.wait_closed()
+    refresher.cancel()
+    await _stop_alexa(True)
+    scheduler.stop()
+    if keeper != None:
+        keeper.cancel()
+        lease.release()
+    flusher.cancel()
+    store.close()
 
 # ============================================================
 
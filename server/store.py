@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Everything the server keeps between runs, in one SQLite database in WAL mode:
+# the config, the amazon session cookies, list snapshots and a little metadata.
+# Reads come from memory. Writes go straight through in one transaction each,
+# or are deferred and committed together by flush(), for values that change
+# often and wouldn't be missed after a crash.
+
+DATABASE_FILE = "asl.db"
+SCHEMA_VERSION = 1
+
+NAMESPACES = ["config", "session", "lists", "meta"]
+
+# ============================================================
+
+
+class Store:
+    """Key value store over SQLite, one table row per namespace and key"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # The selenium backend saves cookies from its own thread
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated INTEGER NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._pending = {}
+        self._values = {namespace: {} for namespace in NAMESPACES}
+        self.reload()
+        if self.get("meta", "schema") == None:
+            self.set("meta", "schema", SCHEMA_VERSION)
+
+    # ============================================================
+    # Helpers
+
+
+    def _transaction(self, statements):
+        # Every statement lands together or not at all
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                for statement, parameters in statements:
+                    self._connection.execute(statement, parameters)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+
+    def _upsert(self, namespace, key, value):
+        return (
+            "INSERT INTO entries (namespace, key, value, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+            (namespace, key, json.dumps(value), int(time.time()))
+        )
+
+
+    def _delete(self, namespace, key):
+        return "DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+
+    # ============================================================
+    # Reads
+
+
+    def reload(self):
+        """Read everything again, picking up what other server instances wrote"""
+        with self._lock:
+            rows = self._connection.execute("SELECT namespace, key, value FROM entries").fetchall()
+        values = {namespace: {} for namespace in NAMESPACES}
+        for namespace, key, value in rows:
+            values.setdefault(namespace, {})[key] = json.loads(value)
+        # Deferred writes haven't reached the database yet, they still win
+        for (namespace, key), value in self._pending.items():
+            if value == None:
+                values[namespace].pop(key, None)
+            else:
+                values[namespace][key] = value
+        self._values = values
+
+
+    def load(self, namespace: str, key: str, default=None):
+        """Read a single value from the database rather than memory"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if (namespace, key) in self._pending:
+            return self.get(namespace, key, default)
+        if row == None:
+            self._values[namespace].pop(key, None)
+            return default
+        self._values[namespace][key] = json.loads(row[0])
+        return self._values[namespace][key]
+
+
+    def get(self, namespace: str, key: str, default=None):
+        return self._values[namespace].get(key, default)
+
+
+    def values(self, namespace: str):
+        return dict(self._values[namespace])
+
+
+    def has(self, namespace: str):
+        return len(self._values[namespace]) > 0
+
+    # ============================================================
+    # Writes
+
+
+    def set(self, namespace: str, key: str, value, defer: bool = False):
+        """Store a value, None removes it. Deferred values are written by the next flush"""
+        if value == None:
+            self._values[namespace].pop(key, None)
+        else:
+            self._values[namespace][key] = value
+
+        if defer:
+            self._pending[(namespace, key)] = value
+            return
+        self._pending.pop((namespace, key), None)
+        self._transaction([self._delete(namespace, key) if value == None else self._upsert(namespace, key, value)])
+
+
+    def flush(self):
+        """Commit every deferred write in a single transaction"""
+        pending = self._pending
+        if len(pending) == 0:
+            return
+        self._pending = {}
+        self._transaction([
+            self._delete(namespace, key) if value == None else self._upsert(namespace, key, value)
+            for (namespace, key), value in pending.items()
+        ])
+
+
+    def clear(self, namespaces: list):
+        """Forget whole namespaces in one transaction"""
+        self._pending = {
+            (namespace, key): value for (namespace, key), value in self._pending.items() if namespace not in namespaces
+        }
+        self._transaction([("DELETE FROM entries WHERE namespace = ?", (namespace,)) for namespace in namespaces])
+        for namespace in namespaces:
+            self._values[namespace] = {}
+
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    # ============================================================
+    # Session cookies
+
+
+    def load_cookies(self):
+        # Always from the database, another instance may have refreshed them
+        return self.load("session", "cookies")
+
+
+    def save_cookies(self, cookies: list):
+        # Most teardowns hand back the same cookies, there's no need to write them again
+        if cookies != self.get("session", "cookies"):
+            self.set("session", "cookies", cookies)
+
+    # ============================================================
+    # Migration
+
+
+    def migrate_json(self, json_path: str, namespace: str, key: str = None):
+        """Import a JSON file written by an older server, then move it aside
+
+        The whole object is spread over the namespace, or stored as one value under key"""
+        if not os.path.exists(json_path):
+            return False
+        try:
+            with open(json_path, 'r') as file:
+                data = json.load(file)
+        except ValueError:
+            # Half written by a crash, there's nothing in it worth keeping
+            os.replace(json_path, json_path+".corrupt")
+            return False
+
+        items = data.items() if key == None else [(key, data)]
+        self._transaction([self._upsert(namespace, name, value) for name, value in items] + [
+            self._upsert("meta", "migrated:"+os.path.basename(json_path), int(time.time())),
+            self._upsert("meta", "schema", SCHEMA_VERSION),
+        ])
+        for name, value in items:
+            self._values[namespace][name] = value
+        self._values["meta"]["migrated:"+os.path.basename(json_path)] = int(time.time())
+        os.replace(json_path, json_path+".migrated")
+        return True
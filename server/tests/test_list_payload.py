@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from list_payload import LIST_PAYLOAD_URL, parse_list_records, parse_list_payload, merge_list_records
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r') as file:
+        return json.load(file)
+
+
+class ListPayloadTest(unittest.TestCase):
+
+    def test_records_from_captured_response(self):
+        records = parse_list_records(_fixture("getlistitems.json"))
+        self.assertEqual(records, [
+            {"title": "Milk", "completed": False, "quantity": "2", "id": "4f6a1c2e-0001"},
+            {"title": "Bread", "completed": True, "quantity": None, "id": "4f6a1c2e-0002"},
+            {"title": "Milk", "completed": False, "quantity": None, "id": "4f6a1c2e-0004"},
+            {"title": "Washing up liquid", "completed": False, "quantity": None, "id": "4f6a1c2e-0005"},
+        ])
+
+
+    def test_titles_from_captured_response(self):
+        self.assertEqual(parse_list_payload(_fixture("getlistitems.json")), ["Milk", "Bread", "Washing up liquid"])
+
+
+    def test_empty_list(self):
+        self.assertEqual(parse_list_records({"shopping": {"listItems": []}}), [])
+
+
+    def test_other_payloads_are_not_lists(self):
+        # List names and sections have names too, but no completed flag
+        self.assertEqual(parse_list_records({"lists": [{"name": "Shopping List", "listId": "1"}]}), None)
+        self.assertEqual(parse_list_records({"settings": _fixture("getlistitems.json")["settings"]}), None)
+        self.assertEqual(parse_list_records([{"value": "Milk", "completed": False}]), None)
+
+
+    def test_merge_skips_payloads_without_a_list(self):
+        payloads = [{"lists": []}, _fixture("getlistitems.json")]
+        self.assertEqual(len(merge_list_records(payloads)), 4)
+        self.assertEqual(merge_list_records([{"lists": []}]), None)
+
+
+    def test_only_the_items_endpoint_is_captured(self):
+        self.assertTrue(LIST_PAYLOAD_URL.search("https://www.amazon.co.uk/alexashoppinglists/api/getlistitems"))
+        self.assertTrue(LIST_PAYLOAD_URL.search("https://www.amazon.com/alexashoppinglists/api/v2/lists/abc/items/fetch?limit=100"))
+        self.assertFalse(LIST_PAYLOAD_URL.search("https://www.amazon.co.uk/alexashoppinglists/api/updatelistitem"))
+        self.assertFalse(LIST_PAYLOAD_URL.search("https://www.amazon.co.uk/alexashoppinglists/api/getlists"))
+        self.assertFalse(LIST_PAYLOAD_URL.search("https://www.amazon.co.uk/gp/wishlist/itemlist"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import json
+
+# How messages are put on the websocket. JSON text frames are the default and what
+# the CLI speaks; a client that sends MessagePack binary frames gets them back.
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# ============================================================
+
+
+def encodings():
+    if msgpack == None:
+        return ["json"]
+    return ["json", "msgpack"]
+
+
+def encode(message, encoding: str = "json"):
+    if encoding == "msgpack":
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message)
+
+
+def decode(frame):
+    """Return the message in a frame, and the encoding it arrived in"""
+    if isinstance(frame, bytes):
+        if msgpack == None:
+            raise ValueError("MessagePack is not installed on this server")
+        return msgpack.unpackb(frame, raw=False), "msgpack"
+    return json.loads(frame), "json"
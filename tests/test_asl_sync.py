@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+# The integration's __init__ needs Home Assistant, the sync itself doesn't
+COMPONENT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "custom_components", "alexa_shopping_list")
+package = types.ModuleType("alexa_shopping_list")
+package.__path__ = [COMPONENT]
+sys.modules.setdefault("alexa_shopping_list", package)
+
+from alexa_shopping_list.asl import AlexaShoppingListSync
+
+
+class FakeServer:
+    """Answers the integration's commands from a list, like the server with the fake backend"""
+
+    def __init__(self, items):
+        self.items = list(items)
+        # Commands that fail as if the server couldn't be reached
+        self.unreachable = []
+
+
+    async def send(self, command, **kwargs):
+        if command in self.unreachable:
+            raise OSError("Connection refused")
+        if command == "get_list":
+            return {"result": list(self.items), "error": None}
+        if command == "add_item":
+            if kwargs['item'] not in self.items:
+                self.items.insert(0, kwargs['item'])
+        elif command == "remove_item":
+            if kwargs['item'] in self.items:
+                self.items.remove(kwargs['item'])
+        elif command == "update_item":
+            if kwargs['old'] not in self.items:
+                return {"result": None, "error": None}
+            self.items[self.items.index(kwargs['old'])] = kwargs['new']
+        return {"result": list(self.items), "error": None}
+
+
+class SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.hasl_path = os.path.join(self.path, ".shopping_list.json")
+        self.server = FakeServer(["Milk"])
+        self.conflicts = []
+
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+
+    def _sync(self):
+        async def refresh():
+            pass
+
+        async def conflict(data):
+            self.conflicts.append(data)
+
+        sync = AlexaShoppingListSync(hasl_path=self.hasl_path, hasl_refresh=refresh, on_conflict=conflict)
+        sync._send_command = self.server.send
+        return sync
+
+
+    def _write_ha_list(self, items):
+        with open(self.hasl_path, 'w') as file:
+            json.dump(items, file)
+
+
+    def _read_ha_list(self):
+        with open(self.hasl_path, 'r') as file:
+            return json.load(file)
+
+
+    def test_new_ha_items_keep_their_ids(self):
+        self._write_ha_list([
+            {"id": "h1", "name": "Milk", "complete": False},
+            {"id": "h2", "name": "Bread", "complete": False},
+            {"id": "h3", "name": "eggs", "complete": False},
+            {"id": "h4", "name": "Jam", "complete": False},
+        ])
+        sync = self._sync()
+        asyncio.run(sync.sync(None, True))
+
+        self.assertEqual(sorted(self.server.items), ["Bread", "Jam", "Milk", "eggs"])
+        ids = {item['name']: item['id'] for item in self._read_ha_list()}
+        self.assertEqual(ids, {"Milk": ids["Milk"], "Bread": "h2", "eggs": "h3", "Jam": "h4"})
+        self.assertEqual(dict((name, ha_id) for ha_id, name in sync.item_ids()), ids)
+
+
+    def test_failed_sync_leaves_nothing_pending(self):
+        self._write_ha_list([
+            {"id": "h1", "name": "Milk", "complete": False},
+            {"id": "h2", "name": "Eggs", "complete": False},
+        ])
+        sync = self._sync()
+        self.server.unreachable = ["add_item"]
+        with self.assertRaises(OSError):
+            asyncio.run(sync.sync(None, True))
+
+        self.assertEqual(sync.pending_operations, 0)
+        self.assertEqual(sync.items, ["Milk"])
+
+        # The next sync isn't blocked, and still adds what the failed one couldn't
+        self.server.unreachable = []
+        asyncio.run(sync.sync(None, True))
+        self.assertEqual(self.server.items, ["Eggs", "Milk"])
+        self.assertEqual({item['name']: item['id'] for item in self._read_ha_list()}["Eggs"], "h2")
+
+
+    def test_rename_of_missing_item_is_a_conflict(self):
+        sync = self._sync()
+        asyncio.run(sync._get_list(True))
+        ha_id = sync.item_ids()[0][0]
+
+        # Gone from Alexa since the last read
+        self.server.items = []
+        asyncio.run(sync.update_item(ha_id, "Oat milk"))
+
+        self.assertEqual(sync.items, ["Milk"])
+        self.assertEqual(sync.item_ids(), [(ha_id, "Milk")])
+        self.assertEqual([conflict['error'] for conflict in self.conflicts], ["Item not found"])
+
+
+if __name__ == "__main__":
+    unittest.main()